@@ -0,0 +1,179 @@
+# ==============================================================================
+# admission.py - CONTROL DE ADMISIÓN Y DESCARTE DE CARGA DELANTE DEL RUNNER ADK
+# ==============================================================================
+"""
+Limita cuántos turnos corren a la vez contra el modelo. Los que no caben esperan
+en una cola acotada ordenada por prioridad de fase: un cliente que está dando su
+dirección o cerrando el pedido pasa antes que un saludo nuevo. Si la cola está
+llena o la espera supera ADMISSION_MAX_QUEUE_S, el turno se descarta y el
+usuario recibe una respuesta enlatada inmediata.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_TURNS = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "16"))
+MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+MAX_QUEUE_S = float(os.environ.get("ADMISSION_MAX_QUEUE_S", "8"))
+
+# Menor número = más prioridad. Las fases finales no deben perder el pedido.
+PHASE_PRIORITY: Dict[str, int] = {
+    'E_FINALIZAR_PEDIDO': 0,
+    'D_RECOGER_DIRECCION': 0,
+    'C_CONFIRMACION_PEDIDO': 1,
+    'B_TOMA_ITEMS': 2,
+    'A_GESTION_CLIENTE': 3,
+    'A_STANDBY': 3,
+}
+DEFAULT_PRIORITY = 3
+
+SHED_REPLIES = {
+    'A_GESTION_CLIENTE': "¡Hola! 😊 Tenemos muchos pedidos en este momento. Escríbeme de nuevo en un minuto y te atiendo.",
+    'A_STANDBY': "¡Hola! 😊 Tenemos muchos pedidos en este momento. Escríbeme de nuevo en un minuto y te atiendo.",
+}
+DEFAULT_SHED_REPLY = "Tenemos mucha demanda en este momento 🙏 Tu pedido sigue guardado; escríbeme de nuevo en unos segundos."
+
+ADMISSION_ACTIVE = metrics.REGISTRY.gauge("pizzeria_admission_active_turns", "Turnos ejecutándose contra el runner ADK.")
+ADMISSION_QUEUED = metrics.REGISTRY.gauge("pizzeria_admission_queued_turns", "Turnos esperando turno de admisión.")
+ADMISSION_WAIT = metrics.REGISTRY.histogram(
+    "pizzeria_admission_wait_seconds", "Espera en la cola de admisión por prioridad.", ["priority"]
+)
+ADMISSION_SHED_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_admission_shed_total", "Turnos descartados por fase y motivo.", ["phase", "reason"]
+)
+
+
+def priority_for_phase(phase: Optional[str]) -> int:
+    return PHASE_PRIORITY.get(phase or '', DEFAULT_PRIORITY)
+
+
+def shed_reply(phase: Optional[str]) -> str:
+    return SHED_REPLIES.get(phase or '', DEFAULT_SHED_REPLY)
+
+
+class Shed(Exception):
+    """El turno no fue admitido."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Semáforo con cola de espera acotada y prioridades; el cupo se entrega directamente al siguiente."""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TURNS, max_queue: int = MAX_QUEUE, max_queue_s: float = MAX_QUEUE_S):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_s = max_queue_s
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _update_gauges(self) -> None:
+        ADMISSION_ACTIVE.set(self._active)
+        ADMISSION_QUEUED.set(self._queued())
+
+    def _queued(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+
+    async def acquire(self, priority: int) -> float:
+        """Espera un cupo. Devuelve los segundos esperados o lanza Shed."""
+        if self._active < self.max_concurrent and not self._queued():
+            self._active += 1
+            self._update_gauges()
+            return 0.0
+
+        if self._queued() >= self.max_queue:
+            # Cola llena: si el recién llegado es más prioritario, se descarta al peor en espera.
+            worst = max((entry for entry in self._waiters if not entry[2].done()), default=None)
+            if worst is None or worst[0] <= priority:
+                raise Shed("queue_full")
+            worst[2].set_exception(Shed("evicted"))
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self._update_gauges()
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_queue_s)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # El cupo llegó justo al vencer la espera: lo aceptamos.
+                return time.monotonic() - started_at
+            waiter.cancel()
+            raise Shed("queue_timeout") from None
+        except asyncio.CancelledError:
+            # Si el cupo ya nos fue entregado hay que devolverlo; si no, que release() nos salte.
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            self._update_gauges()
+        waited = time.monotonic() - started_at
+        ADMISSION_WAIT.observe(waited, priority=str(priority))
+        return waited
+
+    def release(self) -> None:
+        """Libera un cupo, o se lo pasa al siguiente en espera de mayor prioridad."""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(True) # El cupo pasa al que espera: _active no cambia.
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def admit(self, phase: Optional[str]) -> AsyncIterator[float]:
+        """Contexto que ocupa un cupo durante el turno. Lanza Shed si no se admite."""
+        priority = priority_for_phase(phase)
+        try:
+            waited = await self.acquire(priority)
+        except Shed as shed:
+            ADMISSION_SHED_TOTAL.inc(phase=phase or 'none', reason=shed.reason)
+            logger.warning(f"🚦 Turno descartado (fase '{phase}', motivo '{shed.reason}'). Activos: {self._active}, en cola: {self._queued()}.")
+            raise
+        try:
+            yield waited
+        finally:
+            self.release()
+
+
+class KeyedLocks:
+    """Un asyncio.Lock por clave (usuario, sesión...); se borra cuando nadie lo usa."""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+ADMISSION = AdmissionController()
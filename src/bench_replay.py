@@ -0,0 +1,310 @@
+# ==============================================================================
+# bench_replay.py - BENCHMARK END-TO-END OFFLINE DEL ORQUESTADOR
+# ==============================================================================
+"""
+Reproduce guiones de conversación (saludo -> pedido -> confirmación -> dirección ->
+registro) contra RootOrchestratorAgent con un modelo guionado y determinista y una
+hoja de cálculo en memoria, para N usuarios simultáneos. No usa Gemini ni Google Sheets.
+
+Uso (desde src/):
+    python bench_replay.py --users 50 --model-latency-ms 300 --sheets-latency-ms 80
+    python bench_replay.py --scripts mis_guiones.json --output resultados.json
+
+Formato de --scripts: {"nombre": {"returning": true|false, "turns": ["hola", ...]}, ...}
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCRIPTS: Dict[str, Dict[str, Any]] = {
+    "cliente_nuevo": {
+        "returning": False,
+        "turns": ["hola", "Juan Pérez", "quiero una pizza americana familiar", "eso es todo", "sí, confirmo", "Av. Los Olivos 123"],
+    },
+    "cliente_frecuente": {
+        "returning": True,
+        "turns": ["hola", "una pizza jamon grande", "eso es todo", "sí, confirmo", "Calle Lima 456"],
+    },
+}
+
+_CONFIRM_WORDS = ('sí', 'si', 'confirmo', 'correcto')
+_FINISH_WORDS = ('eso es todo', 'nada más', 'nada mas', 'es todo')
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _looks_like_address(text: str) -> bool:
+    return len(text) >= 5 and bool(re.search(r'\d', text)) and bool(re.search(r'[a-zA-Z]', text))
+
+
+def _match_menu_item(text: str) -> Optional[str]:
+    """Devuelve el nombre del plato cuyo nombre o alias aparece en el texto (el más largo gana)."""
+    from menu_cache import get_menu_items
+    text_lower = text.lower()
+    best, best_len = None, 0
+    for item in get_menu_items():
+        for candidate in (item.name.lower(),) + item.aliases:
+            if candidate and candidate in text_lower and len(candidate) > best_len:
+                best, best_len = item.name, len(candidate)
+    return best
+
+
+def classify(text: str) -> str:
+    """Clasificador por palabras clave que imita al IntentClassifierAgent."""
+    lowered = text.strip().lower()
+    if lowered in ('hola', 'buenas', 'buenas tardes', 'buenas noches', 'hola!'):
+        return 'GREETING'
+    if any(word in lowered for word in _FINISH_WORDS):
+        return 'FINALIZE_ORDER'
+    if 'horario' in lowered or 'hora' in lowered:
+        return 'ASK_SCHEDULE'
+    if _match_menu_item(text):
+        return 'TAKE_ORDER'
+    if _looks_like_address(text):
+        return 'GIVE_ADDRESS'
+    if any(lowered.startswith(word) for word in _CONFIRM_WORDS):
+        return 'CONFIRM_ORDER'
+    if re.fullmatch(r"[a-záéíóúñ]+( [a-záéíóúñ]+){1,3}", lowered):
+        return 'PROVIDE_NAME'
+    return 'CONTINUE_CONVERSATION'
+
+
+def build_scripted_llm_class():
+    """Se construye en una función para importar ADK solo cuando se ejecuta el benchmark."""
+    from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+    from google.genai import types as genai_types
+
+    def _last_customer_text(llm_request: LlmRequest) -> str:
+        for content in reversed(llm_request.contents or []):
+            if content.role != 'user':
+                continue
+            texts = [part.text for part in content.parts or [] if part.text]
+            if texts and not texts[0].startswith('For context:'):
+                return " ".join(texts)
+        return ""
+
+    def _last_function_response(llm_request: LlmRequest):
+        if not llm_request.contents:
+            return None
+        for part in llm_request.contents[-1].parts or []:
+            if part.function_response:
+                return part.function_response
+        return None
+
+    def _instruction(llm_request: LlmRequest) -> str:
+        config = llm_request.config
+        return str(getattr(config, 'system_instruction', None) or '') if config else ''
+
+    def _call(name: str, **args) -> genai_types.Part:
+        return genai_types.Part(function_call=genai_types.FunctionCall(name=name, args=args))
+
+    def _text(text: str) -> genai_types.Part:
+        return genai_types.Part(text=text)
+
+    def scripted_reply(agent_name: str, llm_request: LlmRequest) -> genai_types.Part:
+        user_text = _last_customer_text(llm_request)
+        last_response = _last_function_response(llm_request)
+        response = dict(last_response.response or {}) if last_response else {}
+
+        if agent_name == 'IntentClassifierAgent':
+            return _text(json.dumps({"intent": classify(user_text)}))
+
+        if agent_name == 'CustomerManagementAgent':
+            if last_response and last_response.name == 'get_initial_customer_context':
+                if response.get('status') == 'found':
+                    name = (response.get('customer_data') or {}).get('Nombre', '')
+                    return _text(f"¡Hola, {name}! Qué bueno verte de nuevo 😊 ¿Listo para pedir? 🍕")
+                return _text("¡Hola! Bienvenido(a) a Pizzería San Marzano 😊. ¿Me podrías dar tu nombre completo?")
+            if last_response:
+                return _text("¡Gracias!")
+            if classify(user_text) == 'PROVIDE_NAME':
+                return _call('register_update_customer', datos_cliente={'nombre': user_text})
+            if "`_customer_status`: not_found" in _instruction(llm_request):
+                # El estado ya viene en la instrucción: no hace falta la herramienta.
+                return _text("¡Hola! Bienvenido(a) a Pizzería San Marzano 😊. ¿Me podrías dar tu nombre completo?")
+            return _call('get_initial_customer_context')
+
+        if agent_name == 'OrderTakingAgent':
+            if last_response:
+                return _text(response.get('message') or "¿Algo más?")
+            if any(word in user_text.lower() for word in _FINISH_WORDS):
+                return _call('finalize_order_taking')
+            item = _match_menu_item(user_text)
+            if item:
+                return _call('manage_order_item', action='add', item_name=item, quantity=1)
+            return _text("¿Qué te gustaría pedir? 🍕")
+
+        if agent_name == 'OrderConfirmationAgent':
+            if last_response and last_response.name == 'calculate_order_total':
+                return _text(f"Tu pedido: {response.get('calculation_string', '')}. ¿Es correcto tu pedido?")
+            if last_response:
+                return _text("")
+            if classify(user_text) == 'CONFIRM_ORDER':
+                return _call('update_session_state', data_to_update={'_order_confirmed': True})
+            return _call('calculate_order_total')
+
+        if agent_name == 'AddressCollectionAgent':
+            if last_response:
+                return _text("")
+            if _looks_like_address(user_text):
+                return _call('save_delivery_address', direccion=user_text)
+            return _text("¿A qué dirección te gustaría que enviemos tu pedido?")
+
+        if agent_name == 'FinalizationAgent':
+            if last_response:
+                return _text(response.get('message') or "Pedido registrado.")
+            return _call('registrar_pedido_finalizado')
+
+        if agent_name == 'GeneralInquiryAgent':
+            if last_response:
+                return _text(response.get('info_value') or response.get('message') or "")
+            return _call('get_general_info', info_key='horario')
+
+        return _text("")
+
+    class ScriptedLlm(BaseLlm):
+        """Modelo determinista: decide la respuesta según el agente y el último contenido."""
+        agent_name: str
+        latency_s: float = 0.0
+        calls: int = 0
+
+        async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+            self.calls += 1
+            if self.latency_s:
+                await asyncio.sleep(self.latency_s)
+            part = scripted_reply(self.agent_name, llm_request)
+            prompt_chars = sum(len(p.text or '') for c in llm_request.contents or [] for p in c.parts or [])
+            yield LlmResponse(
+                content=genai_types.Content(role='model', parts=[part]),
+                usage_metadata=genai_types.GenerateContentResponseUsageMetadata(
+                    prompt_token_count=prompt_chars // 4,
+                    candidates_token_count=len(part.text or '') // 4 + (8 if part.function_call else 0),
+                ),
+            )
+
+    return ScriptedLlm
+
+
+async def _simulate_user(runner, user_id: str, turns: List[str], think_time_s: float, latencies: List[float], results: Dict[str, int]) -> None:
+    from turn_processing import ensure_session, run_turn
+    user_id_adk, session_id_adk = await ensure_session(runner.session_service, runner.app_name, user_id)
+    for text in turns:
+        started_at = time.perf_counter()
+        result = await run_turn(runner, user_id_adk, session_id_adk, text)
+        latencies.append(time.perf_counter() - started_at)
+        results[result.outcome] = results.get(result.outcome, 0) + 1
+        if think_time_s:
+            await asyncio.sleep(think_time_s)
+
+
+async def run_benchmark(users: int, scripts: Dict[str, Dict[str, Any]], model_latency_s: float, sheets_latency_s: float, think_time_s: float) -> Dict[str, Any]:
+    os.chdir(SRC_DIR) # menu.json y demás rutas relativas, igual que en producción
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+
+    import pizzeria_agents
+    from google.adk.runners import Runner
+    from google.adk.sessions import InMemorySessionService
+    from bench_support import FakeSheets, install_fake_sheets, install_temp_order_files
+
+    fake_sheets = FakeSheets(latency_s=sheets_latency_s)
+    install_fake_sheets(fake_sheets)
+    scratch_dir = tempfile.TemporaryDirectory(prefix="pizzeria-bench-") # Archivos locales de los pedidos simulados.
+    install_temp_order_files(scratch_dir.name)
+
+    ScriptedLlm = build_scripted_llm_class()
+    scripted_models = []
+    for agent in pizzeria_agents.root_agent.sub_agents:
+        model = ScriptedLlm(model=f"scripted-{agent.name}", agent_name=agent.name, latency_s=model_latency_s)
+        agent.model = model
+        scripted_models.append(model)
+
+    runner = Runner(agent=pizzeria_agents.root_agent, app_name="PizzeriaBench", session_service=InMemorySessionService())
+
+    script_names = list(scripts)
+    assignments = []
+    for index in range(users):
+        script = scripts[script_names[index % len(script_names)]]
+        user_id = f"bench-{index}"
+        if script.get("returning"):
+            fake_sheets.seed_customer(user_id, f"Cliente {index}", "Av. Benchmark 100")
+        assignments.append((user_id, script["turns"]))
+
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+    started_at = time.perf_counter()
+    await asyncio.gather(*(
+        _simulate_user(runner, user_id, turns, think_time_s, latencies, outcomes) for user_id, turns in assignments
+    ))
+    elapsed = time.perf_counter() - started_at
+    scratch_dir.cleanup()
+
+    total_turns = len(latencies)
+    model_calls = sum(model.calls for model in scripted_models)
+    orders = fake_sheets.calls.get('Pedidos_Registrados.append_row', 0)
+    return {
+        "users": users,
+        "turns": total_turns,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(total_turns / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p95": round(_percentile(latencies, 95) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+            "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        },
+        "model_calls_per_turn": round(model_calls / total_turns, 2) if total_turns else 0.0,
+        "model_calls_by_agent": {model.agent_name: model.calls for model in scripted_models},
+        "orders_committed": orders,
+        "sheets_calls_per_order": round(fake_sheets.total_calls() / orders, 2) if orders else None,
+        "sheets_calls": dict(sorted(fake_sheets.calls.items())),
+        "outcomes": outcomes,
+        "config": {"model_latency_s": model_latency_s, "sheets_latency_s": sheets_latency_s, "think_time_s": think_time_s, "scripts": script_names},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end offline del orquestador de la pizzería.")
+    parser.add_argument("--users", type=int, default=20, help="Usuarios simulados en paralelo.")
+    parser.add_argument("--scripts", help="JSON con guiones de conversación (por defecto, los incluidos).")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="Latencia simulada por llamada al modelo.")
+    parser.add_argument("--sheets-latency-ms", type=float, default=0.0, help="Latencia simulada por llamada a Sheets.")
+    parser.add_argument("--think-time-ms", type=float, default=0.0, help="Pausa del usuario entre mensajes.")
+    parser.add_argument("--output", help="Ruta donde guardar el resultado en JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Mantiene los logs INFO del bot.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, force=True)
+    scripts = DEFAULT_SCRIPTS
+    if args.scripts:
+        with open(args.scripts, 'r', encoding='utf-8') as f:
+            scripts = json.load(f)
+
+    result = asyncio.run(run_benchmark(
+        args.users, scripts, args.model_latency_ms / 1000, args.sheets_latency_ms / 1000, args.think_time_ms / 1000
+    ))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
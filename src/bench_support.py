@@ -0,0 +1,147 @@
+# ==============================================================================
+# bench_support.py - DOBLES EN MEMORIA PARA BENCHMARKS (SHEETS, TOOLCONTEXT)
+# ==============================================================================
+"""
+Piezas compartidas por bench_replay.py y bench_tools.py. Nada de esto se usa en
+producción: solo sustituye Google Sheets y el ToolContext de ADK por versiones
+deterministas en memoria para poder medir sin red.
+"""
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# Encabezados tal como los escribe registrar_pedido_finalizado.
+SHEET_HEADERS: Dict[str, List[str]] = {
+    'Clientes': ['ID_Cliente', 'Nombre', 'Direccion_Predeterminada', 'Fecha_Registro', 'Fecha_Ultimo_Pedido'],
+    'Pedidos_Registrados': ['ID_Pedido', 'Fecha', 'ID_Cliente', 'Nombre', 'Items', 'Total', 'Direccion', 'Estado'],
+    'Configuracion': ['Clave', 'Valor'],
+    'Quejas': ['Fecha', 'ID_Cliente', 'Nombre', 'Queja'],
+}
+
+
+class FakeWorksheet:
+    """Subconjunto de gspread.Worksheet usado por las herramientas, con latencia simulada."""
+
+    def __init__(self, sheets: 'FakeSheets', title: str, headers: List[str]):
+        self._sheets = sheets
+        self.title = title
+        self._rows: List[List[Any]] = [list(headers)]
+
+    def _call(self, operation: str) -> None:
+        self._sheets.record_call(self.title, operation)
+
+    def row_values(self, row: int) -> List[Any]:
+        self._call('row_values')
+        return list(self._rows[row - 1]) if 0 < row <= len(self._rows) else []
+
+    def get_all_values(self) -> List[List[Any]]:
+        self._call('get_all_values')
+        return [list(row) for row in self._rows]
+
+    def get_all_records(self) -> List[Dict[str, Any]]:
+        self._call('get_all_records')
+        headers = self._rows[0]
+        return [dict(zip(headers, row)) for row in self._rows[1:]]
+
+    def find(self, query: Any, in_column: Optional[int] = None):
+        self._call('find')
+        for row_index, row in enumerate(self._rows, start=1):
+            columns = [in_column - 1] if in_column else range(len(row))
+            for col in columns:
+                if col < len(row) and str(row[col]) == str(query):
+                    return SimpleNamespace(row=row_index, col=col + 1, value=row[col])
+        return None
+
+    def update_cell(self, row: int, col: int, value: Any) -> None:
+        self._call('update_cell')
+        while len(self._rows) < row:
+            self._rows.append([])
+        target = self._rows[row - 1]
+        while len(target) < col:
+            target.append('')
+        target[col - 1] = value
+
+    def append_row(self, values: List[Any], **kwargs) -> None:
+        self._call('append_row')
+        self._rows.append(list(values))
+
+    def append_rows(self, values: List[List[Any]], **kwargs) -> None:
+        self._call('append_rows')
+        self._rows.extend(list(row) for row in values)
+
+
+class FakeSheets:
+    """Hoja de cálculo en memoria con contadores de llamadas por pestaña y operación."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.title = 'PizzeriaBotDB (fake)'
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.worksheets = {name: FakeWorksheet(self, name, headers) for name, headers in SHEET_HEADERS.items()}
+
+    def record_call(self, worksheet: str, operation: str) -> None:
+        with self._lock:
+            key = f"{worksheet}.{operation}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency_s:
+            # Las herramientas llaman a Sheets desde asyncio.to_thread: dormir aquí no bloquea el loop.
+            time.sleep(self.latency_s)
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def worksheet(self, name: str) -> Optional[FakeWorksheet]:
+        self.record_call(name, 'worksheet')
+        return self.worksheets.get(name)
+
+    def get_worksheet(self, name: str) -> Optional[FakeWorksheet]:
+        """Reemplazo directo de sheets_client.get_worksheet."""
+        return self.worksheet(name)
+
+    def seed_customer(self, user_id: str, name: str, address: str = '') -> None:
+        self.worksheets['Clientes']._rows.append([user_id, name, address, '2025-01-01 12:00:00', '2025-01-01 12:00:00'])
+
+
+def _replace_everywhere(name: str, replacement: Any) -> None:
+    """Sustituye la función 'name' en su módulo y en todos los que la importan por nombre."""
+    import sys
+    for module in list(sys.modules.values()):
+        if module is not None and getattr(module, name, None) is not None and module.__name__ != __name__:
+            setattr(module, name, replacement)
+
+
+def install_fake_sheets(fake: FakeSheets) -> None:
+    """
+    Sustituye get_worksheet en sheets_client y en todos los módulos que lo importan por nombre.
+    Debe llamarse después de importar esos módulos.
+    """
+    _replace_everywhere('get_worksheet', fake.get_worksheet)
+
+
+def install_temp_order_files(directory: str) -> None:
+    """
+    Los pedidos del benchmark van a un historial y un almacén columnar en 'directory', no a
+    order_history.jsonl ni a order_store/ reales (que alimentan repeat_previous_order y los
+    informes de ventas). Debe llamarse después de importar pizzeria_tools.
+    """
+    import os
+    from order_history import OrderHistoryIndex
+    from order_store import ColumnarOrderStore
+    history = OrderHistoryIndex(os.path.join(directory, 'order_history.jsonl'))
+    store = ColumnarOrderStore(os.path.join(directory, 'order_store'))
+    _replace_everywhere('get_history', lambda: history)
+    _replace_everywhere('get_store', lambda: store)
+
+
+class FakeToolContext:
+    """ToolContext mínimo: estado de sesión, acciones y los nombres que leen los callbacks."""
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None, agent_name: str = 'BenchAgent'):
+        self.state: Dict[str, Any] = state if state is not None else {}
+        self.actions = SimpleNamespace(skip_summarization=False, escalate=None)
+        self.agent_name = agent_name
+        self.function_call_id = None
+        self.invocation_id = 'bench'
@@ -0,0 +1,244 @@
+# ==============================================================================
+# bench_tools.py - MICRO-BENCHMARKS DE LAS HERRAMIENTAS CALIENTES DE pizzeria_tools
+# ==============================================================================
+"""
+Mide get_item_details_by_name, get_items_by_category, manage_order_item y
+calculate_order_total sobre menús sintéticos (10 a 100k ítems), carritos de
+distintos tamaños y consultas con errores de tipeo realistas.
+
+Uso (desde src/):
+    python bench_tools.py                               # tabla de ops/s y asignaciones
+    python bench_tools.py --sizes 10,1000,100000 --save-baseline
+    python bench_tools.py --compare --tolerance 0.25    # sale con código 1 si hay regresiones
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unicodedata
+from typing import Any, Callable, Dict, List
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(SRC_DIR, 'bench_baselines.json')
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+CART_SIZES = (1, 5, 20, 100)
+
+_CATEGORIES = ('Pizzas', 'Lasagnas', 'Bebidas', 'Postres', 'Entradas', 'Pastas', 'Ensaladas', 'Combos')
+_BASES = ('Americana', 'Jamón', 'Pepperoni', 'Hawaiana', 'Vegetariana', 'Suprema', 'Margarita', 'Cuatro Quesos',
+          'Carbonara', 'Bolognesa', 'Pollo BBQ', 'Mediterránea', 'Napolitana', 'Chorizo', 'Champiñones')
+_SIZES = ('Personal', 'Grande', 'Familiar')
+
+
+def generate_menu(n_items: int, seed: int = 7) -> Dict[str, Dict[str, Any]]:
+    """Menú sintético con el mismo formato que menu.json (diccionario por ID_Plato)."""
+    rng = random.Random(seed)
+    menu = {}
+    for index in range(n_items):
+        category = _CATEGORIES[index % len(_CATEGORIES)]
+        base = _BASES[(index // len(_CATEGORIES)) % len(_BASES)]
+        size = _SIZES[index % len(_SIZES)]
+        variant = index // (len(_CATEGORIES) * len(_BASES))
+        name = f"{category[:-1]} {base} {variant} - {size}" if variant else f"{category[:-1]} {base} - {size}"
+        plain = _strip_accents(name.lower())
+        menu[f"SYN{index:06d}"] = {
+            'Nombre_Plato': name,
+            'Alias': f"{plain.replace(' - ', ' ')}, {plain.split(' - ')[0]}",
+            'Descripcion_Plato': f"Descripción sintética del plato {index}.",
+            'Categoria': category,
+            'Precio': rng.choice((8, 12, 18, 24, 32, 39.9)),
+            'Ingredientes': 'Queso, Salsa',
+            'Disponible': 'Sí' if rng.random() > 0.05 else 'No',
+        }
+    return menu
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def misspell(text: str, rng: random.Random) -> str:
+    """Aplica un error típico de tipeo: letra omitida, duplicada, transpuesta o sin tildes."""
+    text = _strip_accents(text.lower())
+    if len(text) < 4:
+        return text
+    position = rng.randrange(1, len(text) - 2)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return text[:position] + text[position + 1:]
+    if kind == 1:
+        return text[:position] + text[position] + text[position:]
+    if kind == 2:
+        return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+    return text
+
+
+def build_queries(menu: Dict[str, Dict[str, Any]], count: int = 50, seed: int = 11) -> List[str]:
+    """Mezcla de consultas: nombre exacto, alias, fragmento (ambigua) y con error de tipeo."""
+    rng = random.Random(seed)
+    items = list(menu.values())
+    queries = []
+    for index in range(count):
+        item = rng.choice(items)
+        kind = index % 4
+        if kind == 0:
+            queries.append(item['Nombre_Plato'])
+        elif kind == 1:
+            queries.append(item['Alias'].split(',')[0])
+        elif kind == 2:
+            queries.append(item['Nombre_Plato'].split(' - ')[0])
+        else:
+            queries.append(misspell(item['Nombre_Plato'], rng))
+    return queries
+
+
+def build_cart(menu: Dict[str, Dict[str, Any]], size: int, seed: int = 13) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    items = list(menu.values())
+    cart = []
+    for _ in range(size):
+        item = rng.choice(items)
+        price = float(item['Precio'])
+        quantity = rng.randint(1, 3)
+        cart.append({"name": item['Nombre_Plato'], "quantity": quantity, "price": price, "subtotal": price * quantity})
+    return cart
+
+
+def _measure(run_once: Callable[[int], Any], min_time_s: float, max_iterations: int) -> Dict[str, float]:
+    """Ejecuta run_once(i) hasta min_time_s y luego una pasada con tracemalloc para las asignaciones."""
+    iterations = 0
+    started_at = time.perf_counter()
+    while iterations < max_iterations and (iterations < 3 or time.perf_counter() - started_at < min_time_s):
+        run_once(iterations)
+        iterations += 1
+    elapsed = time.perf_counter() - started_at
+
+    alloc_iterations = min(iterations, 20)
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for index in range(alloc_iterations):
+        run_once(index)
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+    allocated_blocks = sum(max(stat.count_diff, 0) for stat in stats)
+
+    return {
+        "ops_per_s": round(iterations / elapsed, 1) if elapsed else 0.0,
+        "us_per_op": round(elapsed / iterations * 1e6, 1) if iterations else 0.0,
+        "peak_kib": round(peak / 1024, 1),
+        "retained_blocks_per_op": round(allocated_blocks / alloc_iterations, 1) if alloc_iterations else 0.0,
+        "iterations": iterations,
+    }
+
+
+def run_suite(sizes: List[int], min_time_s: float, max_iterations: int) -> Dict[str, Dict[str, float]]:
+    os.chdir(SRC_DIR)
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    import menu_cache
+    import pizzeria_tools
+    from bench_support import FakeToolContext
+
+    loop = asyncio.new_event_loop()
+    results: Dict[str, Dict[str, float]] = {}
+
+    def run(coro_factory: Callable[[int], Any]) -> Callable[[int], Any]:
+        return lambda index: loop.run_until_complete(coro_factory(index))
+
+    for size in sizes:
+        menu = generate_menu(size)
+        menu_cache.set_menu_data(menu)
+        queries = build_queries(menu)
+        categories = sorted({item['Categoria'] for item in menu.values()})
+        names = [item['Nombre_Plato'] for item in menu.values()]
+
+        ctx = FakeToolContext()
+        results[f"get_item_details_by_name[menu={size}]"] = _measure(
+            run(lambda i: pizzeria_tools.get_item_details_by_name(ctx, queries[i % len(queries)])), min_time_s, max_iterations)
+        results[f"get_items_by_category[menu={size}]"] = _measure(
+            run(lambda i: pizzeria_tools.get_items_by_category(ctx, categories[i % len(categories)])), min_time_s, max_iterations)
+
+        for cart_size in CART_SIZES:
+            cart = build_cart(menu, cart_size)
+            cart_ctx = FakeToolContext()
+
+            def add_item(i, cart=cart, cart_ctx=cart_ctx):
+                cart_ctx.state['_current_order_items'] = list(cart)
+                return pizzeria_tools.manage_order_item(cart_ctx, 'add', names[i % len(names)], 1)
+
+            def total(i, cart=cart, cart_ctx=cart_ctx):
+                cart_ctx.state['_current_order_items'] = cart
+                return pizzeria_tools.calculate_order_total(cart_ctx)
+
+            results[f"manage_order_item[menu={size},cart={cart_size}]"] = _measure(run(add_item), min_time_s, max_iterations)
+            results[f"calculate_order_total[menu={size},cart={cart_size}]"] = _measure(run(total), min_time_s, max_iterations)
+
+    loop.close()
+    return results
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """Devuelve las mediciones cuyo ops/s cayó más de 'tolerance' (fracción) respecto al baseline."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("ops_per_s"):
+            continue
+        ratio = current["ops_per_s"] / previous["ops_per_s"]
+        if ratio < 1.0 - tolerance:
+            regressions.append(f"{name}: {previous['ops_per_s']} -> {current['ops_per_s']} ops/s ({ratio:.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de las herramientas de pizzeria_tools.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="Tamaños de menú separados por coma.")
+    parser.add_argument("--min-time", type=float, default=0.3, help="Segundos mínimos por medición.")
+    parser.add_argument("--max-iterations", type=int, default=100000)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Archivo JSON de baseline.")
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como nuevo baseline.")
+    parser.add_argument("--compare", action="store_true", help="Compara contra el baseline y falla si hay regresiones.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Caída máxima aceptada de ops/s (fracción).")
+    parser.add_argument("--with-logging", action="store_true", help="Mide también el costo de los logs INFO de las herramientas.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.with_logging else logging.WARNING, force=True)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = run_suite(sizes, args.min_time, args.max_iterations)
+
+    print(f"{'medición':<55} {'ops/s':>12} {'µs/op':>10} {'peak KiB':>10} {'blocks/op':>10}")
+    for name, stats in results.items():
+        print(f"{name:<55} {stats['ops_per_s']:>12} {stats['us_per_op']:>10} {stats['peak_kib']:>10} {stats['retained_blocks_per_op']:>10}")
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo existe el baseline '{args.baseline}'. Ejecuta primero con --save-baseline.")
+            exit_code = 2
+        else:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+            if regressions:
+                print("\n❌ Regresiones detectadas:")
+                for line in regressions:
+                    print(f"  - {line}")
+                exit_code = 1
+            else:
+                print("\n✅ Sin regresiones respecto al baseline.")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline guardado en '{args.baseline}'.")
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
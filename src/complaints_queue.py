@@ -0,0 +1,124 @@
+# ==============================================================================
+# complaints_queue.py - QUEJAS A LA PESTAÑA 'Quejas' EN LOTES ASÍNCRONOS
+# ==============================================================================
+"""
+handle_complaint no espera a Google Sheets: la queja se encola en memoria y un
+trabajador en segundo plano la escribe en 'Quejas' con un solo append_rows por
+lote, cada COMPLAINTS_FLUSH_S o en cuanto se juntan COMPLAINTS_BATCH_SIZE.
+Si Sheets falla, el lote se queda en cola y se reintenta con espera creciente,
+en orden. Al apagar el bot se intenta vaciar lo pendiente (con límite).
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import metrics
+import tenants
+from sheets_client import get_worksheet
+
+logger = logging.getLogger(__name__)
+
+COMPLAINTS_WORKSHEET = 'Quejas'
+COMPLAINT_COLUMNS = ('Fecha', 'ID_Cliente', 'Nombre', 'Queja')
+COMPLAINTS_FLUSH_S = float(os.environ.get("COMPLAINTS_FLUSH_S", "2"))
+COMPLAINTS_BATCH_SIZE = int(os.environ.get("COMPLAINTS_BATCH_SIZE", "20"))
+COMPLAINTS_MAX_DELAY_S = 60.0
+
+COMPLAINTS_PENDING = metrics.REGISTRY.gauge("pizzeria_complaints_pending", "Quejas en cola, aún sin escribir en Google Sheets.")
+COMPLAINTS_WRITTEN_TOTAL = metrics.REGISTRY.counter("pizzeria_complaints_written_total", "Quejas escritas en la pestaña 'Quejas'.")
+COMPLAINTS_FAILURES_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_complaints_failures_total", "Lotes de quejas que no se pudieron escribir (se reintentan)."
+)
+
+
+def _append_rows(rows: List[List[Any]]) -> None:
+    worksheet = get_worksheet(COMPLAINTS_WORKSHEET)
+    if worksheet is None:
+        raise RuntimeError(f"La pestaña '{COMPLAINTS_WORKSHEET}' de Google Sheets no está disponible.")
+    worksheet.append_rows(rows)
+
+
+class ComplaintQueue:
+    """Cola de quejas de una pizzería con escritura por lotes en segundo plano."""
+
+    def __init__(self, tenant: tenants.Tenant, flush_s: float = COMPLAINTS_FLUSH_S, batch_size: int = COMPLAINTS_BATCH_SIZE):
+        self.tenant = tenant
+        self.flush_s = flush_s
+        self.batch_size = batch_size
+        self._rows: List[List[Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def submit(self, complaint: Dict[str, Any]) -> None:
+        """Encola una queja (claves de COMPLAINT_COLUMNS). No bloquea ni toca la red."""
+        self._rows.append([complaint.get(column, '') for column in COMPLAINT_COLUMNS])
+        COMPLAINTS_PENDING.inc()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            # Sin heredar el turno que encoló la queja (su plazo y sus métricas).
+            self._worker = tenants.detached_context(self.tenant).run(
+                asyncio.get_running_loop().create_task, self._run(), name=f"complaints-{self.tenant.tenant_id}"
+            )
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """Escribe todo lo pendiente en un solo append_rows. Devuelve False si falló."""
+        if not self._rows:
+            return True
+        batch = list(self._rows)
+        try:
+            await asyncio.to_thread(_append_rows, batch)
+        except Exception as e:
+            COMPLAINTS_FAILURES_TOTAL.inc()
+            logger.warning(f"⚠️ No se pudieron escribir {len(batch)} quejas en '{COMPLAINTS_WORKSHEET}' ({self.tenant.tenant_id}): {e!r}")
+            return False
+        # Las quejas que llegaron durante la escritura siguen en cola, detrás del lote.
+        del self._rows[:len(batch)]
+        COMPLAINTS_PENDING.dec(len(batch))
+        COMPLAINTS_WRITTEN_TOTAL.inc(len(batch))
+        logger.info(f"📝 {len(batch)} queja(s) escrita(s) en '{COMPLAINTS_WORKSHEET}' ({self.tenant.tenant_id}).")
+        return True
+
+    async def _run(self) -> None:
+        delay = self.flush_s
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            flushed = await self.flush()
+            if self._closing:
+                return
+            # Si Sheets falla, el siguiente intento espera cada vez más (o a que se llene un lote).
+            delay = self.flush_s if flushed else min(COMPLAINTS_MAX_DELAY_S, max(delay, 1.0) * 2)
+
+    async def close(self, timeout_s: float = 10.0) -> None:
+        """Último intento (con límite) de escribir lo pendiente; luego se detiene el trabajador."""
+        if self._worker is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        # Se espera al trabajador sin cancelarlo (asyncio.wait, no wait_for): cancelarlo no detendría
+        # el append_rows que corre en su hilo, y esas quejas se darían por no escritas aunque lleguen a la hoja.
+        await asyncio.wait({self._worker}, timeout=timeout_s)
+        self._worker = None
+        if self._rows:
+            logger.warning(f"⚠️ Quedaron {len(self._rows)} quejas sin escribir en '{COMPLAINTS_WORKSHEET}' ({self.tenant.tenant_id}) al apagar.")
+
+
+# Una cola por pizzería (ver tenants.py).
+_queues: Dict[str, ComplaintQueue] = {}
+
+
+def get_queue() -> ComplaintQueue:
+    """Cola de quejas de la pizzería activa."""
+    return tenants.scoped(_queues, ComplaintQueue)
+
+
+async def close_all() -> None:
+    for queue in list(_queues.values()):
+        await queue.close()
@@ -0,0 +1,136 @@
+# ==============================================================================
+# config_cache.py - CACHÉ DE LA PESTAÑA 'Configuracion' CON REFRESCO EN SEGUNDO PLANO
+# ==============================================================================
+"""
+get_general_info responde desde memoria. La pestaña 'Configuracion' (Clave | Valor)
+se lee una vez y se vuelve a leer en segundo plano cada CONFIG_REFRESH_S; cada
+lectura reemplaza el diccionario entero, así que una consulta nunca ve una
+configuración a medias.
+
+Una pregunta del cliente nunca espera a Sheets: mientras la primera lectura no
+termine (o si falla), se responde con DEFAULT_GENERAL_INFO y los valores de
+'general_info' de la pizzería en tenants.json. Lo que diga la hoja tiene prioridad.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import metrics
+import tenants
+from sheets_client import get_worksheet
+
+logger = logging.getLogger(__name__)
+
+CONFIG_WORKSHEET = 'Configuracion'
+CONFIG_REFRESH_S = float(os.environ.get("CONFIG_REFRESH_S", "300"))
+CONFIG_RETRY_S = 30.0 # Tras una lectura fallida se reintenta antes que el refresco normal.
+
+# Información general por defecto (la de la pizzería original).
+DEFAULT_GENERAL_INFO: Dict[str, str] = {
+    "horario": "Nuestro horario es de Lunes a Sábado, de 11:00 AM a 10:00 PM. Domingos cerramos.",
+    "telefono": "Puedes contactarnos al número +51 987 654 321.",
+    "ubicacion": "Estamos ubicados en Av. Siempre Viva 742."
+}
+
+CONFIG_LOOKUPS_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_config_lookups_total", "Consultas de información general por origen (hoja, valores por defecto o sin dato).", ["result"]
+)
+CONFIG_REFRESH_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_config_refresh_total", "Lecturas de la pestaña 'Configuracion' por resultado.", ["outcome"]
+)
+
+
+def normalize_key(key: str) -> str:
+    return str(key or '').strip().lower()
+
+
+def _read_worksheet() -> Dict[str, str]:
+    """Lee 'Configuracion' (en un hilo). Primera fila: encabezados; columnas Clave y Valor."""
+    worksheet = get_worksheet(CONFIG_WORKSHEET)
+    if worksheet is None:
+        raise RuntimeError(f"La pestaña '{CONFIG_WORKSHEET}' de Google Sheets no está disponible.")
+    values: Dict[str, str] = {}
+    for row in worksheet.get_all_values()[1:]:
+        if len(row) >= 2 and str(row[0]).strip() and str(row[1]).strip():
+            values[normalize_key(row[0])] = str(row[1]).strip()
+    return values
+
+
+class ConfigCache:
+    """Configuración de una pizzería en memoria, con un refresco periódico en segundo plano."""
+
+    def __init__(self, tenant: tenants.Tenant, refresh_s: float = CONFIG_REFRESH_S):
+        self.tenant = tenant
+        self.refresh_s = refresh_s
+        self.fallback = {**DEFAULT_GENERAL_INFO, **tenant.general_info}
+        self._values: Dict[str, str] = dict(self.fallback)
+        self.loaded_at: Optional[float] = None # time.monotonic() de la última lectura correcta.
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, key: str) -> Optional[str]:
+        """Valor de una clave, solo desde memoria. Arranca el refresco si aún no corre."""
+        self.start()
+        value = self._values.get(normalize_key(key))
+        CONFIG_LOOKUPS_TOTAL.inc(result='miss' if value is None else ('sheet' if self.loaded_at else 'default'))
+        return value
+
+    def values(self) -> Dict[str, str]:
+        return dict(self._values)
+
+    async def refresh(self) -> bool:
+        try:
+            sheet_values = await asyncio.to_thread(_read_worksheet)
+        except Exception as e:
+            CONFIG_REFRESH_TOTAL.inc(outcome='error')
+            logger.warning(f"⚠️ No se pudo leer '{CONFIG_WORKSHEET}' ({self.tenant.tenant_id}): {e!r}. Se sigue con la configuración en memoria.")
+            return False
+        self._values = {**self.fallback, **sheet_values}
+        self.loaded_at = time.monotonic()
+        CONFIG_REFRESH_TOTAL.inc(outcome='ok')
+        logger.info(f"⚙️ Configuración de '{self.tenant.tenant_id}' cargada desde '{CONFIG_WORKSHEET}': {len(sheet_values)} claves.")
+        return True
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            loaded = await self.refresh()
+            await asyncio.sleep(self.refresh_s if loaded else min(CONFIG_RETRY_S, self.refresh_s))
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # Sin heredar el turno que hizo la primera consulta (su plazo y sus métricas).
+        self._task = tenants.detached_context(self.tenant).run(
+            loop.create_task, self._refresh_forever(), name=f"config-refresh-{self.tenant.tenant_id}"
+        )
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Una configuración por pizzería (ver tenants.py).
+_caches: Dict[str, ConfigCache] = {}
+
+
+def get_config() -> ConfigCache:
+    """Configuración de la pizzería activa."""
+    return tenants.scoped(_caches, ConfigCache)
+
+
+def start_all() -> None:
+    """Lanza la primera lectura y el refresco de todas las pizzerías (al arrancar el bot)."""
+    for tenant in tenants.all_tenants():
+        with tenants.activate(tenant):
+            get_config().start()
+
+
+def stop_all() -> None:
+    for cache in list(_caches.values()):
+        cache.stop()
@@ -0,0 +1,123 @@
+# ==============================================================================
+# customer_prefetch.py - PRECARGA ASÍNCRONA DEL CLIENTE AL CREAR LA SESIÓN
+# ==============================================================================
+"""
+Cuando se crea una sesión (por /start o por el primer mensaje) lanzamos en
+segundo plano la lectura del cliente en la hoja 'Clientes'. Al empezar el turno
+siguiente, el resultado se vuelca al estado de la sesión (_customer_status,
+_customer_name_for_greeting, _customer_record, _customer_prefetched) y el
+orquestador puede saltarse la fase A para clientes conocidos.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from google.adk.events import Event, EventActions
+
+import metrics
+import tenants
+from pizzeria_tools import fetch_customer_record
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_AUTHOR = 'CustomerPrefetch'
+# Cuánto puede esperar el primer turno a una precarga que aún no terminó.
+PREFETCH_WAIT_S = float(os.environ.get('CUSTOMER_PREFETCH_WAIT_S', '1.5'))
+# Cuánto se guarda una precarga terminada que nadie aplicó (p.ej. /start sin más mensajes).
+PREFETCH_TTL_S = float(os.environ.get('CUSTOMER_PREFETCH_TTL_S', '600'))
+
+PREFETCH_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_customer_prefetch_total", "Precargas de cliente por resultado.", ["result"]
+)
+
+_pending: Dict[Tuple[str, str], asyncio.Task] = {} # (tenant, usuario) -> lectura en curso
+
+
+def _pending_key(user_id: str) -> Tuple[str, str]:
+    # El mismo usuario de Telegram puede escribir a varias pizzerías: cada una tiene su hoja de clientes.
+    return (tenants.current_tenant().tenant_id, user_id)
+
+
+def schedule_prefetch(user_id: str) -> None:
+    """Lanza la lectura del cliente en segundo plano (una sola vez por usuario y pizzería)."""
+    key = _pending_key(user_id)
+    if key in _pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    # Contexto limpio (solo la pizzería): la lectura no hereda el plazo ni las métricas del turno que la lanzó.
+    task = tenants.detached_context().run(loop.create_task, fetch_customer_record(user_id), name=f"customer-prefetch-{user_id}")
+    _pending[key] = task
+    task.add_done_callback(lambda done: loop.call_later(PREFETCH_WAIT_S + PREFETCH_TTL_S, _expire, key, done))
+    logger.debug("Precarga de cliente lanzada para user %s.", user_id)
+
+
+def _expire(key: Tuple[str, str], task: asyncio.Task) -> None:
+    """Descarta una precarga que ningún turno llegó a aplicar."""
+    if _pending.get(key) is task:
+        del _pending[key]
+        PREFETCH_TOTAL.inc(result='expired')
+
+
+def customer_state_delta(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Traduce el registro de 'Clientes' a las claves de estado que usan agentes y herramientas."""
+    if record:
+        return {
+            '_customer_status': 'found',
+            '_customer_name_for_greeting': str(record.get('Nombre') or '').strip() or None,
+            '_customer_record': record,
+            '_customer_prefetched': True,
+        }
+    return {'_customer_status': 'not_found', '_customer_prefetched': True}
+
+
+async def apply_prefetch(session_service: Any, app_name: str, user_id: str, session_id: str,
+                         wait_s: float = PREFETCH_WAIT_S) -> bool:
+    """
+    Vuelca a la sesión el resultado de la precarga pendiente, si la hay.
+    Si la lectura no termina en wait_s, el turno sigue sin ella (el agente hará la consulta
+    por su cuenta) y se reintenta aplicar en el turno siguiente.
+    """
+    key = _pending_key(user_id)
+    task = _pending.get(key)
+    if task is None:
+        return False
+
+    if not task.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(task), wait_s)
+        except asyncio.TimeoutError:
+            PREFETCH_TOTAL.inc(result='late')
+            logger.info(f"⏳ La precarga del cliente {user_id} no terminó en {wait_s}s. Se continúa sin ella.")
+            return False
+        except Exception:
+            pass # El error se examina abajo con task.exception().
+
+    _pending.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        PREFETCH_TOTAL.inc(result='error')
+        reason = 'cancelada' if task.cancelled() else repr(task.exception())
+        logger.warning(f"⚠️ Falló la precarga del cliente {user_id}: {reason}")
+        return False
+
+    session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    if session is None:
+        return False
+    phase = session.state.get('processing_order_sub_phase')
+    if session.state.get('_customer_status') or phase not in (None, 'A_GESTION_CLIENTE'):
+        # El agente ya resolvió al cliente por su cuenta: la precarga llegó tarde.
+        PREFETCH_TOTAL.inc(result='stale')
+        return False
+
+    record = task.result()
+    state_delta = customer_state_delta(record)
+    await session_service.append_event(
+        session,
+        Event(author=PREFETCH_AUTHOR, invocation_id=Event.new_id(), actions=EventActions(state_delta=state_delta)),
+    )
+    PREFETCH_TOTAL.inc(result='found' if record else 'not_found')
+    logger.info(f"⚡ Cliente {user_id} precargado en la sesión (estado: {state_delta['_customer_status']}).")
+    return True
@@ -0,0 +1,201 @@
+# ==============================================================================
+# fake_bot_api.py - BOT API DE TELEGRAM FALSO PARA PROBAR LA COLA DE ENVÍOS
+# ==============================================================================
+"""
+Servidor HTTP local que imita los métodos del Bot API que usa el bot (getMe,
+getUpdates, sendMessage, editMessageText, sendChatAction, sendDocument) y aplica
+los mismos límites que Telegram: ~30 mensajes/s por bot y ~1 mensaje/s por chat.
+Si se superan responde 429 con 'retry_after', igual que el servicio real.
+
+Uso (desde src/):
+    python fake_bot_api.py --port 8081                        # solo el servidor
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot python telegram_pizzeria_bot.py
+    python fake_bot_api.py --drive --chats 200 --messages 5   # pico simulado a través de outbound_queue
+"""
+import argparse
+import asyncio
+import email.parser
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE, GLOBAL_BURST = 30.0, 30.0
+CHAT_RATE, CHAT_BURST = 1.0, 3.0
+LIMITED_METHODS = {"sendMessage", "editMessageText", "sendDocument"}
+
+
+class _Limiter:
+    """Token buckets del lado servidor; devuelve los segundos a esperar si no hay ficha."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[Any, Tuple[float, float]] = {}
+
+    def _take(self, key: Any, rate: float, burst: float, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens < 1.0:
+            self._buckets[key] = (tokens, now)
+            return (1.0 - tokens) / rate
+        self._buckets[key] = (tokens - 1.0, now)
+        return 0.0
+
+    def check(self, chat_id: Any) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait_s = self._take(("chat", chat_id), CHAT_RATE, CHAT_BURST, now)
+            if wait_s:
+                return wait_s
+            return self._take("global", GLOBAL_RATE, GLOBAL_BURST, now)
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.limiter = _Limiter()
+        self.stats = {"requests": 0, "sent": 0, "edited": 0, "documents": 0, "rate_limited": 0}
+        self.messages: Dict[Any, list] = {} # chat_id -> textos en orden de llegada
+        self._message_ids = 0
+        self._lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path == "/stats":
+                    self._reply(200, dict(api.stats, chats=len(api.messages)))
+                else:
+                    self._handle({k: v[0] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).items()})
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._handle(_parse_params(self.headers.get("Content-Type", ""), body))
+
+            def _handle(self, params: Dict[str, Any]) -> None:
+                method = urllib.parse.urlsplit(self.path).path.rsplit("/", 1)[-1]
+                status, payload = api.dispatch(method, params)
+                self._reply(status, payload)
+
+            def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self.server.server_address[1]}/bot"
+
+    def _message(self, chat_id: Any, **fields: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._message_ids += 1
+            message_id = self._message_ids
+        return dict({"message_id": message_id, "date": int(time.time()), "chat": {"id": int(chat_id), "type": "private"}}, **fields)
+
+    def dispatch(self, method: str, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.stats["requests"] += 1
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Pizzería (fake)", "username": "fake_pizzeria_bot"}}
+        if method in ("deleteWebhook", "sendChatAction", "setMyCommands"):
+            return 200, {"ok": True, "result": True}
+        if method == "getUpdates":
+            time.sleep(min(1.0, float(params.get("timeout") or 0)))
+            return 200, {"ok": True, "result": []}
+
+        chat_id = params.get("chat_id")
+        if method in LIMITED_METHODS:
+            wait_s = self.limiter.check(chat_id)
+            if wait_s:
+                self.stats["rate_limited"] += 1
+                retry_after = max(1, int(wait_s + 0.999))
+                return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                             "parameters": {"retry_after": retry_after}}
+        if method == "sendMessage":
+            self.stats["sent"] += 1
+            self.messages.setdefault(chat_id, []).append(params.get("text"))
+            return 200, {"ok": True, "result": self._message(chat_id, text=params.get("text"))}
+        if method == "editMessageText":
+            self.stats["edited"] += 1
+            return 200, {"ok": True, "result": self._message(chat_id, text=params.get("text"))}
+        if method == "sendDocument":
+            self.stats["documents"] += 1
+            document = params.get("document")
+            file_id = document if isinstance(document, str) else f"fake-file-{self.stats['documents']}"
+            return 200, {"ok": True, "result": self._message(chat_id, document={"file_id": file_id, "file_unique_id": file_id})}
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+
+    def start(self) -> "FakeBotAPI":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+def _parse_params(content_type: str, body: bytes) -> Dict[str, Any]:
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            # Un archivo subido no tiene valor útil aquí: se marca con None para generar un file_id.
+            params[name] = None if part.get_filename() else part.get_payload(decode=True).decode("utf-8")
+        return params
+    return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+
+
+async def drive(base_url: str, n_chats: int, per_chat: int) -> Dict[str, Any]:
+    """Envía per_chat mensajes a cada uno de n_chats chats a la vez a través de outbound_queue."""
+    from telegram import Bot
+    import outbound_queue
+
+    bot = Bot("123:FAKE", base_url=base_url)
+    started_at = time.monotonic()
+    async with bot:
+        futures = [
+            outbound_queue.OUTBOX.submit(chat_id, lambda c=chat_id, i=i: bot.send_message(c, f"mensaje {i}"), kind="text")
+            for i in range(per_chat) for chat_id in range(1, n_chats + 1)
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    return {"messages": len(results), "errors": len(errors), "seconds": round(time.monotonic() - started_at, 2),
+            "retry_after_seen": outbound_queue.OUTBOUND_RETRY_AFTER_TOTAL.value()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bot API de Telegram falso con límites de tasa.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--drive", action="store_true", help="Lanza un pico de envíos contra el servidor y muestra el resultado.")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=3, help="Mensajes por chat.")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.host, 0 if args.drive else args.port)
+    if not args.drive:
+        print(f"Bot API falso escuchando en {api.base_url}<token>/<método>  (estadísticas en /stats)")
+        api.server.serve_forever()
+        return
+    api.start()
+    try:
+        summary = asyncio.run(drive(api.base_url, args.chats, args.messages))
+    finally:
+        api.stop()
+    summary["server"] = api.stats
+    # El orden por chat debe conservarse aunque haya habido 429.
+    summary["out_of_order_chats"] = sum(1 for texts in api.messages.values() if texts != sorted(texts, key=lambda t: int(t.split()[-1])))
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# ==============================================================================
+# instruction_templates.py - INSTRUCCIONES DE AGENTES CON ESTADO Y MENÚ RENDERIZADOS
+# ==============================================================================
+"""
+Los agentes reciben en su instrucción los datos que antes leían con herramientas
+de solo lectura (estado del cliente, carrito, categorías y platos del menú).
+
+Las plantillas usan la sintaxis de string.Template:
+- ${menu_digest} y ${pizzeria_name} se resuelven una vez por pizzería (tenant) y
+  versión del menú y quedan cacheados: los agentes se comparten entre pizzerías.
+- ${_clave} se resuelve con el estado de la sesión en cada invocación.
+ADK no inyecta el estado cuando la instrucción es un callable, por eso lo hacemos aquí.
+"""
+import logging
+import os
+from string import Template
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+import menu_cache
+import tenants
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_VALUE = 'desconocido'
+# Con menús más grandes el resumen dejaría de ser compacto: solo se listan las categorías.
+MAX_DIGEST_ITEMS = int(os.environ.get('MENU_DIGEST_MAX_ITEMS', '200'))
+
+_digest_cache: Dict[str, Tuple[int, str]] = {} # tenant -> (versión del menú, resumen)
+
+
+def menu_digest() -> str:
+    """
+    Resumen compacto de los platos disponibles, agrupado por categoría. Cacheado por versión
+    del menú y ya escapado para string.Template (se incrusta antes de compilar la plantilla).
+    """
+    tenant_id = tenants.current_tenant().tenant_id
+    version = menu_cache.get_menu_version()
+    cached = _digest_cache.get(tenant_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    available = menu_cache.get_available_items()
+    by_category: Dict[str, List[menu_cache.MenuItem]] = {}
+    for item in available:
+        by_category.setdefault(item.category or 'Otros', []).append(item)
+
+    if len(available) > MAX_DIGEST_ITEMS:
+        text = ("(Menú extenso: usa `get_items_by_category` para ver los platos.) Categorías: "
+                + ", ".join(sorted(by_category)))
+    else:
+        lines = []
+        for category in sorted(by_category):
+            entries = []
+            for item in by_category[category]:
+                entry = f"{item.name} S/ {item.price:.2f}"
+                if item.ingredients:
+                    entry += f" ({item.ingredients})"
+                entries.append(entry)
+            lines.append(f"- {category}: " + "; ".join(entries))
+        text = "\n".join(lines) if lines else "(El menú no está disponible en este momento.)"
+
+    # Un '$' en el menú no debe confundirse con un marcador de la plantilla.
+    text = text.replace('$', '$$')
+    _digest_cache[tenant_id] = (version, text)
+    logger.info(f"📝 Resumen del menú para instrucciones regenerado ({tenant_id}, versión {version}, {len(available)} ítems, {len(text)} caracteres).")
+    return text
+
+
+def render_cart(items: Any) -> str:
+    """Carrito en una línea: '2x Pizza ... (S/ 48.00); ... | Subtotal: S/ 52.00'."""
+    if not items:
+        return 'vacío'
+    parts = []
+    total = 0.0
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        subtotal = float(item.get('subtotal') or 0)
+        total += subtotal
+        parts.append(f"{item.get('quantity', 1)}x {item.get('name')} (S/ {subtotal:.2f})")
+    return "; ".join(parts) + f" | Subtotal: S/ {total:.2f}"
+
+
+def render_state_value(key: str, value: Any) -> str:
+    if value is None or value == '':
+        return UNKNOWN_VALUE
+    if key == '_current_order_items':
+        return render_cart(value)
+    if isinstance(value, bool):
+        return 'sí' if value else 'no'
+    return str(value)
+
+
+class _StateView(Mapping):
+    """Vista del estado para Template: cualquier clave ausente se muestra como 'desconocido'."""
+
+    def __init__(self, state: Any):
+        self._state = state
+
+    def __getitem__(self, key: str) -> str:
+        return render_state_value(key, self._state.get(key))
+
+    def __iter__(self):
+        return iter(self._state)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
+def state_instruction(template: str) -> Callable[[Any], str]:
+    """
+    Devuelve un InstructionProvider de ADK para la plantilla dada.
+    La parte estática (con el menú ya incrustado) se cachea por pizzería y versión del menú.
+    """
+    compiled: Dict[str, Tuple[int, Template]] = {} # tenant -> (versión del menú, plantilla)
+
+    def provider(context: Any) -> str:
+        tenant = tenants.current_tenant()
+        version = menu_cache.get_menu_version()
+        cached = compiled.get(tenant.tenant_id)
+        if cached is None or cached[0] != version:
+            static = Template(template).safe_substitute(
+                menu_digest=menu_digest(), pizzeria_name=tenant.display_name.replace('$', '$$'))
+            cached = compiled[tenant.tenant_id] = (version, Template(static))
+        return cached[1].safe_substitute(_StateView(context.state))
+
+    return provider
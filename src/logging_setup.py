@@ -0,0 +1,189 @@
+# ==============================================================================
+# logging_setup.py - LOGGING ESTRUCTURADO, ASÍNCRONO Y CON MUESTREO
+# ==============================================================================
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+from typing import Any, Dict, Optional
+
+import metrics
+
+LOG_RECORDS_DROPPED = metrics.REGISTRY.counter(
+    "pizzeria_log_records_dropped_total", "Registros de log descartados por cola llena o muestreo.", ["reason"]
+)
+
+DEFAULT_PAYLOAD_LIMIT = 300
+
+# Repr acotado: nunca recorre más de unos pocos elementos de dicts/listas grandes.
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 3
+_payload_repr.maxdict = 12
+_payload_repr.maxlist = 12
+_payload_repr.maxtuple = 12
+_payload_repr.maxset = 12
+_payload_repr.maxstring = 160
+_payload_repr.maxother = 160
+
+
+def render_payload(obj: Any, limit: int = DEFAULT_PAYLOAD_LIMIT) -> str:
+    """Representación de un payload con tamaño máximo, sin construir primero el str completo."""
+    text = obj if isinstance(obj, str) else _payload_repr.repr(obj)
+    if len(text) > limit:
+        return text[:limit] + "..."
+    return text
+
+
+class LazyPayload:
+    """
+    Envoltura para pasar como argumento de logging ('%s'): el payload solo se
+    renderiza si el registro supera el nivel y el muestreo.
+    """
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj: Any, limit: int = DEFAULT_PAYLOAD_LIMIT):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return render_payload(self.obj, self.limit)
+
+    __repr__ = __str__
+
+
+class CategorySamplingFilter(logging.Filter):
+    """
+    Deja pasar solo una fracción de los registros de cada categoría.
+    La categoría se indica con extra={'category': '...'}; sin categoría, siempre pasa.
+    WARNING y superiores nunca se muestrean.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'category', None))
+        if rate is None or rate >= 1.0:
+            return True
+        if rate > 0.0 and random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason='sampled')
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos estándar más los 'extra' simples."""
+    _STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._STANDARD_ATTRS and not key.startswith('_'):
+                payload[key] = value if isinstance(value, (str, int, float, bool, type(None))) else render_payload(value)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class _BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que solo interpola el mensaje en el hilo que loguea (para capturar
+    el valor actual de los argumentos) y deja el formateo y la escritura al hilo
+    del QueueListener. Si la cola está llena, descarta el registro en vez de bloquear.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason='queue_full')
+
+
+def _parse_sampling(spec: str) -> Dict[str, float]:
+    """Convierte 'model_prompt=0.1,tool_result=0.5' en un diccionario de tasas."""
+    rates = {}
+    for chunk in spec.split(','):
+        if '=' not in chunk:
+            continue
+        category, rate = chunk.split('=', 1)
+        try:
+            rates[category.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def stop_logging() -> None:
+    """Vacía la cola y detiene el hilo escritor (se registra con atexit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    use_queue: Optional[bool] = None,
+    sampling: Optional[str] = None,
+    queue_size: int = 10000,
+) -> None:
+    """
+    Configura el logging raíz del proceso. Cada parámetro tiene su variable de entorno:
+      - LOG_LEVEL (INFO), LOG_FORMAT ('text' | 'json'), LOG_ASYNC ('1' usa escritor en segundo plano),
+      - LOG_SAMPLING ('categoria=tasa,...', p. ej. 'model_prompt=0.1,tool_result=0.25').
+    """
+    global _listener
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    log_format = (log_format or os.environ.get("LOG_FORMAT", "text")).lower()
+    if use_queue is None:
+        use_queue = os.environ.get("LOG_ASYNC", "1") != "0"
+    rates = _parse_sampling(sampling if sampling is not None else os.environ.get("LOG_SAMPLING", ""))
+
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] %(message)s')
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    stop_logging()
+
+    if use_queue:
+        handler = _BackgroundQueueHandler(queue.Queue(maxsize=queue_size))
+        _listener = logging.handlers.QueueListener(handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = stream_handler
+
+    if rates:
+        handler.addFilter(CategorySamplingFilter(rates))
+
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+    logging.getLogger('google_adk').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+atexit.register(stop_logging)
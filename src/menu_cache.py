@@ -1,40 +1,276 @@
+import bisect
 import json
 import logging
+import sys
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import tenants
 
 logger = logging.getLogger(__name__)
 
-# Esta variable global guardará nuestro menú en memoria.
-_MENU_DATA = None # Lo iniciamos como None para ser más explícitos
+DEFAULT_MENU_PATH = 'menu.json'
+AVAILABLE_TEXT = 'Sí'
+UNAVAILABLE_TEXT = 'No'
+
+# ==============================================================================
+# REGISTRO TIPADO DE CADA ÍTEM DEL MENÚ
+# ==============================================================================
+# La caché ya no guarda los diccionarios de texto de menu.json: cada ítem es un
+# registro inmutable con __slots__, precio en céntimos, alias ya separados,
+# categoría internada y disponibilidad booleana, así que nada se vuelve a parsear
+# en las búsquedas ni en el carrito. to_dict() da la forma que devuelven las herramientas.
+
+
+def _parse_cents(value: Any) -> int:
+    try:
+        return int(round(float(value or 0) * 100))
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ Precio inválido en el menú: {value!r}. Se usa 0.")
+        return 0
+
+
+@dataclass(frozen=True, slots=True)
+class MenuItem:
+    item_id: str
+    name: str
+    aliases: Tuple[str, ...] # En minúsculas, sin espacios sobrantes.
+    description: str
+    category: str
+    price_cents: int
+    ingredients: str
+    available: bool
+
+    @property
+    def price(self) -> float:
+        return self.price_cents / 100
+
+    @classmethod
+    def from_dict(cls, item_id: Any, raw: Dict[str, Any]) -> 'MenuItem':
+        """Convierte una entrada con el formato de menu.json."""
+        return cls(
+            item_id=str(item_id),
+            name=str(raw.get('Nombre_Plato', '')).strip(),
+            aliases=tuple(alias.strip().lower() for alias in str(raw.get('Alias', '') or '').split(',') if alias.strip()),
+            description=str(raw.get('Descripcion_Plato') or raw.get('Descripcion') or ''),
+            category=sys.intern(str(raw.get('Categoria', '')).strip()),
+            price_cents=_parse_cents(raw.get('Precio')),
+            ingredients=str(raw.get('Ingredientes', '') or ''),
+            available=str(raw.get('Disponible', '')).strip().lower() == 'sí',
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """La forma de las entradas de menu.json (más ID_Plato), que es lo que devuelven las herramientas."""
+        return {
+            'ID_Plato': self.item_id,
+            'Nombre_Plato': self.name,
+            'Alias': ", ".join(self.aliases),
+            'Descripcion_Plato': self.description,
+            'Categoria': self.category,
+            'Precio': self.price_cents // 100 if self.price_cents % 100 == 0 else self.price,
+            'Ingredientes': self.ingredients,
+            'Disponible': AVAILABLE_TEXT if self.available else UNAVAILABLE_TEXT,
+        }
+
+
+# ==============================================================================
+# ÍNDICES DE BÚSQUEDA Y DISPONIBILIDAD EN TIEMPO DE EJECUCIÓN
+# ==============================================================================
+# Las herramientas no recorren el menú comprobando la disponibilidad en cada
+# búsqueda: el índice guarda qué ítems están disponibles (en el orden del menú, en
+# total y por categoría) y diccionarios por nombre y alias. set_item_availability
+# solo toca las entradas del ítem afectado; no se reconstruye nada más.
+
+class _MenuIndex:
+    __slots__ = ('items', 'position', 'by_name', 'by_alias', 'available', 'available_by_category', 'categories')
+
+    def __init__(self, records: List[MenuItem]):
+        self.items: Dict[str, MenuItem] = {}   # id -> registro
+        self.position: Dict[str, int] = {}     # id -> posición en el menú, para mantener el orden al reinsertar
+        self.by_name: Dict[str, Tuple[str, ...]] = {}  # nombre en minúsculas -> ids, en orden del menú
+        self.by_alias: Dict[str, Tuple[str, ...]] = {} # alias -> ids, en orden del menú (un alias puede ser de varios platos)
+        self.available: List[str] = []         # ids disponibles, en orden del menú
+        self.available_by_category: Dict[str, List[str]] = {} # categoría en minúsculas -> ids disponibles, en orden
+        self.categories: Tuple[str, ...] = tuple(sorted({record.category for record in records if record.category}))
+        for position, record in enumerate(records):
+            self.items[record.item_id] = record
+            self.position[record.item_id] = position
+            name_key = record.name.lower()
+            self.by_name[name_key] = self.by_name.get(name_key, ()) + (record.item_id,)
+            for alias in record.aliases:
+                self.by_alias[alias] = self.by_alias.get(alias, ()) + (record.item_id,)
+            if record.available:
+                self.available.append(record.item_id)
+                self.available_by_category.setdefault(record.category.lower(), []).append(record.item_id)
+
+    def _insert_ordered(self, ids: List[str], item_id: str) -> None:
+        keys = [self.position[i] for i in ids]
+        ids.insert(bisect.bisect_left(keys, self.position[item_id]), item_id)
+
+    def set_available(self, item_id: str, available: bool) -> bool:
+        """Actualiza solo las entradas del ítem. Devuelve False si ya estaba en ese estado."""
+        record = self.items[item_id]
+        if record.available == available:
+            return False
+        category_ids = self.available_by_category.setdefault(record.category.lower(), [])
+        if available:
+            self._insert_ordered(self.available, item_id)
+            self._insert_ordered(category_ids, item_id)
+        else:
+            self.available.remove(item_id)
+            category_ids.remove(item_id)
+        self.items[item_id] = replace(record, available=available)
+        return True
+
+
+class MenuCache:
+    """Menú en memoria de una pizzería (un tenant): el índice y su versión."""
+
+    def __init__(self, path: str = DEFAULT_MENU_PATH):
+        self.path = path
+        self.version = 0 # Se incrementa cada vez que cambia el menú.
+        self._index: Optional[_MenuIndex] = None # Lo iniciamos como None para ser más explícitos
+
+    def set_menu_data(self, raw_menu: Any) -> None:
+        """Reemplaza el menú con datos en el formato de menu.json (dict por ID_Plato o lista)."""
+        if isinstance(raw_menu, dict):
+            entries = raw_menu.items()
+        else:
+            entries = ((raw.get('ID_Plato', position), raw) for position, raw in enumerate(raw_menu or []))
+        self._index = _MenuIndex([MenuItem.from_dict(item_id, raw) for item_id, raw in entries])
+        self.version += 1
+
+    def load_from_json(self, file_path: Optional[str] = None) -> None:
+        file_path = file_path or self.path
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                raw_menu = json.load(f)
+            self.set_menu_data(raw_menu)
+            logger.info(f"✅ Menú cargado exitosamente en caché desde '{file_path}'. Se encontraron {len(raw_menu)} ítems.")
+        except FileNotFoundError:
+            logger.error(f"❌ ERROR CRÍTICO: No se encontró el archivo del menú en '{file_path}'.")
+            self.set_menu_data({}) # Menú vacío en caso de error
+        except json.JSONDecodeError:
+            logger.error(f"❌ ERROR CRÍTICO: El archivo del menú '{file_path}' contiene un JSON inválido.")
+            self.set_menu_data({})
+
+    @property
+    def index(self) -> _MenuIndex:
+        if self._index is None:
+            self.load_from_json()
+        return self._index
+
+    def set_item_availability(self, reference: str, available: bool) -> MenuItem:
+        item_id = find_item_id(reference, cache=self)
+        if item_id is None:
+            raise KeyError(reference)
+        index = self.index
+        if index.set_available(item_id, available):
+            self.version += 1
+            logger.info(f"🍕 Disponibilidad de '{index.items[item_id].name}' ({item_id}) cambiada a {'disponible' if available else 'agotado'}.")
+        return index.items[item_id]
+
+
+# Un menú en memoria por pizzería (ver tenants.py); con un solo tenant, el de siempre.
+_CACHES: Dict[str, MenuCache] = {}
+
+
+def current_cache() -> MenuCache:
+    """El menú de la pizzería del turno en curso."""
+    return tenants.scoped(_CACHES, lambda tenant: MenuCache(tenant.menu_path or DEFAULT_MENU_PATH))
+
+
+def _get_index() -> _MenuIndex:
+    return current_cache().index
 
-def load_menu_from_json(file_path: str = 'menu.json'):
+
+def set_menu_data(raw_menu: Any) -> None:
+    """Reemplaza el menú en caché con datos en el formato de menu.json (dict por ID_Plato o lista)."""
+    current_cache().set_menu_data(raw_menu)
+
+
+def load_menu_from_json(file_path: Optional[str] = None):
     """
-    Carga los datos del menú desde un archivo JSON a la variable global _MENU_DATA.
+    Carga los datos del menú desde un archivo JSON a la caché en memoria.
     Esta función se debe llamar UNA SOLA VEZ cuando el bot se inicia.
+    Sin file_path, usa el menú configurado para la pizzería activa.
     """
-    global _MENU_DATA
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            _MENU_DATA = json.load(f)
-        logger.info(f"✅ Menú cargado exitosamente en caché desde '{file_path}'. Se encontraron {len(_MENU_DATA)} ítems.")
-    except FileNotFoundError:
-        logger.error(f"❌ ERROR CRÍTICO: No se encontró el archivo del menú en '{file_path}'.")
-        _MENU_DATA = {} # Usamos un diccionario vacío en caso de error
-    except json.JSONDecodeError:
-        logger.error(f"❌ ERROR CRÍTICO: El archivo del menú '{file_path}' contiene un JSON inválido.")
-        _MENU_DATA = {}
+    current_cache().load_from_json(file_path)
+
+
+def get_menu_items() -> List[MenuItem]:
+    """Todos los registros del menú, en orden."""
+    return list(_get_index().items.values())
+
 
 def get_menu() -> list:
     """
-    Devuelve SIEMPRE una lista de los ítems del menú.
-    Si la caché es un diccionario (formato antiguo), lo convierte a una lista de sus valores.
-    """
-    if _MENU_DATA is None:
-        load_menu_from_json()
-    
-    # <<< LA SOLUCIÓN DEFINITIVA ESTÁ AQUÍ >>>
-    if isinstance(_MENU_DATA, dict):
-        # Si la caché es un diccionario, devuelve una lista de sus valores (los objetos de las pizzas)
-        return list(_MENU_DATA.values())
-    
-    # Si ya es una lista (formato correcto), la devuelve tal cual
-    return _MENU_DATA
\ No newline at end of file
+    Devuelve SIEMPRE una lista de los ítems del menú como diccionarios (formato de menu.json).
+    En caminos calientes conviene usar los registros (get_menu_items, get_available_items...).
+    """
+    return [record.to_dict() for record in _get_index().items.values()]
+
+
+def get_menu_version() -> int:
+    """Versión actual del menú en caché (cambia con cada recarga o cambio de disponibilidad)."""
+    return current_cache().version
+
+
+def get_categories() -> Tuple[str, ...]:
+    """Categorías del menú, ordenadas alfabéticamente."""
+    return _get_index().categories
+
+
+def get_available_items(category: Optional[str] = None) -> List[MenuItem]:
+    """Ítems disponibles en el orden del menú; solo los de una categoría si se indica."""
+    index = _get_index()
+    ids = index.available_by_category.get(category.strip().lower(), []) if category else index.available
+    return [index.items[item_id] for item_id in ids]
+
+
+def get_item_by_name(name: str) -> Optional[MenuItem]:
+    """Ítem con ese nombre exacto (sin distinguir mayúsculas), esté o no disponible."""
+    index = _get_index()
+    item_ids = index.by_name.get(str(name or '').strip().lower())
+    return index.items[item_ids[0]] if item_ids else None
+
+
+def find_item_id(reference: str, cache: Optional[MenuCache] = None) -> Optional[str]:
+    """ID de un ítem a partir de su ID, su nombre exacto o uno de sus alias (sin distinguir mayúsculas)."""
+    index = (cache or current_cache()).index
+    reference = str(reference or '').strip()
+    if reference in index.items:
+        return reference
+    key = reference.lower()
+    item_ids = index.by_name.get(key) or index.by_alias.get(key)
+    return item_ids[0] if item_ids else None
+
+
+def find_available_item(name: str, category: Optional[str] = None) -> Optional[MenuItem]:
+    """
+    Primer ítem disponible (en orden del menú, y de 'category' si se indica) cuyo nombre o
+    alias coincide exactamente con 'name', o None. Si el primero que comparte el alias está
+    agotado, sirve el siguiente.
+    """
+    index = _get_index()
+    key = str(name or '').strip().lower()
+    category_key = category.strip().lower() if category else None
+    candidates = [
+        index.items[item_id]
+        for item_id in index.by_name.get(key, ()) + index.by_alias.get(key, ())
+        if index.items[item_id].available and (category_key is None or index.items[item_id].category.lower() == category_key)
+    ]
+    return min(candidates, key=lambda record: index.position[record.item_id]) if candidates else None
+
+
+def set_item_availability(reference: str, available: bool) -> MenuItem:
+    """
+    Marca un ítem como disponible o agotado en caliente (lo ven al instante todas las
+    búsquedas y el resumen del menú de los agentes). Lanza KeyError si no existe.
+    El cambio vive en memoria: al reiniciar manda lo que diga menu.json.
+    """
+    return current_cache().set_item_availability(reference, available)
+
+
+def get_unavailable_items() -> List[MenuItem]:
+    return [record for record in _get_index().items.values() if not record.available]
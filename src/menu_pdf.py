@@ -0,0 +1,150 @@
+# ==============================================================================
+# menu_pdf.py - ENVÍO DEL MENÚ EN PDF REUTILIZANDO EL file_id DE TELEGRAM
+# ==============================================================================
+"""
+La herramienta solicitar_envio_menu_pdf devuelve action_request SEND_PDF_MENU_TO_USER
+y aquí se atiende. El PDF pesa cerca de 2 MB, así que solo se sube la primera vez:
+el file_id que devuelve Telegram se guarda en disco (MENU_PDF_FILE_ID_CACHE) bajo
+el sha256 del archivo, y los envíos siguientes mandan solo ese identificador.
+Si el PDF cambia, cambia el hash y se vuelve a subir. Los file_id son de cada bot,
+así que con varias pizzerías (tenants.py) cada una tiene su PDF y su caché.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.error import BadRequest
+
+import metrics
+import outbound_queue
+import tenants
+
+logger = logging.getLogger(__name__)
+
+ACTION_SEND_PDF_MENU = "SEND_PDF_MENU_TO_USER"
+MENU_PDF_PATH = os.environ.get("MENU_PDF_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu_pizzeria.pdf"))
+MENU_PDF_FILE_ID_CACHE = os.environ.get("MENU_PDF_FILE_ID_CACHE", "menu_pdf_file_id.json")
+MENU_PDF_FILENAME = "menu_pizzeria.pdf"
+
+MENU_PDF_SENDS_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_menu_pdf_sends_total", "Envíos del menú en PDF por origen (file_id en caché o subida).", ["source"]
+)
+
+_digest_cache: Dict[str, Tuple[Tuple[float, int], str]] = {} # ruta -> ((mtime, tamaño), sha256)
+_upload_lock = asyncio.Lock()
+
+
+def _pdf_digest(path: str) -> str:
+    """sha256 del PDF; solo se recalcula si cambian la fecha o el tamaño del archivo."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime, stat.st_size)
+    cached = _digest_cache.get(path)
+    if cached is None or cached[0] != signature:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        cached = _digest_cache[path] = (signature, digest.hexdigest())
+    return cached[1]
+
+
+def _pdf_path() -> str:
+    return tenants.current_tenant().menu_pdf_path or MENU_PDF_PATH
+
+
+def _file_id_cache_path() -> str:
+    return tenants.current_tenant().data_path(MENU_PDF_FILE_ID_CACHE)
+
+
+def _load_file_ids() -> Dict[str, str]:
+    try:
+        with open(_file_id_cache_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ No se pudo leer la caché de file_id del PDF ({e}). Se subirá de nuevo.")
+        return {}
+
+
+def _store_file_id(digest: str, file_id: Optional[str]) -> None:
+    """Guarda (o borra, con None) el file_id de un hash. Escritura atómica con os.replace."""
+    file_ids = _load_file_ids()
+    if file_id:
+        file_ids[digest] = file_id
+    else:
+        file_ids.pop(digest, None)
+    cache_path = _file_id_cache_path()
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(file_ids, f)
+    os.replace(tmp_path, cache_path)
+
+
+def _read_pdf(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _send_cached(message: Any, file_id: str) -> str:
+    """Reenvía el PDF por file_id. Devuelve 'sent', 'stale' (hay que subirlo de nuevo) o 'failed'."""
+    try:
+        await outbound_queue.OUTBOX.send(message.chat_id, lambda: message.reply_document(document=file_id), kind="document")
+    except BadRequest as e:
+        # file_id caducado o de otro bot (cambio de token): se olvida y se sube de nuevo.
+        logger.warning(f"⚠️ Telegram rechazó el file_id en caché del menú PDF ({e}). Se volverá a subir.")
+        return "stale"
+    except Exception as e:
+        # Chat bloqueado (Forbidden) o red caída tras los reintentos de la cola: subirlo tampoco serviría.
+        logger.error(f"❌ No se pudo enviar el menú en PDF al chat {message.chat_id}: {e!r}")
+        MENU_PDF_SENDS_TOTAL.inc(source="failed")
+        return "failed"
+    MENU_PDF_SENDS_TOTAL.inc(source="cached")
+    return "sent"
+
+
+async def send_menu_pdf(message: Any) -> bool:
+    """Envía el menú en PDF (el de la pizzería activa) al chat del mensaje. Devuelve False si no se pudo enviar."""
+    pdf_path = _pdf_path()
+    try:
+        digest = await asyncio.to_thread(_pdf_digest, pdf_path)
+    except OSError as e:
+        logger.error(f"❌ No se encontró el menú en PDF en '{pdf_path}': {e}")
+        MENU_PDF_SENDS_TOTAL.inc(source="failed")
+        return False
+
+    cached_file_id = _load_file_ids().get(digest)
+    if cached_file_id:
+        outcome = await _send_cached(message, cached_file_id)
+        if outcome != "stale":
+            return outcome == "sent"
+
+    # Solo una subida a la vez: si varios chats piden el PDF en frío, los demás reutilizan el file_id resultante.
+    async with _upload_lock:
+        file_id = _load_file_ids().get(digest)
+        if file_id and file_id != cached_file_id:
+            outcome = await _send_cached(message, file_id)
+            if outcome != "stale":
+                return outcome == "sent"
+        if file_id:
+            _store_file_id(digest, None)
+        try:
+            content = await asyncio.to_thread(_read_pdf, pdf_path)
+            sent = await outbound_queue.OUTBOX.send(
+                message.chat_id,
+                lambda: message.reply_document(document=content, filename=MENU_PDF_FILENAME),
+                kind="document",
+            )
+        except Exception as e:
+            logger.error(f"❌ No se pudo enviar el menú en PDF al chat {message.chat_id}: {e}", exc_info=True)
+            MENU_PDF_SENDS_TOTAL.inc(source="failed")
+            return False
+        MENU_PDF_SENDS_TOTAL.inc(source="upload")
+        new_file_id = sent.document.file_id if sent and sent.document else None
+        if new_file_id:
+            _store_file_id(digest, new_file_id)
+            logger.info(f"📎 Menú PDF subido a Telegram; file_id guardado para el hash {digest[:12]}.")
+    return True
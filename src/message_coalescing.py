@@ -0,0 +1,121 @@
+# ==============================================================================
+# message_coalescing.py - AGRUPACIÓN DE MENSAJES RÁPIDOS POR CHAT (DEBOUNCE)
+# ==============================================================================
+"""
+Los clientes suelen escribir "quiero", "una pizza", "americana familiar" en tres
+mensajes seguidos. Con una ventana de espera (COALESCE_WINDOW_S > 0), los mensajes
+de un mismo chat que llegan dentro de la ventana se unen en un único turno ADK.
+
+Si llega un mensaje mientras el turno anterior todavía espera su turno (el lock del
+usuario o el control de admisión), ese turno se cancela y sus mensajes se vuelven a
+juntar con el nuevo. Una vez arrancado el runner ya no se cancela: ADK ya anexó el
+mensaje del usuario a la sesión y puede haber cambiado el estado (clasificación,
+datos del cliente, transiciones) sin llamar a ninguna herramienta, así que repetirlo
+duplicaría el historial. En ese caso el mensaje nuevo espera al siguiente turno.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COALESCE_WINDOW_S = float(os.environ.get("COALESCE_WINDOW_S", "0")) # 0 = desactivado
+COALESCE_MAX_MESSAGES = int(os.environ.get("COALESCE_MAX_MESSAGES", "10"))
+
+COALESCED_MESSAGES = metrics.REGISTRY.histogram(
+    "pizzeria_coalesced_messages_per_turn", "Mensajes del usuario unidos en un mismo turno.",
+    buckets=(1, 2, 3, 4, 6, 10),
+)
+COALESCE_CANCELLED_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_coalesce_cancelled_turns_total", "Turnos ya iniciados cancelados para unirse a un mensaje nuevo."
+)
+
+
+class PendingTurn:
+    """
+    Turno agrupado en curso. El procesador marca 'started' justo antes de arrancar el
+    runner (o de responder sin él); desde ahí el turno ya no se puede cancelar.
+    """
+    __slots__ = ("texts", "stats", "started", "task")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.stats = metrics.TurnStats()
+        self.started = False
+        self.task: Optional[asyncio.Task] = None
+
+    def cancellable(self) -> bool:
+        return self.task is not None and not self.task.done() and not self.started
+
+
+class _ChatBuffer:
+    __slots__ = ("texts", "context", "timer", "turn")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.context: Any = None
+        self.timer: Optional[asyncio.Task] = None
+        self.turn: Optional[PendingTurn] = None
+
+
+ProcessFn = Callable[[str, str, Any, PendingTurn], Awaitable[None]]
+
+
+class MessageCoalescer:
+    """
+    process(chat_key, texto_unido, contexto, pending_turn) ejecuta el turno;
+    'contexto' es lo último que se pasó a submit (p.ej. el Update de Telegram).
+    """
+
+    def __init__(self, process: ProcessFn, window_s: float = COALESCE_WINDOW_S, max_messages: int = COALESCE_MAX_MESSAGES):
+        self.process = process
+        self.window_s = window_s
+        self.max_messages = max_messages
+        self._buffers: Dict[str, _ChatBuffer] = {}
+
+    def submit(self, chat_key: str, text: str, context: Any) -> None:
+        buffer = self._buffers.setdefault(chat_key, _ChatBuffer())
+        turn = buffer.turn
+        if turn is not None and turn.cancellable():
+            turn.task.cancel()
+            buffer.texts = turn.texts + buffer.texts
+            buffer.turn = None
+            COALESCE_CANCELLED_TOTAL.inc()
+            logger.info(f"✂️ Turno en curso del chat {chat_key} cancelado para unirlo con el mensaje nuevo.")
+
+        buffer.texts.append(text)
+        buffer.context = context
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+        # Con demasiados mensajes acumulados no se espera más.
+        delay = 0.0 if len(buffer.texts) >= self.max_messages else self.window_s
+        buffer.timer = asyncio.ensure_future(self._flush_after(chat_key, delay))
+
+    async def _flush_after(self, chat_key: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        buffer = self._buffers.get(chat_key)
+        if buffer is None or not buffer.texts:
+            return
+        turn = PendingTurn(buffer.texts)
+        buffer.texts = []
+        buffer.timer = None
+        buffer.turn = turn
+        COALESCED_MESSAGES.observe(len(turn.texts))
+        turn.task = asyncio.ensure_future(self._run(chat_key, turn, buffer.context))
+
+    async def _run(self, chat_key: str, turn: PendingTurn, context: Any) -> None:
+        try:
+            await self.process(chat_key, "\n".join(turn.texts), context, turn)
+        except asyncio.CancelledError:
+            logger.debug("Turno agrupado del chat %s cancelado.", chat_key)
+        except Exception as e:
+            logger.error(f"❌ Error procesando el turno agrupado del chat {chat_key}: {e}", exc_info=True)
+        finally:
+            buffer = self._buffers.get(chat_key)
+            if buffer is not None and buffer.turn is turn:
+                buffer.turn = None
+            if buffer is not None and buffer.turn is None and buffer.timer is None and not buffer.texts:
+                del self._buffers[chat_key]
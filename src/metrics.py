@@ -0,0 +1,320 @@
+# ==============================================================================
+# metrics.py - REGISTRO DE MÉTRICAS EN PROCESO (FORMATO PROMETHEUS)
+# ==============================================================================
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base común: nombre, ayuda, etiquetas y un lock propio por métrica."""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"La métrica '{self.name}' espera las etiquetas {self.labelnames}, recibió {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """El valor se calcula al momento de exponer las métricas (solo gauges sin etiquetas)."""
+        self._function = function
+
+    def value(self, **labels: Any) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {float(self._function())}"]
+            except Exception as e:
+                logger.warning(f"[Metrics] No se pudo evaluar el gauge '{self.name}': {e!r}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por cada combinación de etiquetas: [conteos por bucket..., +Inf], suma
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Colección de métricas. Registrar dos veces el mismo nombre devuelve la misma instancia."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"La métrica '{name}' ya existe con otro tipo ({metric.metric_type}).")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# ==============================================================================
+# MÉTRICAS DEL BOT
+# ==============================================================================
+TURNS_TOTAL = REGISTRY.counter("pizzeria_turns_total", "Turnos de conversación procesados.", ["outcome"])
+TURN_LATENCY = REGISTRY.histogram("pizzeria_turn_latency_seconds", "Latencia total del turno según la fase en la que empezó.", ["phase"])
+AGENT_RUN_LATENCY = REGISTRY.histogram("pizzeria_agent_run_seconds", "Duración de cada ejecución de agente dentro del orquestador.", ["agent"])
+MODEL_CALLS_TOTAL = REGISTRY.counter("pizzeria_model_calls_total", "Llamadas al modelo por agente.", ["agent"])
+MODEL_CALLS_PER_TURN = REGISTRY.histogram("pizzeria_model_calls_per_turn", "Llamadas al modelo por turno y agente.", ["agent"], buckets=COUNT_BUCKETS)
+TOOL_LATENCY = REGISTRY.histogram("pizzeria_tool_latency_seconds", "Latencia de ejecución por herramienta.", ["tool"])
+SHEETS_REQUESTS_TOTAL = REGISTRY.counter("pizzeria_sheets_requests_total", "Peticiones a Google Sheets por operación.", ["operation"])
+SHEETS_ERRORS_TOTAL = REGISTRY.counter("pizzeria_sheets_errors_total", "Errores de Google Sheets por operación.", ["operation"])
+MENU_LOOKUPS_TOTAL = REGISTRY.counter("pizzeria_menu_lookups_total", "Búsquedas en el menú por resultado (hit, miss, ambiguous).", ["result"])
+SESSIONS_ACTIVE = REGISTRY.gauge("pizzeria_sessions_active", "Sesiones ADK activas en memoria.")
+INTENTS_TOTAL = REGISTRY.counter("pizzeria_intents_total", "Distribución de intenciones clasificadas.", ["intent"])
+PROCESS_RESIDENT_MEMORY = REGISTRY.gauge("pizzeria_process_resident_memory_bytes", "Memoria residente del proceso (RSS).")
+
+
+def _resident_memory_bytes() -> float:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return float(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+    except (OSError, ValueError, IndexError):
+        # Fuera de Linux: pico de RSS (ru_maxrss está en KiB en Linux y en bytes en macOS).
+        return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+PROCESS_RESIDENT_MEMORY.set_function(_resident_memory_bytes)
+
+
+# ==============================================================================
+# ESTADÍSTICAS POR TURNO
+# ==============================================================================
+class TurnStats:
+    """Acumula lo que ocurre durante un turno (visible desde callbacks vía contextvar)."""
+    __slots__ = ("started_at", "model_calls", "tool_calls", "usage")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.model_calls: Dict[str, int] = {}
+        self.tool_calls = 0
+        # Consumo de tokens por agente durante el turno (lo rellena usage_accounting).
+        self.usage: Dict[str, Any] = {}
+
+    def record_model_call(self, agent_name: str) -> None:
+        self.model_calls[agent_name] = self.model_calls.get(agent_name, 0) + 1
+
+    def record_tool_call(self) -> None:
+        self.tool_calls += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+
+_current_turn: ContextVar[Optional[TurnStats]] = ContextVar("pizzeria_current_turn", default=None)
+
+
+def begin_turn(stats: Optional[TurnStats] = None) -> TurnStats:
+    """
+    Inicia la contabilidad de un turno en el contexto asíncrono actual.
+    Quien necesite observar el turno desde fuera (p.ej. message_coalescing) puede pasar su propio TurnStats.
+    """
+    stats = stats if stats is not None else TurnStats()
+    _current_turn.set(stats)
+    return stats
+
+
+def current_turn() -> Optional[TurnStats]:
+    return _current_turn.get()
+
+
+def end_turn(stats: TurnStats, phase: Optional[str], outcome: str = "ok") -> None:
+    """Cierra el turno: observa latencia y llamadas al modelo por agente."""
+    TURNS_TOTAL.inc(outcome=outcome)
+    TURN_LATENCY.observe(stats.elapsed(), phase=phase or "desconocida")
+    for agent_name, calls in stats.model_calls.items():
+        MODEL_CALLS_PER_TURN.observe(calls, agent=agent_name)
+    _current_turn.set(None)
+
+
+# ==============================================================================
+# EXPOSICIÓN HTTP
+# ==============================================================================
+_json_endpoints: Dict[str, Callable[[], Any]] = {}
+
+
+def register_json_endpoint(path: str, provider: Callable[[], Any]) -> None:
+    """Publica un informe JSON adicional en el servidor de métricas (p. ej. '/usage')."""
+    _json_endpoints[path] = provider
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path in _json_endpoints:
+            body = json.dumps(_json_endpoints[path](), ensure_ascii=False, default=str).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        elif path in ('/metrics', '/'):
+            body = self.registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Evitamos que cada scrape ensucie el log de la aplicación.
+        pass
+
+
+def start_metrics_server(port: int, addr: str = '0.0.0.0', registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Expone las métricas en http://<addr>:<port>/metrics desde un hilo daemon,
+    de modo que los scrapes nunca bloquean el event loop del bot.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"📈 Servidor de métricas escuchando en http://{addr}:{port}/metrics")
+    return server
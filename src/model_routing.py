@@ -0,0 +1,228 @@
+# ==============================================================================
+# model_routing.py - MODELO POR AGENTE (NIVELES) Y ENRUTADO SEGÚN LATENCIA/ERRORES
+# ==============================================================================
+"""
+Cada agente tiene un modelo principal y, opcionalmente, uno de respaldo.
+
+Resolución del modelo de un agente (de mayor a menor prioridad):
+1. Variable de entorno ADK_MODEL_<AGENTE> (p.ej. ADK_MODEL_ORDER_TAKING_AGENT).
+2. Archivo JSON indicado en ADK_MODEL_CONFIG:
+       {"tiers": {"fast": "...", "strong": "..."},
+        "agents": {"OrderTakingAgent": {"tier": "strong", "fallback": "gemini-2.0-flash"}}}
+3. El nivel por defecto del agente (AGENT_TIERS).
+
+Los niveles se configuran con ADK_MODEL_FAST, ADK_MODEL_NAME (nivel 'default',
+como hasta ahora) y ADK_MODEL_STRONG.
+
+Con ADK_MODEL_ROUTER=1, before_model_callback pasa al modelo de respaldo cuando
+el principal se degrada (tasa de errores o latencia media en la ventana reciente).
+Sin tráfico, la ventana del principal se vacía y vuelve a probarse solo.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIER_MODELS: Dict[str, str] = {
+    'fast': os.environ.get("ADK_MODEL_FAST", "gemini-2.5-flash-lite-preview-06-17"),
+    'default': os.environ.get("ADK_MODEL_NAME", "gemini-2.5-flash-lite-preview-06-17"),
+    'strong': os.environ.get("ADK_MODEL_STRONG", "gemini-2.5-flash"),
+}
+
+# El clasificador y el registro final son tareas mecánicas: van al nivel más barato.
+# La toma de pedido es la conversación más difícil: va al nivel fuerte.
+AGENT_TIERS: Dict[str, str] = {
+    'IntentClassifierAgent': 'fast',
+    'FinalizationAgent': 'fast',
+    'OrderTakingAgent': 'strong',
+}
+
+# Si el principal se degrada, cada nivel cae al inmediatamente inferior.
+TIER_FALLBACKS: Dict[str, str] = {'strong': 'default', 'default': 'fast'}
+
+ROUTER_ENABLED = os.environ.get("ADK_MODEL_ROUTER", "0").lower() in ("1", "true", "yes")
+ROUTER_WINDOW_S = float(os.environ.get("ADK_MODEL_ROUTER_WINDOW_S", "120"))
+ROUTER_MIN_SAMPLES = int(os.environ.get("ADK_MODEL_ROUTER_MIN_SAMPLES", "5"))
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ADK_MODEL_ROUTER_MAX_ERROR_RATE", "0.3"))
+ROUTER_MAX_LATENCY_S = float(os.environ.get("ADK_MODEL_ROUTER_MAX_LATENCY_S", "8"))
+# Una llamada sin after_model_callback pasado este tiempo se cuenta como error.
+ROUTER_STALE_CALL_S = float(os.environ.get("ADK_MODEL_ROUTER_STALE_CALL_S", "60"))
+
+MODEL_ROUTED_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_model_routed_total", "Llamadas al modelo por agente, modelo elegido y motivo.", ["agent", "model", "route"]
+)
+MODEL_CALL_LATENCY = metrics.REGISTRY.histogram(
+    "pizzeria_model_call_latency_seconds", "Latencia de cada llamada al modelo, por modelo.", ["model"]
+)
+MODEL_CALL_ERRORS_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_model_call_errors_total", "Llamadas al modelo fallidas o sin respuesta, por modelo.", ["model"]
+)
+
+
+def _env_name(agent_name: str) -> str:
+    """'OrderTakingAgent' -> 'ADK_MODEL_ORDER_TAKING_AGENT'."""
+    return "ADK_MODEL_" + re.sub(r'(?<!^)(?=[A-Z])', '_', agent_name).upper()
+
+
+class ModelConfig:
+    """Modelo principal y de respaldo de cada agente."""
+
+    def __init__(self, config_path: Optional[str] = None):
+        self.tier_models = dict(DEFAULT_TIER_MODELS)
+        self.agents: Dict[str, Dict[str, Any]] = {}
+        config_path = config_path if config_path is not None else os.environ.get("ADK_MODEL_CONFIG")
+        if config_path:
+            self._load(config_path)
+
+    def _load(self, config_path: str) -> None:
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"❌ No se pudo leer la configuración de modelos '{config_path}': {e}. Se usan los valores por defecto.")
+            return
+        self.tier_models.update(data.get('tiers') or {})
+        self.agents = {name: dict(entry) for name, entry in (data.get('agents') or {}).items()}
+        logger.info(f"✅ Configuración de modelos cargada desde '{config_path}' ({len(self.agents)} agentes).")
+
+    def tier_for(self, agent_name: str) -> str:
+        return self.agents.get(agent_name, {}).get('tier') or AGENT_TIERS.get(agent_name, 'default')
+
+    def model_for(self, agent_name: str) -> str:
+        """Modelo principal del agente."""
+        env_model = os.environ.get(_env_name(agent_name))
+        if env_model:
+            return env_model
+        entry = self.agents.get(agent_name, {})
+        if entry.get('model'):
+            return entry['model']
+        tier = self.tier_for(agent_name)
+        return self.tier_models.get(tier) or self.tier_models['default']
+
+    def fallback_for(self, agent_name: str) -> Optional[str]:
+        """Modelo de respaldo del agente, o None si no tiene uno distinto del principal."""
+        fallback = os.environ.get(_env_name(agent_name) + "_FALLBACK") or self.agents.get(agent_name, {}).get('fallback')
+        if not fallback:
+            fallback_tier = TIER_FALLBACKS.get(self.tier_for(agent_name))
+            fallback = self.tier_models.get(fallback_tier) if fallback_tier else None
+        return fallback if fallback and fallback != self.model_for(agent_name) else None
+
+
+class ModelRouter:
+    """Ventana deslizante de latencia y errores por modelo; decide principal o respaldo."""
+
+    def __init__(self, config: ModelConfig, enabled: bool = ROUTER_ENABLED):
+        self.config = config
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[Tuple[float, float, bool]]] = {}
+        self._pending: Dict[Tuple[str, str], Tuple[float, str]] = {}
+
+    # --- Observaciones ---
+    def record(self, model: str, latency_s: float, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            window = self._samples.setdefault(model, deque())
+            window.append((now, latency_s, ok))
+            self._trim(window, now)
+        if ok:
+            MODEL_CALL_LATENCY.observe(latency_s, model=model)
+        else:
+            MODEL_CALL_ERRORS_TOTAL.inc(model=model)
+
+    @staticmethod
+    def _trim(window: Deque[Tuple[float, float, bool]], now: float) -> None:
+        while window and now - window[0][0] > ROUTER_WINDOW_S:
+            window.popleft()
+
+    def begin_call(self, call_key: Tuple[str, str], model: str) -> None:
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for key, (started_at, pending_model) in list(self._pending.items()):
+                if now - started_at > ROUTER_STALE_CALL_S or key == call_key:
+                    stale.append((pending_model, now - started_at))
+                    del self._pending[key]
+            self._pending[call_key] = (now, model)
+        for pending_model, waited in stale:
+            self.record(pending_model, waited, ok=False)
+
+    def end_call(self, call_key: Tuple[str, str], error: bool = False) -> None:
+        with self._lock:
+            pending = self._pending.pop(call_key, None)
+        if pending is not None:
+            started_at, model = pending
+            self.record(model, time.monotonic() - started_at, ok=not error)
+
+    # --- Decisión ---
+    def health(self, model: str) -> Dict[str, Any]:
+        with self._lock:
+            window = self._samples.get(model, deque())
+            self._trim(window, time.monotonic())
+            samples = list(window)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        latencies = [latency for _, latency, ok in samples if ok]
+        mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        error_rate = errors / len(samples) if samples else 0.0
+        degraded = len(samples) >= ROUTER_MIN_SAMPLES and (
+            error_rate > ROUTER_MAX_ERROR_RATE or mean_latency > ROUTER_MAX_LATENCY_S
+        )
+        return {"samples": len(samples), "error_rate": round(error_rate, 3), "mean_latency_s": round(mean_latency, 3), "degraded": degraded}
+
+    def route(self, agent_name: str, requested_model: Optional[str]) -> str:
+        primary = requested_model or self.config.model_for(agent_name)
+        if not self.enabled:
+            return primary
+        fallback = self.config.fallback_for(agent_name)
+        if fallback and self.health(primary)["degraded"] and not self.health(fallback)["degraded"]:
+            MODEL_ROUTED_TOTAL.inc(agent=agent_name, model=fallback, route='fallback')
+            return fallback
+        MODEL_ROUTED_TOTAL.inc(agent=agent_name, model=primary, route='primary')
+        return primary
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            models = list(self._samples)
+        return {
+            "enabled": self.enabled,
+            "agents": {
+                agent: {"model": self.config.model_for(agent), "fallback": self.config.fallback_for(agent)}
+                for agent in sorted(set(AGENT_TIERS) | set(self.config.agents))
+            },
+            "models": {model: self.health(model) for model in models},
+        }
+
+
+MODEL_CONFIG = ModelConfig()
+ROUTER = ModelRouter(MODEL_CONFIG)
+metrics.register_json_endpoint('/models', ROUTER.report)
+
+
+def model_for(agent_name: str) -> str:
+    """Modelo principal configurado para un agente (para el parámetro model= de Agent)."""
+    return MODEL_CONFIG.model_for(agent_name)
+
+
+def _call_key(callback_context: Any) -> Tuple[str, str]:
+    return (callback_context.invocation_id, callback_context.agent_name)
+
+
+def route_model_request(callback_context: Any, llm_request: Any) -> None:
+    """Se llama desde before_model_callback: elige el modelo y abre la medición."""
+    llm_request.model = ROUTER.route(callback_context.agent_name, llm_request.model)
+    ROUTER.begin_call(_call_key(callback_context), llm_request.model)
+
+
+def record_model_result(callback_context: Any, llm_response: Any) -> None:
+    """Se llama desde after_model_callback: cierra la medición (las respuestas parciales no cuentan)."""
+    if getattr(llm_response, 'partial', False):
+        return
+    ROUTER.end_call(_call_key(callback_context), error=bool(getattr(llm_response, 'error_code', None)))
@@ -0,0 +1,166 @@
+# ==============================================================================
+# order_history.py - ÍNDICE LOCAL DEL HISTORIAL DE PEDIDOS POR CLIENTE
+# ==============================================================================
+"""
+Para "lo mismo de siempre" no hace falta recorrer 'Pedidos_Registrados': cada
+pedido registrado se añade a un archivo JSONL local (ORDER_HISTORY_PATH) y a un
+índice en memoria cliente -> últimos ORDER_HISTORY_PER_CUSTOMER pedidos.
+
+El archivo solo crece por el final; al cargarlo, si tiene muchas más líneas que
+las que conserva el índice, se reescribe compactado.
+
+Con varias pizzerías (tenants.py) cada una tiene su propio historial.
+
+Para construirlo desde una base SQLite ya existente (desde src/):
+    python order_history.py --rebuild-from-sqlite pizzeria.db
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import tenants
+
+logger = logging.getLogger(__name__)
+
+ORDER_HISTORY_PATH = os.environ.get("ORDER_HISTORY_PATH", "order_history.jsonl")
+ORDER_HISTORY_PER_CUSTOMER = int(os.environ.get("ORDER_HISTORY_PER_CUSTOMER", "20"))
+COMPACT_RATIO = 2 # Se compacta si el archivo tiene el doble de líneas de las que se conservan.
+
+
+def _signature(items: List[Dict[str, Any]]) -> Tuple[Tuple[str, int], ...]:
+    """Forma canónica de un pedido para contar repeticiones: mismos ítems y cantidades."""
+    totals: Dict[str, int] = {}
+    for item in items:
+        totals[item['name']] = totals.get(item['name'], 0) + int(item['quantity'])
+    return tuple(sorted(totals.items()))
+
+
+class OrderHistoryIndex:
+    def __init__(self, path: str = ORDER_HISTORY_PATH, per_customer: int = ORDER_HISTORY_PER_CUSTOMER):
+        self.path = path
+        self.per_customer = per_customer
+        self._orders: Optional[Dict[str, Deque[Dict[str, Any]]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Deque[Dict[str, Any]]]:
+        with self._lock:
+            if self._orders is not None:
+                return self._orders
+            orders: Dict[str, Deque[Dict[str, Any]]] = {}
+            lines = 0
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        lines += 1
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue # Línea a medio escribir tras una caída.
+                        orders.setdefault(entry['customer_id'], deque(maxlen=self.per_customer)).append(entry)
+            except FileNotFoundError:
+                pass
+            kept = sum(len(entries) for entries in orders.values())
+            if kept and lines > COMPACT_RATIO * kept:
+                self._rewrite(orders)
+                logger.info(f"🗜️ Historial de pedidos compactado: {lines} -> {kept} líneas.")
+            self._orders = orders
+            logger.info(f"📚 Historial de pedidos cargado: {kept} pedidos de {len(orders)} clientes.")
+            return orders
+
+    def _rewrite(self, orders: Dict[str, Deque[Dict[str, Any]]]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entries in orders.values():
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    async def load(self) -> None:
+        """Carga (y compacta si hace falta) el archivo en un hilo, fuera del event loop. Solo la primera vez."""
+        if self._orders is None:
+            await asyncio.to_thread(self._load)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        orders = self._load()
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            orders.setdefault(entry['customer_id'], deque(maxlen=self.per_customer)).append(entry)
+
+    async def record(self, customer_id: Any, order_id: str, timestamp: str, items: List[Dict[str, Any]]) -> None:
+        """Añade un pedido registrado al historial (solo nombre y cantidad de cada ítem)."""
+        entry = {
+            'customer_id': str(customer_id), 'order_id': order_id, 'timestamp': timestamp,
+            'items': [{'name': item['name'], 'quantity': int(item['quantity'])} for item in items],
+        }
+        await asyncio.to_thread(self._append, entry)
+
+    def orders_for(self, customer_id: Any) -> List[Dict[str, Any]]:
+        return list(self._load().get(str(customer_id), ()))
+
+    def last_order(self, customer_id: Any) -> Optional[Dict[str, Any]]:
+        orders = self.orders_for(customer_id)
+        return orders[-1] if orders else None
+
+    def most_frequent_order(self, customer_id: Any) -> Optional[Dict[str, Any]]:
+        """El pedido que más se repite; a igualdad, el más reciente."""
+        orders = self.orders_for(customer_id)
+        if not orders:
+            return None
+        counts = Counter(_signature(order['items']) for order in orders)
+        best = max(counts.values())
+        return next(order for order in reversed(orders) if counts[_signature(order['items'])] == best)
+
+    def rebuild_from_sqlite(self, db_path: str) -> int:
+        """Reconstruye el archivo a partir de la tabla 'pedidos' de persistence.SQLiteBackend."""
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = conn.execute(
+                "SELECT ID_Cliente, ID_Pedido, Fecha, Items_Detalle FROM pedidos WHERE Items_Detalle IS NOT NULL ORDER BY Fecha"
+            ).fetchall()
+        finally:
+            conn.close()
+        orders: Dict[str, Deque[Dict[str, Any]]] = {}
+        for customer_id, order_id, timestamp, items_json in rows:
+            items = [{'name': item['name'], 'quantity': int(item['quantity'])} for item in json.loads(items_json)]
+            if items:
+                entry = {'customer_id': str(customer_id), 'order_id': order_id, 'timestamp': timestamp, 'items': items}
+                orders.setdefault(entry['customer_id'], deque(maxlen=self.per_customer)).append(entry)
+        with self._lock:
+            self._rewrite(orders)
+            self._orders = orders
+        return sum(len(entries) for entries in orders.values())
+
+
+# Un historial por pizzería; con un solo tenant, el archivo de siempre.
+_histories: Dict[str, OrderHistoryIndex] = {}
+
+
+def get_history() -> OrderHistoryIndex:
+    """Historial de la pizzería activa."""
+    return tenants.scoped(_histories, lambda tenant: OrderHistoryIndex(tenant.data_path(ORDER_HISTORY_PATH)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Historial local de pedidos por cliente.")
+    parser.add_argument("--rebuild-from-sqlite", metavar="DB", help="Reconstruye el historial desde la base SQLite.")
+    parser.add_argument("--customer", help="Muestra el último pedido y el más frecuente de un cliente.")
+    args = parser.parse_args()
+    history = get_history()
+    if args.rebuild_from_sqlite:
+        print(f"Historial reconstruido con {history.rebuild_from_sqlite(args.rebuild_from_sqlite)} pedidos en '{history.path}'.")
+    if args.customer:
+        print(json.dumps({'last': history.last_order(args.customer), 'most_frequent': history.most_frequent_order(args.customer)},
+                         indent=2, ensure_ascii=False))
+    if not (args.rebuild_from_sqlite or args.customer):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# ==============================================================================
+# order_ids.py - GENERADOR DE IDS DE PEDIDO ÚNICOS ENTRE PROCESOS
+# ==============================================================================
+"""
+IDs de pedido del tipo PZ-1A2B3-C4D5E: 50 bits codificados en base32 de Crockford
+(sin I, L, O ni U, así se dictan por teléfono sin confusiones).
+
+    | 32 bits: segundos desde 2025-01-01 | 5 bits: nodo | 13 bits: secuencia |
+
+- El nodo (ORDER_NODE_ID, 0-31) distingue procesos o máquinas: sin coordinación.
+- La secuencia permite 8192 pedidos por segundo y nodo; si se agota, o si el reloj
+  retrocede, se sigue con el segundo lógico siguiente, así que los IDs de un mismo
+  nodo siempre crecen.
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+EPOCH_S = 1735689600 # 2025-01-01 00:00:00 UTC
+NODE_BITS = 5
+SEQUENCE_BITS = 13
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_CHARS = 10 # 50 bits / 5 bits por carácter
+PREFIX = "PZ-"
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODE: Dict[str, int] = {char: value for value, char in enumerate(CROCKFORD_ALPHABET)}
+_DECODE.update({'O': 0, 'I': 1, 'L': 1}) # Lo que se suele confundir al dictar o leer.
+
+
+def encode_base32(value: int, length: int = ID_CHARS) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def decode_base32(text: str) -> int:
+    value = 0
+    for char in text.upper():
+        if char == '-':
+            continue
+        value = (value << 5) | _DECODE[char]
+    return value
+
+
+class OrderIdGenerator:
+    """Generador monotónico por nodo. Seguro entre hilos."""
+
+    def __init__(self, node_id: int):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"ORDER_NODE_ID debe estar entre 0 y {MAX_NODE_ID} (recibido: {node_id}).")
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._last_second = 0
+        self._sequence = 0
+
+    def next_id(self) -> str:
+        with self._lock:
+            second = max(int(time.time()) - EPOCH_S, self._last_second)
+            if second == self._last_second:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    # Secuencia agotada: tomamos prestado el segundo siguiente.
+                    second += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_second = second
+            value = (second << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+        code = encode_base32(value)
+        return f"{PREFIX}{code[:5]}-{code[5:]}"
+
+
+def parse_order_id(order_id: str) -> Dict[str, int]:
+    """Descompone un ID (tolera minúsculas, sin guiones y letras confundibles) en fecha, nodo y secuencia."""
+    text = order_id.strip().upper()
+    if text.startswith(PREFIX):
+        text = text[len(PREFIX):]
+    value = decode_base32(text)
+    return {
+        'timestamp': (value >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_S,
+        'node_id': (value >> SEQUENCE_BITS) & MAX_NODE_ID,
+        'sequence': value & MAX_SEQUENCE,
+    }
+
+
+ORDER_IDS = OrderIdGenerator(int(os.environ.get("ORDER_NODE_ID", "0")))
+
+
+def new_order_id() -> str:
+    return ORDER_IDS.next_id()
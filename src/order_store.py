@@ -0,0 +1,311 @@
+# ==============================================================================
+# order_store.py - ALMACÉN COLUMNAR LOCAL DE PEDIDOS Y REPORTES DE VENTAS
+# ==============================================================================
+"""
+Cada pedido registrado se añade, además, a un almacén columnar en ORDER_STORE_DIR:
+un archivo binario por columna con tipo fijo, que solo crece por el final.
+
+    Pedidos: orders_ts (int64, hora local en segundos), orders_total (int64, céntimos),
+             orders_qty (int32, unidades en el pedido)
+    Líneas:  lines_order (int64, índice del pedido), lines_item (int32, código del ítem),
+             lines_qty (int32), lines_price (int64, céntimos)
+    items.json: código -> nombre del ítem
+
+La escritura usa solo el módulo 'array' de la biblioteca estándar; los reportes
+leen las columnas con NumPy (np.fromfile) y agregan con operaciones vectorizadas,
+sin tocar la API de Sheets.
+Con varias pizzerías (tenants.py) cada una tiene su propio directorio.
+
+Uso (desde src/):
+    python order_store.py report                     # popularidad, ingresos por día/hora, tamaño de cesta
+    python order_store.py report --since 2025-07-01 --json
+    python order_store.py import-sqlite pizzeria.db  # carga pedidos ya registrados en SQLite
+    python order_store.py bench --orders 300000      # año sintético para medir los reportes
+"""
+import argparse
+import asyncio
+import calendar
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError: # Solo los reportes necesitan NumPy; el registro de pedidos no.
+    np = None
+
+import tenants
+
+logger = logging.getLogger(__name__)
+
+ORDER_STORE_DIR = os.environ.get("ORDER_STORE_DIR", "order_store")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH_DAY = datetime(1970, 1, 1)
+
+# columna -> (código de tipo de 'array', dtype de NumPy)
+ORDER_COLUMNS = {'orders_ts': ('q', 'int64'), 'orders_total': ('q', 'int64'), 'orders_qty': ('i', 'int32')}
+LINE_COLUMNS = {'lines_order': ('q', 'int64'), 'lines_item': ('i', 'int32'), 'lines_qty': ('i', 'int32'), 'lines_price': ('q', 'int64')}
+
+
+def _cents(value: Any) -> int:
+    return int(round(float(value or 0) * 100))
+
+
+def _local_seconds(timestamp: str) -> int:
+    """'2025-07-06 21:15:00' -> segundos de reloj local (tratados como UTC para agrupar por día/hora sin zona)."""
+    return calendar.timegm(datetime.strptime(timestamp, TIMESTAMP_FORMAT).timetuple())
+
+
+class ColumnarOrderStore:
+    def __init__(self, directory: str = ORDER_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._item_codes: Optional[Dict[str, int]] = None
+        self._n_orders: Optional[int] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _column_length(self, name: str, typecode: str) -> int:
+        try:
+            return os.path.getsize(self._path(name)) // array(typecode).itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _open(self) -> None:
+        """Carga el diccionario de ítems y recorta columnas que quedaron a medio escribir tras una caída."""
+        if self._item_codes is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, "items.json"), "r", encoding="utf-8") as f:
+                names = json.load(f)
+        except FileNotFoundError:
+            names = []
+        self._item_codes = {name: code for code, name in enumerate(names)}
+        # Las líneas se escriben antes que el pedido: el número de pedidos completos manda.
+        n_orders = min(self._column_length(name, typecode) for name, (typecode, _) in ORDER_COLUMNS.items())
+        for name, (typecode, _) in ORDER_COLUMNS.items():
+            self._truncate(name, typecode, n_orders)
+        n_lines = min(self._column_length(name, typecode) for name, (typecode, _) in LINE_COLUMNS.items())
+        if n_lines:
+            line_orders = array('q')
+            with open(self._path('lines_order'), "rb") as f:
+                line_orders.fromfile(f, n_lines)
+            while n_lines and line_orders[n_lines - 1] >= n_orders:
+                n_lines -= 1
+        for name, (typecode, _) in LINE_COLUMNS.items():
+            self._truncate(name, typecode, n_lines)
+        self._n_orders = n_orders
+
+    def _truncate(self, name: str, typecode: str, length: int) -> None:
+        if self._column_length(name, typecode) > length:
+            with open(self._path(name), "r+b") as f:
+                f.truncate(length * array(typecode).itemsize)
+
+    def _append_columns(self, columns: Dict[str, Any], values: Dict[str, List[int]]) -> None:
+        for name, (typecode, _) in columns.items():
+            with open(self._path(name), "ab") as f:
+                array(typecode, values[name]).tofile(f)
+
+    def _item_code(self, name: str, new_names: List[str]) -> int:
+        code = self._item_codes.get(name)
+        if code is None:
+            code = len(self._item_codes)
+            self._item_codes[name] = code
+            new_names.append(name)
+        return code
+
+    def append_orders(self, orders: List[Dict[str, Any]]) -> int:
+        """
+        Añade pedidos {'timestamp', 'total', 'items': [{'name','quantity','price'}]}.
+        Devuelve cuántos se añadieron. Seguro entre hilos.
+        """
+        with self._lock:
+            self._open()
+            new_names: List[str] = []
+            order_values: Dict[str, List[int]] = {name: [] for name in ORDER_COLUMNS}
+            line_values: Dict[str, List[int]] = {name: [] for name in LINE_COLUMNS}
+            for offset, order in enumerate(orders):
+                order_index = self._n_orders + offset
+                quantity = 0
+                for item in order['items']:
+                    line_values['lines_order'].append(order_index)
+                    line_values['lines_item'].append(self._item_code(item['name'], new_names))
+                    line_values['lines_qty'].append(int(item['quantity']))
+                    line_values['lines_price'].append(_cents(item.get('price')))
+                    quantity += int(item['quantity'])
+                order_values['orders_ts'].append(_local_seconds(order['timestamp']))
+                order_values['orders_total'].append(_cents(order['total']))
+                order_values['orders_qty'].append(quantity)
+            if new_names:
+                names = sorted(self._item_codes, key=self._item_codes.get)
+                tmp_path = os.path.join(self.directory, "items.json.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(names, f, ensure_ascii=False)
+                os.replace(tmp_path, os.path.join(self.directory, "items.json"))
+            self._append_columns(LINE_COLUMNS, line_values)
+            self._append_columns(ORDER_COLUMNS, order_values)
+            self._n_orders += len(orders)
+            return len(orders)
+
+    async def record(self, timestamp: str, total: float, items: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self.append_orders, [{'timestamp': timestamp, 'total': total, 'items': items}])
+
+    def load(self) -> Dict[str, Any]:
+        """Columnas como arrays de NumPy, más la lista de nombres de ítems."""
+        if np is None:
+            raise RuntimeError("Los reportes necesitan NumPy: pip install numpy")
+        with self._lock:
+            self._open()
+            data = {}
+            for name, (_, dtype) in {**ORDER_COLUMNS, **LINE_COLUMNS}.items():
+                path = self._path(name)
+                data[name] = np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.zeros(0, dtype=dtype)
+            data['item_names'] = sorted(self._item_codes, key=self._item_codes.get)
+        return data
+
+
+# Un almacén por pizzería (ver tenants.py); con un solo tenant, el directorio de siempre.
+_stores: Dict[str, ColumnarOrderStore] = {}
+
+
+def get_store() -> ColumnarOrderStore:
+    """Almacén de la pizzería activa."""
+    return tenants.scoped(_stores, lambda tenant: ColumnarOrderStore(tenant.data_path(ORDER_STORE_DIR)))
+
+
+def sales_report(data: Dict[str, Any], since: Optional[str] = None, until: Optional[str] = None, top: int = 10) -> Dict[str, Any]:
+    """Agregados vectorizados sobre las columnas de load(). Fechas 'YYYY-MM-DD' (hasta exclusiva)."""
+    ts = data['orders_ts']
+    mask = np.ones(len(ts), dtype=bool)
+    if since:
+        mask &= ts >= _local_seconds(f"{since} 00:00:00")
+    if until:
+        mask &= ts < _local_seconds(f"{until} 00:00:00")
+    totals = data['orders_total'][mask]
+    selected_ts = ts[mask]
+    n_orders = int(mask.sum())
+
+    line_mask = mask[data['lines_order']] if len(data['lines_order']) else np.zeros(0, dtype=bool)
+    line_items = data['lines_item'][line_mask]
+    line_qty = data['lines_qty'][line_mask]
+    line_revenue = line_qty.astype(np.int64) * data['lines_price'][line_mask]
+    n_items = len(data['item_names'])
+    units_by_item = np.bincount(line_items, weights=line_qty, minlength=n_items)
+    revenue_by_item = np.bincount(line_items, weights=line_revenue, minlength=n_items)
+    top_codes = np.argsort(units_by_item)[::-1][:top]
+
+    days, day_index = np.unique(selected_ts // 86400, return_inverse=True)
+    revenue_by_day = np.bincount(day_index, weights=totals, minlength=len(days))
+    orders_by_day = np.bincount(day_index, minlength=len(days))
+    hours = (selected_ts // 3600) % 24
+    revenue_by_hour = np.bincount(hours, weights=totals, minlength=24)
+    orders_by_hour = np.bincount(hours, minlength=24)
+    basket = np.bincount(data['orders_qty'][mask])
+
+    return {
+        'orders': n_orders,
+        'revenue': round(float(totals.sum()) / 100, 2),
+        'average_ticket': round(float(totals.mean()) / 100, 2) if n_orders else 0.0,
+        'top_items': [
+            {'name': data['item_names'][code], 'units': int(units_by_item[code]), 'revenue': round(float(revenue_by_item[code]) / 100, 2)}
+            for code in top_codes if units_by_item[code] > 0
+        ],
+        'revenue_by_day': {
+            (EPOCH_DAY + timedelta(days=int(day))).strftime("%Y-%m-%d"): {'orders': int(count), 'revenue': round(float(revenue) / 100, 2)}
+            for day, count, revenue in zip(days, orders_by_day, revenue_by_day)
+        },
+        'revenue_by_hour': {
+            f"{hour:02d}:00": {'orders': int(orders_by_hour[hour]), 'revenue': round(float(revenue_by_hour[hour]) / 100, 2)}
+            for hour in range(24) if orders_by_hour[hour]
+        },
+        'basket_size': {int(size): int(count) for size, count in enumerate(basket) if count},
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"Pedidos: {report['orders']}  |  Ingresos: S/ {report['revenue']:.2f}  |  Ticket medio: S/ {report['average_ticket']:.2f}")
+    print("\nMás vendidos:")
+    for row in report['top_items']:
+        print(f"  {row['units']:>7}  {row['name']:<40} S/ {row['revenue']:>10.2f}")
+    print("\nIngresos por hora:")
+    for hour, row in report['revenue_by_hour'].items():
+        print(f"  {hour}  {row['orders']:>7} pedidos  S/ {row['revenue']:>10.2f}")
+    print("\nTamaño de cesta (unidades -> pedidos):")
+    for size, count in report['basket_size'].items():
+        print(f"  {size:>3}  {count}")
+    print(f"\nDías con ventas: {len(report['revenue_by_day'])} (detalle con --json)")
+
+
+def _import_sqlite(store: ColumnarOrderStore, db_path: str) -> int:
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT Fecha, Total, Items_Detalle FROM pedidos WHERE Items_Detalle IS NOT NULL ORDER BY Fecha").fetchall()
+    finally:
+        conn.close()
+    return store.append_orders([{'timestamp': ts, 'total': total, 'items': json.loads(items)} for ts, total, items in rows])
+
+
+def _synthetic_year(store: ColumnarOrderStore, n_orders: int, seed: int = 7) -> None:
+    rng = np.random.default_rng(seed)
+    names = [f"Ítem {i}" for i in range(60)]
+    prices = rng.integers(500, 6000, len(names)) / 100
+    start = datetime(2025, 1, 1).timestamp()
+    orders = []
+    for ts in np.sort(rng.uniform(start, start + 365 * 86400, n_orders)):
+        codes = rng.integers(0, len(names), rng.integers(1, 5))
+        items = [{'name': names[c], 'quantity': int(rng.integers(1, 4)), 'price': float(prices[c])} for c in codes]
+        orders.append({'timestamp': datetime.fromtimestamp(ts).strftime(TIMESTAMP_FORMAT),
+                       'total': sum(i['quantity'] * i['price'] for i in items), 'items': items})
+    store.append_orders(orders)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Almacén columnar de pedidos y reportes de ventas.")
+    parser.add_argument("--dir", default=ORDER_STORE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report", help="Reporte de ventas.")
+    report_parser.add_argument("--since", help="Desde esta fecha (YYYY-MM-DD).")
+    report_parser.add_argument("--until", help="Hasta esta fecha, exclusiva (YYYY-MM-DD).")
+    report_parser.add_argument("--top", type=int, default=10)
+    report_parser.add_argument("--json", action="store_true")
+    import_parser = sub.add_parser("import-sqlite", help="Carga pedidos desde la base SQLite de persistence.py.")
+    import_parser.add_argument("db")
+    bench_parser = sub.add_parser("bench", help="Genera un año sintético en un directorio temporal y mide el reporte.")
+    bench_parser.add_argument("--orders", type=int, default=300000)
+    args = parser.parse_args()
+
+    if args.command == "import-sqlite":
+        print(f"Importados {_import_sqlite(ColumnarOrderStore(args.dir), args.db)} pedidos en '{args.dir}'.")
+        return
+    if np is None:
+        parser.error("Los reportes necesitan NumPy: pip install numpy")
+    if args.command == "bench":
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            store = ColumnarOrderStore(directory)
+            _synthetic_year(store, args.orders)
+            started_at = time.perf_counter()
+            report = sales_report(store.load())
+            elapsed = time.perf_counter() - started_at
+        print(f"{report['orders']} pedidos: carga + reporte en {elapsed * 1000:.1f} ms")
+        return
+
+    started_at = time.perf_counter()
+    report = sales_report(ColumnarOrderStore(args.dir).load(), args.since, args.until, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        _print_report(report)
+        print(f"(calculado en {(time.perf_counter() - started_at) * 1000:.1f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# ==============================================================================
+# outbound_queue.py - COLA DE ENVÍOS A TELEGRAM CON LÍMITES DE TASA Y RETRY_AFTER
+# ==============================================================================
+"""
+Todos los envíos al usuario pasan por aquí en lugar de llamar directamente a
+reply_text. Telegram permite ~30 mensajes/s por bot y ~1 mensaje/s por chat:
+
+- Un token bucket global y otro por chat regulan el ritmo.
+- Cada chat tiene su propio trabajador, así los mensajes salen en orden.
+- Ante un 429 (RetryAfter) se espera lo indicado, se pausa el bucket global y se
+  reintenta el MISMO envío, sin adelantar los siguientes del chat.
+- Errores de red transitorios se reintentan con backoff; BadRequest no.
+
+Para probar contra un Bot API local (fake_bot_api.py) basta con TELEGRAM_API_BASE_URL.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+import tenants
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "25"))    # mensajes/s, algo por debajo de 30
+GLOBAL_BURST = float(os.environ.get("OUTBOUND_GLOBAL_BURST", "25"))
+CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", "1"))         # mensajes/s por chat
+CHAT_BURST = float(os.environ.get("OUTBOUND_CHAT_BURST", "3"))
+MAX_ATTEMPTS = int(os.environ.get("OUTBOUND_MAX_ATTEMPTS", "5"))
+# El trabajador de un chat sigue vivo un rato sin trabajo para no regalar una ráfaga nueva.
+CHAT_IDLE_EXIT_S = 5.0
+
+OUTBOUND_QUEUE_DEPTH = metrics.REGISTRY.gauge("pizzeria_outbound_queue_depth", "Envíos a Telegram pendientes en cola.")
+OUTBOUND_QUEUE_LAG = metrics.REGISTRY.histogram(
+    "pizzeria_outbound_queue_lag_seconds", "Tiempo desde que se encola un envío hasta que sale.", ["kind"]
+)
+OUTBOUND_SENT_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_outbound_sent_total", "Envíos a Telegram por tipo y resultado.", ["kind", "outcome"]
+)
+OUTBOUND_RETRY_AFTER_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_outbound_retry_after_total", "Respuestas 429 RetryAfter recibidas de Telegram."
+)
+
+
+def _seconds(value: Any) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value or 0)
+
+
+class TokenBucket:
+    """Token bucket clásico: 'rate' fichas por segundo, hasta 'capacity' acumuladas."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        """Tras un 429 no se entregan fichas hasta que pase el retry_after."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class _Job:
+    __slots__ = ("send", "kind", "future", "enqueued_at")
+
+    def __init__(self, send: Callable[[], Awaitable[Any]], kind: str, future: asyncio.Future):
+        self.send = send
+        self.kind = kind
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _ChatLane:
+    """Estado de un chat: sus envíos en orden, su bucket y su trabajador (que duerme en 'wakeup')."""
+    __slots__ = ("jobs", "bucket", "wakeup", "worker")
+
+    def __init__(self, bucket: TokenBucket):
+        self.jobs: Deque[_Job] = deque()
+        self.bucket = bucket
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class OutboundQueue:
+    """Cola de envíos con un trabajador por chat y límites global/por chat."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST, max_attempts: int = MAX_ATTEMPTS):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self._chats: Dict[Any, _ChatLane] = {}
+        self._depth = 0
+
+    def submit(self, chat_id: Any, send: Callable[[], Awaitable[Any]], kind: str = "message") -> asyncio.Future:
+        """Encola un envío; el futuro devuelto se resuelve con el resultado de la llamada a Telegram."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        lane = self._chats.get(chat_id)
+        if lane is None:
+            lane = self._chats[chat_id] = _ChatLane(TokenBucket(self.chat_rate, self.chat_burst))
+        lane.jobs.append(_Job(send, kind, future))
+        lane.wakeup.set()
+        if lane.worker is None or lane.worker.done():
+            # Contexto limpio: el trabajador sobrevive al turno que encoló el primer envío.
+            lane.worker = tenants.detached_context().run(loop.create_task, self._chat_worker(chat_id, lane), name=f"outbound-{chat_id}")
+        self._depth += 1
+        OUTBOUND_QUEUE_DEPTH.set(self._depth)
+        return future
+
+    async def send(self, chat_id: Any, send: Callable[[], Awaitable[Any]], kind: str = "message") -> Any:
+        return await self.submit(chat_id, send, kind)
+
+    async def _chat_worker(self, chat_id: Any, lane: _ChatLane) -> None:
+        while True:
+            if not lane.jobs:
+                # Sin trabajo: se duerme hasta que submit despierte al chat o pase CHAT_IDLE_EXIT_S.
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), CHAT_IDLE_EXIT_S)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            job = lane.jobs[0]
+            await self._deliver(job, lane.bucket)
+            lane.jobs.popleft()
+            self._depth -= 1
+            OUTBOUND_QUEUE_DEPTH.set(self._depth)
+        # Nadie encoló durante la espera final: se libera el estado del chat.
+        if not lane.jobs and self._chats.get(chat_id) is lane and lane.worker is asyncio.current_task():
+            del self._chats[chat_id]
+
+    async def _deliver(self, job: _Job, bucket: TokenBucket) -> None:
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            if attempt == 0:
+                OUTBOUND_QUEUE_LAG.observe(time.monotonic() - job.enqueued_at, kind=job.kind)
+            attempt += 1
+            try:
+                result = await job.send()
+            except RetryAfter as e:
+                wait_s = _seconds(e.retry_after)
+                OUTBOUND_RETRY_AFTER_TOTAL.inc()
+                logger.warning(f"🐢 Telegram pidió esperar {wait_s:.1f}s (429). Reintentando el mismo envío en orden.")
+                bucket.pause(wait_s)
+                self.global_bucket.pause(wait_s)
+                continue # Un 429 no consume intentos: Telegram nos dice exactamente cuándo volver.
+            except (BadRequest, Forbidden) as e:
+                OUTBOUND_SENT_TOTAL.inc(kind=job.kind, outcome='rejected')
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            except NetworkError as e:
+                if attempt >= self.max_attempts:
+                    OUTBOUND_SENT_TOTAL.inc(kind=job.kind, outcome='failed')
+                    logger.error(f"❌ Envío a Telegram descartado tras {attempt} intentos: {e!r}")
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    return
+                await asyncio.sleep(min(10.0, 0.5 * (2 ** attempt)))
+                continue
+            except Exception as e:
+                OUTBOUND_SENT_TOTAL.inc(kind=job.kind, outcome='failed')
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            OUTBOUND_SENT_TOTAL.inc(kind=job.kind, outcome='ok')
+            if not job.future.done():
+                job.future.set_result(result)
+            return
+
+    async def drain(self, timeout_s: float = 5.0) -> None:
+        """Espera (con límite) a que salgan los envíos pendientes; para el apagado."""
+        deadline = time.monotonic() + timeout_s
+        while self._depth > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._depth:
+            logger.warning(f"⚠️ Quedaron {self._depth} envíos sin salir al apagar.")
+
+
+OUTBOX = OutboundQueue()
+
+
+async def reply_text(message: Any, text: str, **kwargs: Any) -> Any:
+    """Equivalente a message.reply_text(...) pero a través de la cola."""
+    return await OUTBOX.send(message.chat_id, lambda: message.reply_text(text, **kwargs), kind="text")
+
+
+async def reply_html(message: Any, text: str, **kwargs: Any) -> Any:
+    return await OUTBOX.send(message.chat_id, lambda: message.reply_html(text, **kwargs), kind="text")
+
+
+async def edit_text(message: Any, text: str, **kwargs: Any) -> Any:
+    return await OUTBOX.send(message.chat_id, lambda: message.edit_text(text, **kwargs), kind="edit")
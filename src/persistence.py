@@ -0,0 +1,322 @@
+# ==============================================================================
+# persistence.py - CAPA DE PERSISTENCIA DE CLIENTES Y PEDIDOS (SQLITE / SHEETS)
+# ==============================================================================
+"""
+Las herramientas ya no hablan con gspread directamente sino con un backend:
+
+- SheetsBackend: el comportamiento de siempre (hojas 'Clientes' y 'Pedidos_Registrados').
+- SQLiteBackend: base local en modo WAL, indexada por cliente y por pedido. Las
+  consultas van a un único hilo dedicado, así que no bloquean el event loop.
+- MirroredBackend: SQLite como sistema de registro y, en segundo plano, una copia
+  en una sola dirección hacia las pestañas de Sheets para que el personal siga
+  trabajando igual. Si Sheets falla, los cambios esperan en cola y se reintentan.
+
+Configuración: PERSISTENCE_BACKEND=sheets (por defecto) | sqlite, SQLITE_DB_PATH,
+SHEETS_MIRROR=1 para activar la copia a Sheets con SQLite. Con varias pizzerías
+(tenants.py) cada una tiene su backend: su hoja y su propia base SQLite.
+
+Para sembrar una base SQLite nueva con lo que ya hay en Sheets (desde src/):
+    python persistence.py --import-sheets
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+import tenants
+from sheets_client import get_worksheet
+from turn_deadline import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_BACKEND = os.environ.get("PERSISTENCE_BACKEND", "sheets").lower()
+SQLITE_DB_PATH = os.environ.get("SQLITE_DB_PATH", "pizzeria.db")
+SHEETS_MIRROR = os.environ.get("SHEETS_MIRROR", "0").lower() in ("1", "true", "yes")
+MIRROR_MAX_DELAY_S = 60.0
+
+# Columnas de las pestañas, en el orden en que se escriben las filas.
+CUSTOMER_COLUMNS: Tuple[str, ...] = ('ID_Cliente', 'Nombre', 'Direccion_Predeterminada', 'Fecha_Registro', 'Fecha_Ultimo_Pedido')
+ORDER_COLUMNS: Tuple[str, ...] = ('ID_Pedido', 'Fecha', 'ID_Cliente', 'Nombre_Cliente', 'Items', 'Total', 'Direccion', 'Estado')
+# Además de las columnas de la hoja, un pedido lleva 'Items_Detalle': la lista de ítems del carrito.
+ORDER_ITEMS_KEY = 'Items_Detalle'
+
+PERSISTENCE_OPS = metrics.REGISTRY.histogram(
+    "pizzeria_persistence_seconds", "Latencia de las operaciones de persistencia por backend y operación.", ["backend", "operation"]
+)
+MIRROR_PENDING = metrics.REGISTRY.gauge("pizzeria_sheets_mirror_pending", "Cambios pendientes de copiar a Google Sheets.")
+MIRROR_FAILURES_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_sheets_mirror_failures_total", "Intentos fallidos de copiar un cambio a Google Sheets.", ["operation"]
+)
+
+
+def format_order_items(items: List[Dict[str, Any]]) -> str:
+    """'2x Pizza Americana, 1x Coca Cola': el formato legible de la columna Items."""
+    return ", ".join(f"{item['quantity']}x {item['name']}" for item in items)
+
+
+class PersistenceBackend:
+    """Interfaz común. Todos los métodos son asíncronos."""
+    name = "base"
+
+    async def get_customer(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def upsert_customer(self, user_id: Any, name: str, address: str, timestamp: str) -> None:
+        """Crea el cliente o actualiza nombre, dirección y fecha del último pedido."""
+        raise NotImplementedError
+
+    async def append_order(self, order: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class SheetsBackend(PersistenceBackend):
+    """Google Sheets como base de datos (comportamiento original). Usa la hoja de la pizzería activa."""
+    name = "sheets"
+
+    @staticmethod
+    def _worksheet(name: str) -> Any:
+        worksheet = get_worksheet(name)
+        if worksheet is None:
+            raise RuntimeError(f"La pestaña '{name}' de Google Sheets no está disponible.")
+        return worksheet
+
+    async def get_customer(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        # Dentro de un turno, cada lectura tiene como límite una parte del plazo del turno.
+        customers_ws = await run_in_thread(self._worksheet, 'Clientes', stage='sheets:Clientes')
+        all_customers = await run_in_thread(customers_ws.get_all_records, stage='sheets:Clientes')
+        return next((row for row in all_customers if str(row.get('ID_Cliente')).strip() == str(user_id).strip()), None)
+
+    async def upsert_customer(self, user_id: Any, name: str, address: str, timestamp: str) -> None:
+        clientes_ws = await asyncio.to_thread(self._worksheet, 'Clientes')
+        # Buscamos si el cliente ya existe por su ID en la primera columna
+        cell = await asyncio.to_thread(clientes_ws.find, str(user_id), in_column=1)
+        if cell:
+            logger.info(f"Cliente con ID '{user_id}' encontrado en la fila {cell.row}. Actualizando datos.")
+            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 2, name)
+            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 3, address)
+            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 5, timestamp) # Fecha de última interacción
+        else:
+            logger.info(f"Cliente con ID '{user_id}' no encontrado. Creando nuevo registro.")
+            await asyncio.to_thread(clientes_ws.append_row, [str(user_id), name, address, timestamp, timestamp])
+
+    async def append_order(self, order: Dict[str, Any]) -> None:
+        pedidos_ws = await asyncio.to_thread(self._worksheet, 'Pedidos_Registrados')
+        await asyncio.to_thread(pedidos_ws.append_row, [order.get(column) for column in ORDER_COLUMNS])
+
+
+class SQLiteBackend(PersistenceBackend):
+    """SQLite en modo WAL. Un solo hilo dedicado serializa el acceso a la conexión."""
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Con WAL sigue siendo seguro ante caídas del proceso.
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS clientes (
+                    ID_Cliente TEXT PRIMARY KEY,
+                    Nombre TEXT,
+                    Direccion_Predeterminada TEXT,
+                    Fecha_Registro TEXT,
+                    Fecha_Ultimo_Pedido TEXT
+                );
+                CREATE TABLE IF NOT EXISTS pedidos (
+                    ID_Pedido TEXT PRIMARY KEY,
+                    Fecha TEXT,
+                    ID_Cliente TEXT,
+                    Nombre_Cliente TEXT,
+                    Items TEXT,
+                    Total REAL,
+                    Direccion TEXT,
+                    Estado TEXT,
+                    Items_Detalle TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_pedidos_cliente ON pedidos (ID_Cliente, Fecha);
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, operation: str, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        started_at = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: func(self._connect()))
+        finally:
+            PERSISTENCE_OPS.observe(time.perf_counter() - started_at, backend=self.name, operation=operation)
+
+    async def get_customer(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        def query(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute("SELECT * FROM clientes WHERE ID_Cliente = ?", (str(user_id).strip(),)).fetchone()
+            return dict(row) if row else None
+        return await self._run("get_customer", query)
+
+    async def upsert_customer(self, user_id: Any, name: str, address: str, timestamp: str) -> None:
+        def upsert(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO clientes (ID_Cliente, Nombre, Direccion_Predeterminada, Fecha_Registro, Fecha_Ultimo_Pedido)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(ID_Cliente) DO UPDATE SET
+                        Nombre = excluded.Nombre,
+                        Direccion_Predeterminada = excluded.Direccion_Predeterminada,
+                        Fecha_Ultimo_Pedido = excluded.Fecha_Ultimo_Pedido
+                    """,
+                    (str(user_id), name, address, timestamp, timestamp),
+                )
+        await self._run("upsert_customer", upsert)
+
+    async def append_order(self, order: Dict[str, Any]) -> None:
+        columns = ORDER_COLUMNS + (ORDER_ITEMS_KEY,)
+        values = [order.get(column) for column in ORDER_COLUMNS] + [json.dumps(order.get(ORDER_ITEMS_KEY) or [], ensure_ascii=False)]
+
+        def insert(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO pedidos ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})", values
+                )
+        await self._run("append_order", insert)
+
+    def import_rows(self, customers: List[Dict[str, Any]], orders: List[Dict[str, Any]]) -> None:
+        """Carga masiva (síncrona) de filas leídas de Sheets; las existentes se respetan."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO clientes ({', '.join(CUSTOMER_COLUMNS)}) VALUES ({', '.join('?' for _ in CUSTOMER_COLUMNS)})",
+                [[str(row.get(column, '')) for column in CUSTOMER_COLUMNS] for row in customers],
+            )
+            conn.executemany(
+                f"INSERT OR IGNORE INTO pedidos ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' for _ in ORDER_COLUMNS)})",
+                [[row.get(column) for column in ORDER_COLUMNS] for row in orders],
+            )
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+class MirroredBackend(PersistenceBackend):
+    """
+    Lee y escribe en 'primary'; cada escritura se copia después, en orden y en
+    segundo plano, a 'mirror'. Un fallo del espejo nunca afecta al pedido.
+    """
+
+    def __init__(self, primary: PersistenceBackend, mirror: PersistenceBackend):
+        self.primary = primary
+        self.mirror = mirror
+        self.name = f"{primary.name}+{mirror.name}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _enqueue(self, operation: str, *args: Any) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._drain_forever())
+        self._queue.put_nowait((operation, args))
+        MIRROR_PENDING.set(self._queue.qsize())
+
+    async def _drain_forever(self) -> None:
+        while True:
+            operation, args = await self._queue.get()
+            delay = 1.0
+            while True:
+                try:
+                    await getattr(self.mirror, operation)(*args)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    MIRROR_FAILURES_TOTAL.inc(operation=operation)
+                    logger.warning(f"⚠️ No se pudo copiar '{operation}' a {self.mirror.name} ({e!r}). Reintento en {delay:.0f}s.")
+                    await asyncio.sleep(delay)
+                    delay = min(MIRROR_MAX_DELAY_S, delay * 2)
+            self._queue.task_done()
+            MIRROR_PENDING.set(self._queue.qsize())
+
+    async def get_customer(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_customer(user_id)
+
+    async def upsert_customer(self, user_id: Any, name: str, address: str, timestamp: str) -> None:
+        await self.primary.upsert_customer(user_id, name, address, timestamp)
+        self._enqueue("upsert_customer", user_id, name, address, timestamp)
+
+    async def append_order(self, order: Dict[str, Any]) -> None:
+        await self.primary.append_order(order)
+        self._enqueue("append_order", order)
+
+    async def close(self, timeout_s: float = 10.0) -> None:
+        """Espera (con límite) a que el espejo se ponga al día antes de cerrar."""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout_s)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Quedaron {self._queue.qsize()} cambios sin copiar a {self.mirror.name} al apagar.")
+            self._worker.cancel()
+        await self.primary.close()
+
+
+def build_backend(db_path: str = SQLITE_DB_PATH) -> PersistenceBackend:
+    if PERSISTENCE_BACKEND == "sqlite":
+        backend: PersistenceBackend = SQLiteBackend(db_path)
+        if SHEETS_MIRROR:
+            backend = MirroredBackend(backend, SheetsBackend())
+    elif PERSISTENCE_BACKEND == "sheets":
+        backend = SheetsBackend()
+    else:
+        raise ValueError(f"PERSISTENCE_BACKEND desconocido: '{PERSISTENCE_BACKEND}' (usa 'sheets' o 'sqlite').")
+    logger.info(f"🗄️ Persistencia de clientes y pedidos: {backend.name}.")
+    return backend
+
+
+# Un backend por pizzería (ver tenants.py); con un solo tenant, el de siempre.
+_backends: Dict[str, PersistenceBackend] = {}
+
+
+def get_backend() -> PersistenceBackend:
+    return tenants.scoped(_backends, lambda tenant: build_backend(tenant.data_path(SQLITE_DB_PATH)))
+
+
+async def close_backend() -> None:
+    """Cierra los backends de todas las pizzerías."""
+    for backend in list(_backends.values()):
+        await backend.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Utilidades de la persistencia local de la pizzería.")
+    parser.add_argument("--import-sheets", action="store_true", help="Copia 'Clientes' y 'Pedidos_Registrados' a la base SQLite.")
+    parser.add_argument("--db", default=SQLITE_DB_PATH)
+    args = parser.parse_args()
+    if not args.import_sheets:
+        parser.print_help()
+        return
+    customers = SheetsBackend._worksheet('Clientes').get_all_records()
+    orders_ws = SheetsBackend._worksheet('Pedidos_Registrados')
+    # Las filas de pedidos se leen por posición: la cabecera de la hoja puede tener otros nombres.
+    orders = [dict(zip(ORDER_COLUMNS, row)) for row in orders_ws.get_all_values()[1:] if row and row[0]]
+    backend = SQLiteBackend(args.db)
+    backend.import_rows(customers, orders)
+    print(f"Importados {len(customers)} clientes y {len(orders)} pedidos en '{args.db}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -32,22 +32,26 @@ from pizzeria_tools import (
     manage_order_item, view_current_order, save_delivery_address,
     registrar_pedido_finalizado, update_session_state, get_general_info, handle_complaint,
     calculate_order_total, get_items_by_category, get_item_details_by_name, draft_response_for_review,
-    register_update_customer, finalize_order_taking, solicitar_envio_menu_pdf,get_available_categories
+    register_update_customer, finalize_order_taking, solicitar_envio_menu_pdf,get_available_categories,
+    repeat_previous_order
 )
 from menu_cache import load_menu_from_json
+from instruction_templates import state_instruction
+from resilient_llm import resilient_model
 import google.generativeai as genai
 from google.api_core import retry
 from google.genai import errors
 from google.api_core import exceptions as core_exceptions
 from pydantic import PrivateAttr
 from pizzeria_callbacks import log_before_tool_call, log_after_tool_call, log_before_model_call, log_after_model_call
+import metrics
+import tenants
 
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__) # Logger global para tareas a nivel de módulo
 logging.getLogger('google_adk').setLevel(logging.WARNING)
 
-AGENT_GLOBAL_MODEL = os.environ.get("ADK_MODEL_NAME", "gemini-2.5-flash-lite-preview-06-17")
 load_menu_from_json()
 
 # ==============================================================================
@@ -56,23 +60,28 @@ load_menu_from_json()
 
 customer_management_agent = Agent(
     name="CustomerManagementAgent",
-    model=AGENT_GLOBAL_MODEL,
-    instruction="""
+    model=resilient_model("CustomerManagementAgent"),
+    instruction=state_instruction("""
     ## Tu Rol: Recepcionista Experto y Eficiente 🤵
 
+    **DATOS DEL CLIENTE (ya consultados por el sistema):**
+    - `_customer_status`: ${_customer_status}
+    - Nombre: ${_customer_name_for_greeting}
+
     **1. ACCIÓN INICIAL:**
-    - Al recibir CUALQUIER input, debes llamar a `get_initial_customer_context`.
+    - Si `_customer_status` es 'desconocido', llama a `get_initial_customer_context`.
+    - Si ya es 'found' o 'not_found', NO llames a `get_initial_customer_context`: usa los datos de arriba.
 
         SI EL CLIENTE ES NUEVO(`_customer_status: 'not_found'`):**
-            - Tu única acción es preguntar por su nombre.Puedes decir algo como: "¡Hola! Bienvenido(a) a Pizzería San Marzano 😊. Para atenderte mejor, ¿me podrías dar tu nombre completo?"
+            - Tu única acción es preguntar por su nombre.Puedes decir algo como: "¡Hola! Bienvenido(a) a ${pizzeria_name} 😊. Para atenderte mejor, ¿me podrías dar tu nombre completo?"
             Analiza la respuesta, si no parece un nombre, insiste amablemente para que escriba su nombre, cuando detectes un nombre usa `register_update_customer` y usa la variable 'nombre' para guardar su nombre.
     
         EL CLIENTE YA EXISTE (`_customer_status: 'found'`):
-            - Tu única acción es saludar al cliente por su nombre. Por ejemplo: "¡Hola, [Nombre del Cliente]! Qué bueno verte de nuevo en Pizzería San Marzano 😊, estas listo para pedir?🍕
+            - Tu única acción es saludar al cliente por su nombre. Por ejemplo: "¡Hola, [Nombre del Cliente]! Qué bueno verte de nuevo en ${pizzeria_name} 😊, estas listo para pedir?🍕
 
     **2. ACCIÓN POST-REGISTRO:**
        - SIMULTÁNEAMENTE, debes llamar a la herramienta `yield_control_silently` (o la que creemos) para notificar al orquestador que has terminado.
-    """,
+    """),
     tools=[get_initial_customer_context, register_update_customer],
     before_model_callback=log_before_model_call, # <-- AÑADIR
     after_model_callback=log_after_model_call,   # <-- AÑADIR
@@ -82,17 +91,23 @@ customer_management_agent = Agent(
 
 order_taking_agent = Agent(
     name="OrderTakingAgent",
-    model=AGENT_GLOBAL_MODEL,
-    instruction="""
+    model=resilient_model("OrderTakingAgent"),
+    instruction=state_instruction("""
 ## Tu Rol: Asistente de Ventas Experto y Proactivo 🤖🍕
 
 Tu misión es guiar al cliente a través del menú y tomar su pedido de la forma más eficiente y agradable posible, anticipando sus necesidades.
 
+**MENÚ DISPONIBLE (ya lo conoces, no necesitas herramientas para consultarlo):**
+${menu_digest}
+
+**PEDIDO ACTUAL DEL CLIENTE:** ${_current_order_items}
+
 **PROTOCOLO DE EJECUCIÓN INTELIGENTE:**
 
 **1. DETECCIÓN DE CATEGORÍA (ACCIÓN PROACTIVA):**
-   - **SI** la solicitud del usuario es general y menciona una categoría (ej. "quiero una pizza", "ver las bebidas", "qué postres tienen"), tu **PRIMERA ACCIÓN** debe ser llamar a la herramienta `get_items_by_category`.
-   - Luego, presenta la lista de opciones al cliente de forma atractiva para que elija.
+   - **SI** la solicitud del usuario es general y menciona una categoría (ej. "quiero una pizza", "ver las bebidas", "qué postres tienen"), responde directamente con las opciones de esa categoría del MENÚ DISPONIBLE.
+   - Solo llama a `get_items_by_category` o `get_available_categories` si el menú de arriba indica que es extenso.
+   - Presenta la lista de opciones al cliente de forma atractiva para que elija.
    - **Ejemplo de respuesta:** "¡Claro! En nuestra sección de Pizzas tenemos: [lista de pizzas]. ¿Cuál te apetece hoy?"
 
 **2. PROCESAMIENTO DE ÍTEMS ESPECÍFICOS:**
@@ -107,16 +122,22 @@ Tu misión es guiar al cliente a través del menú y tomar su pedido de la forma
    - Para ello, llama a la herramienta `solicitar_envio_menu_pdf`.
    - **Ejemplo de respuesta:** "Lo siento, no pude encontrar 'piza de peperoni'. Si quieres, puedo enviarte nuestro menú completo en PDF para que veas todas las opciones."
 
-**5. FINALIZACIÓN DEL PEDIDO (REGLA DE ORO):**
+**5. "LO MISMO DE SIEMPRE" (CLIENTES FRECUENTES):**
+   - **SI** el cliente pide repetir un pedido ("lo mismo de la otra vez", "lo de siempre"), llama a `repeat_previous_order` con `which='last'`, o con `which='frequent'` si dice "lo de siempre".
+   - Con `status: 'success'`, resume los ítems cargados con sus precios actuales y menciona los `skipped_items` si los hay. Pregunta si desea algo más.
+   - Con `status: 'no_history'`, dile amablemente que no encontraste pedidos anteriores y ofrécele el menú.
+
+**6. FINALIZACIÓN DEL PEDIDO (REGLA DE ORO):**
    - Si el cliente indica que ha terminado (ej. "eso es todo"), tu **ÚNICA** acción es llamar a la herramienta `finalize_order_taking`. No hagas nada más.
-""",
+"""),
     tools=[
         manage_order_item,
         view_current_order,
         finalize_order_taking, # Esta es la herramienta refactorizada
         get_items_by_category,
         get_item_details_by_name,
-        get_available_categories, solicitar_envio_menu_pdf
+        get_available_categories, solicitar_envio_menu_pdf,
+        repeat_previous_order
     ],
     before_model_callback=log_before_model_call, # <-- AÑADIR
     after_model_callback=log_after_model_call,   # <-- AÑADIR
@@ -126,14 +147,16 @@ Tu misión es guiar al cliente a través del menú y tomar su pedido de la forma
 
 order_confirmation_agent = Agent(
     name="OrderConfirmationAgent",
-    model=AGENT_GLOBAL_MODEL,
-    instruction="""
+    model=resilient_model("OrderConfirmationAgent"),
+    instruction=state_instruction("""
     ## Tu Rol: Verificador de Pedidos Robótico 🤖
 
+    **PEDIDO ACTUAL DEL CLIENTE:** ${_current_order_items}
+
     **PROTOCOLO DE EJECUCIÓN:**
 
     **1. ACCIÓN INICIAL (Al ser activado):**
-       - Llama a las herramientas `view_current_order` y `calculate_order_total` para obtener los datos frescos del pedido.
+       - Llama a la herramienta `calculate_order_total` (registra el subtotal y te da el desglose). No necesitas `view_current_order`: el pedido ya está arriba.
        - Usa la información para construir y mostrar un resumen claro del pedido al usuario.
        - Finaliza tu mensaje preguntando **exactamente**: "¿Es correcto tu pedido?"
 
@@ -141,7 +164,7 @@ order_confirmation_agent = Agent(
        - Si el cliente responde afirmativamente ('sí', 'es correcto', 'confirmo'), tu **ÚNICA** acción es llamar a la herramienta `update_session_state` con los argumentos `data_to_update={'_order_confirmed': True}`.
        - Si el cliente quiere modificar ('no', 'cambiar', 'quitar'), tu **ÚNICA** acción es llamar a `update_session_state` con `data_to_update={'_modification_requested': True}`.
        - **NO generes texto después de llamar a `update_session_state`**. Cede el control.
-    """,
+    """),
     # Asegúrate de que tenga las herramientas necesarias
     tools=[
         view_current_order,
@@ -159,7 +182,7 @@ order_confirmation_agent = Agent(
 
 address_collection_agent = Agent(
     name="AddressCollectionAgent",
-    model=AGENT_GLOBAL_MODEL,
+    model=resilient_model("AddressCollectionAgent"),
     instruction="""
     ## Tu Rol: Especialista en Logística 🤖
 
@@ -183,7 +206,7 @@ address_collection_agent = Agent(
 
 finalization_agent = Agent(
     name="FinalizationAgent",
-    model=AGENT_GLOBAL_MODEL,
+    model=resilient_model("FinalizationAgent"),
     instruction="""
     ## Tu Rol: Registrador Final de Pedidos 🤖
 
@@ -191,12 +214,16 @@ finalization_agent = Agent(
     Al ser activado, tu **ÚNICA** acción es llamar inmediatamente a la herramienta `registrar_pedido_finalizado`.
     Después de la llamada, proporciona al usuario el mensaje de éxito que te devuelve la herramienta.
     """,
-    tools=[registrar_pedido_finalizado] # Solo necesita esta herramienta
+    tools=[registrar_pedido_finalizado], # Solo necesita esta herramienta
+    before_model_callback=log_before_model_call,
+    after_model_callback=log_after_model_call,
+    before_tool_callback=log_before_tool_call,
+    after_tool_callback=log_after_tool_call
 )
 
 intent_classifier_agent = Agent(
     name="IntentClassifierAgent",
-    model=AGENT_GLOBAL_MODEL, # Podemos usar el modelo más rápido y económico
+    model=resilient_model("IntentClassifierAgent"), # Nivel 'fast': el modelo más rápido y económico
     instruction="""
     ## Tu Rol: Clasificador de Intenciones Robótico
 
@@ -224,12 +251,14 @@ intent_classifier_agent = Agent(
     **REGLA DE ORO: TU RESPUESTA DEBE SER ÚNICAMENTE EL JSON.**
     """,
     # ¡Este agente es tan simple que no necesita herramientas!
-    tools=[]
+    tools=[],
+    before_model_callback=log_before_model_call,
+    after_model_callback=log_after_model_call
 )
 
 general_inquiry_agent = Agent(
     name="GeneralInquiryAgent",
-    model=AGENT_GLOBAL_MODEL,
+    model=resilient_model("GeneralInquiryAgent"),
     instruction="""
     ## Tu Rol: Conserje de Información General y Quejas
 
@@ -238,7 +267,11 @@ general_inquiry_agent = Agent(
     Usa la herramienta `handle_complaint` si el cliente expresa una queja, un problema o está molesto.
     Responde de forma concisa y directa a la pregunta. No tienes acceso a la información del pedido.
     """,
-    tools=[get_general_info, handle_complaint]
+    tools=[get_general_info, handle_complaint],
+    before_model_callback=log_before_model_call,
+    after_model_callback=log_after_model_call,
+    before_tool_callback=log_before_tool_call,
+    after_tool_callback=log_after_tool_call
 )
 class RootOrchestratorAgent(BaseAgent):
     """
@@ -278,6 +311,7 @@ class RootOrchestratorAgent(BaseAgent):
         # Clasificación de intención (se mantiene)
         intent = "UNKNOWN"
         # ... (tu código de clasificación de intención no cambia)
+        classifier_started_at = time.perf_counter()
         try:
             intent_response_str = ""
             async for event in self.intent_classifier_agent.run_async(ctx):
@@ -290,13 +324,17 @@ class RootOrchestratorAgent(BaseAgent):
             self._logger.info(f"Intención clasificada: '{intent}'")
         except (json.JSONDecodeError, AttributeError, IndexError) as e:
             self._logger.warning(f"No se pudo decodificar la intención. Se asume 'UNKNOWN'. Respuesta: '{intent_response_str}'. Error: {e}")
+        metrics.AGENT_RUN_LATENCY.observe(time.perf_counter() - classifier_started_at, agent=self.intent_classifier_agent.name)
+        metrics.INTENTS_TOTAL.inc(intent=intent)
 
 
         # Lógica de desvío (se mantiene)
         if intent in ['ASK_SCHEDULE', 'MAKE_COMPLAINT']:
             self._logger.info(f"Desviando a GeneralInquiryAgent por intención '{intent}'.")
+            agent_started_at = time.perf_counter()
             async for event in self.general_inquiry_agent.run_async(ctx):
                 yield event
+            metrics.AGENT_RUN_LATENCY.observe(time.perf_counter() - agent_started_at, agent=self.general_inquiry_agent.name)
             return
 
         # Bucle proactivo de gestión de fases (con la corrección de 'A_STANDBY' que hicimos)
@@ -318,6 +356,23 @@ class RootOrchestratorAgent(BaseAgent):
                 state.pop('_last_confirmed_delivery_address_for_order', None)
                 current_phase = 'B_TOMA_ITEMS'
 
+            # Cliente conocido y precargado al crear la sesión: no hace falta gastar
+            # una llamada al modelo en la fase A, pasamos directo a la toma de pedido.
+            if current_phase == 'A_GESTION_CLIENTE' and self._is_prefetched_known_customer(state):
+                customer_name = state.get('_customer_name_for_greeting') or str(state['_customer_record'].get('Nombre')).strip()
+                self._logger.info(f"⚡ Cliente precargado '{customer_name}'. Se omite {self.customer_management_agent.name}.")
+                yield Event(
+                    author=self.name,
+                    actions=EventActions(state_delta={
+                        'processing_order_sub_phase': 'B_TOMA_ITEMS',
+                        '_customer_name_for_greeting': customer_name,
+                    }),
+                    content=genai_types.Content(parts=[genai_types.Part(
+                        text=f"¡Hola de nuevo, {customer_name.title()}! 😊 Qué bueno verte otra vez en {tenants.current_tenant().display_name}. ¿Qué te gustaría pedir hoy? 🍕"
+                    )])
+                )
+                continue
+
             self._logger.info(f"--- CICLO ORQUESTADOR --- Delegando a la fase: {current_phase}")
             agent_for_phase = self._get_agent_for_phase(current_phase, intent)
 
@@ -326,8 +381,10 @@ class RootOrchestratorAgent(BaseAgent):
                 yield Event(author=self.name, content=genai_types.Content(parts=[genai_types.Part(text="Lo siento, me he perdido. ¿Podemos empezar de nuevo?")]))
                 break
 
+            agent_started_at = time.perf_counter()
             async for event in agent_for_phase.run_async(ctx):
                 yield event
+            metrics.AGENT_RUN_LATENCY.observe(time.perf_counter() - agent_started_at, agent=agent_for_phase.name)
             
             next_phase = self._determine_next_phase(state)
 
@@ -446,6 +503,13 @@ class RootOrchestratorAgent(BaseAgent):
         state.pop('_modification_requested', None)
 
 
+    def _is_prefetched_known_customer(self, state: Dict[str, Any]) -> bool:
+        """True si customer_prefetch ya dejó en el estado un cliente registrado con nombre."""
+        if not state.get('_customer_prefetched') or state.get('_customer_status') != 'found':
+            return False
+        record = state.get('_customer_record') or {}
+        return bool(state.get('_customer_name_for_greeting') or str(record.get('Nombre') or '').strip())
+
     def _get_agent_for_phase(self, phase: str, intent: str) -> Optional[BaseAgent]:
         if phase == 'A_GESTION_CLIENTE': return self.customer_management_agent
         if phase == 'B_TOMA_ITEMS': return self.order_taking_agent
@@ -1,9 +1,15 @@
 # src/pizzeria_callbacks.py
 
 import logging
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, Optional, Tuple
 from google.adk.tools.tool_context import ToolContext
 from google.adk.tools.base_tool import BaseTool
+import metrics
+from logging_setup import LazyPayload
+import usage_accounting
+import model_routing
+import turn_deadline
 
 # Usamos el mismo logger que en los otros archivos para consistencia
 logger = logging.getLogger(__name__)
@@ -12,26 +18,63 @@ from google.adk.agents.callback_context import CallbackContext
 from google.adk.models import LlmRequest, LlmResponse
 from typing import Optional
 
+# Marca de inicio de cada herramienta en curso, indexada por (invocación, function_call_id).
+# Si una herramienta lanza una excepción, after_tool_callback no llega: las marcas viejas se descartan.
+_tool_started_at: Dict[Tuple[str, str], float] = {}
+_TOOL_TIMING_MAX_ENTRIES = 1000
+_TOOL_TIMING_TTL_S = 600.0
+
+def _tool_call_key(tool: BaseTool, tool_context: ToolContext) -> Tuple[str, str]:
+    return (tool_context.invocation_id, tool_context.function_call_id or tool.name)
+
+def _start_tool_timer(key: Tuple[str, str]) -> None:
+    now = time.perf_counter()
+    if len(_tool_started_at) >= _TOOL_TIMING_MAX_ENTRIES:
+        for stale_key in [k for k, started_at in _tool_started_at.items() if now - started_at > _TOOL_TIMING_TTL_S]:
+            del _tool_started_at[stale_key]
+        if len(_tool_started_at) >= _TOOL_TIMING_MAX_ENTRIES:
+            _tool_started_at.clear()
+    _tool_started_at[key] = now
+
 def log_before_model_call(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
     """Callback que loggea el prompt que se envía al LLM."""
     agent_name = callback_context.agent_name
-    logger.info(f"[[🧠 MODEL_CALL - PROMPT]] Para Agente '{agent_name}':")
-    # El prompt completo suele estar en la última parte del contenido
-    if llm_request.contents:
-        for part in llm_request.contents[-1].parts:
-             logger.info(f"  -> {part.text}")
+    # Primero se elige el modelo (puede pasar al de respaldo) para que la contabilidad use el real.
+    model_routing.route_model_request(callback_context, llm_request)
+    turn_deadline.enter_stage(f"model:{agent_name}")
+    turn_deadline.apply_model_timeout(llm_request)
+    metrics.MODEL_CALLS_TOTAL.inc(agent=agent_name)
+    turn = metrics.current_turn()
+    if turn is not None:
+        turn.record_model_call(agent_name)
+    usage_accounting.record_model_request(callback_context, llm_request)
+    # El prompt completo suele estar en la última parte del contenido.
+    # Se registra en una sola línea, acotada y solo si el registro pasa nivel y muestreo.
+    if logger.isEnabledFor(logging.INFO):
+        last_parts = llm_request.contents[-1].parts if llm_request.contents else []
+        logger.info(
+            "[[🧠 MODEL_CALL - PROMPT]] Para Agente '%s': %s", agent_name,
+            LazyPayload([part.text for part in last_parts or [] if part.text]),
+            extra={'category': 'model_prompt', 'agent': agent_name},
+        )
     return None # Devuelve None para permitir que la llamada continúe
 
 def log_after_model_call(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
     """Callback que loggea la respuesta cruda del LLM."""
     agent_name = callback_context.agent_name
-    logger.info(f"[[🧠 MODEL_CALL - RESPONSE]] De Agente '{agent_name}':")
+    model_routing.record_model_result(callback_context, llm_response)
+    turn_deadline.enter_stage("orchestrator")
+    usage_accounting.record_model_response(callback_context, llm_response)
     # La decisión del LLM (llamar a una función) está en las partes de la respuesta
-    if llm_response.content and llm_response.content.parts:
+    if logger.isEnabledFor(logging.INFO) and llm_response.content and llm_response.content.parts:
         for part in llm_response.content.parts:
             if part.function_call:
                 fc = part.function_call
-                logger.info(f"  <- [Function Call] Herramienta: {fc.name}, Args: {dict(fc.args)}")
+                logger.info(
+                    "[[🧠 MODEL_CALL - RESPONSE]] De Agente '%s' <- [Function Call] Herramienta: %s, Args: %s",
+                    agent_name, fc.name, LazyPayload(fc.args),
+                    extra={'category': 'model_response', 'agent': agent_name},
+                )
     return None # Devuelve None para no interferir con la respuesta
 
 
@@ -43,11 +86,17 @@ def log_before_tool_call(
     """
     agent_name = tool_context.agent_name
     tool_name = tool.name
+    _start_tool_timer(_tool_call_key(tool, tool_context))
+    turn_deadline.enter_stage(f"tool:{tool_name}")
+    turn = metrics.current_turn()
+    if turn is not None:
+        turn.record_tool_call()
     
     logger.info(
-        f"[[CALLBACK - ANTES]] Agente '{agent_name}' está a punto de llamar a la Herramienta ---> '{tool_name}'"
+        "[[CALLBACK - ANTES]] Agente '%s' está a punto de llamar a la Herramienta ---> '%s' | Argumentos: %s",
+        agent_name, tool_name, LazyPayload(args),
+        extra={'category': 'tool_call', 'agent': agent_name, 'tool': tool_name},
     )
-    logger.info(f"    -> Argumentos: {args}")
     
     return None
 
@@ -59,14 +108,17 @@ def log_after_tool_call(
     """
     agent_name = tool_context.agent_name
     tool_name = tool.name
+    started_at = _tool_started_at.pop(_tool_call_key(tool, tool_context), None)
+    turn_deadline.enter_stage("orchestrator")
+    if started_at is not None:
+        metrics.TOOL_LATENCY.observe(time.perf_counter() - started_at, tool=tool_name)
+    if tool_name == 'registrar_pedido_finalizado' and isinstance(tool_response, dict) and tool_response.get('status') == 'success':
+        usage_accounting.record_order_completed(tool_context.state.get('_session_user_id'), tool_response.get('order_id'))
     
-    response_str = str(tool_response)
-    if len(response_str) > 300:
-        response_str = response_str[:300] + "..."
-        
     logger.info(
-        f"[[CALLBACK - DESPUÉS]] Herramienta '{tool_name}' ejecutada por Agente '{agent_name}'"
+        "[[CALLBACK - DESPUÉS]] Herramienta '%s' ejecutada por Agente '%s' | Resultado: %s",
+        tool_name, agent_name, LazyPayload(tool_response),
+        extra={'category': 'tool_result', 'agent': agent_name, 'tool': tool_name},
     )
-    logger.info(f"    <- Resultado: {response_str}")
     
     return None
\ No newline at end of file
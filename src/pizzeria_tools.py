@@ -5,14 +5,20 @@ import logging
 import time
 import redis
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 import gspread
 from datetime import datetime
 from thefuzz import process, fuzz
 from typing import Any, Dict
-import asyncio
-from sheets_client import get_worksheet
+import persistence
+from order_ids import new_order_id
+from order_history import get_history
+from order_store import get_store
 from google.adk.tools import ToolContext
+import metrics
+import config_cache
+import complaints_queue
+from logging_setup import LazyPayload
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +35,14 @@ def get_state_from_context(context: Any) -> Dict[str, Any]:
 # ==============================================================================
 # EN pizzeria_tools.py
 
+async def fetch_customer_record(user_id: Any) -> Optional[Dict[str, Any]]:
+    """
+    Lee el registro del cliente en el backend de persistencia (SQLite o la hoja 'Clientes').
+    Devuelve el registro si existe, None si no está registrado. Los errores del backend se propagan.
+    Con Sheets, cada lectura dentro de un turno tiene como límite una parte del plazo del turno.
+    """
+    return await persistence.get_backend().get_customer(user_id)
+
 async def get_initial_customer_context(tool_context: ToolContext) -> Dict[str, Any]:
     """
     [VERSIÓN DEFINITIVA]
@@ -36,6 +50,7 @@ async def get_initial_customer_context(tool_context: ToolContext) -> Dict[str, A
     - Si el cliente existe, DEVUELVE sus datos para que el agente los use.
     - Si no existe, lo informa.
     - Siempre actualiza la bandera _customer_status en el estado.
+    - Si la sesión ya trae el cliente precargado (customer_prefetch), responde sin leer Sheets.
     """
     state = get_state_from_context(tool_context)
     user_id = state.get('_session_user_id')
@@ -44,10 +59,23 @@ async def get_initial_customer_context(tool_context: ToolContext) -> Dict[str, A
     if not user_id:
         return {"status": "error", "message": "No se pudo obtener el user_id."}
 
+    if state.get('_customer_prefetched'):
+        if state.get('_customer_status') == 'found' and state.get('_customer_record'):
+            logger.info(f"Cliente '{user_id}' ya precargado en la sesión. Sin lectura de Sheets.")
+            return {
+                "status": "found",
+                "customer_data": state['_customer_record'],
+                "message": "Cliente existente encontrado."
+            }
+        if state.get('_customer_status') == 'not_found':
+            logger.info(f"Cliente '{user_id}' precargado como NO registrado. Sin lectura de Sheets.")
+            return {
+                "status": "not_found",
+                "message": "Cliente no registrado."
+            }
+
     try:
-        customers_ws = await asyncio.to_thread(get_worksheet, 'Clientes')
-        all_customers = await asyncio.to_thread(customers_ws.get_all_records)
-        customer_row = next((row for row in all_customers if str(row.get('ID_Cliente')).strip() == str(user_id).strip()), None)
+        customer_row = await fetch_customer_record(user_id)
 
         if customer_row:
             logger.info(f"Cliente '{user_id}' encontrado. DEVOLVIENDO DATOS AL AGENTE.")
@@ -103,58 +131,61 @@ async def commit_final_order_and_customer_data(tool_context: Any) -> Dict[str, A
 
 # Reemplazar la función get_item_details_by_name en: pizzeria_tools.py
 
-async def get_item_details_by_name(tool_context: Any, nombre_plato: str, categoria: Optional[str] = None) -> Dict[str, Any]:
+def _lookup_menu_item(nombre_plato: str, categoria: Optional[str] = None) -> Dict[str, Any]:
     """
-    [VERSIÓN v3 - BÚSQUEDA POR CATEGORÍA]
-    Busca un plato. Si se proporciona una 'categoria', la búsqueda es más rápida y precisa.
-    Mantiene la lógica de manejo de ambigüedad para tamaños y variantes.
+    Búsqueda sobre los registros del menú (menu_cache.MenuItem). Devuelve el mismo
+    resultado que get_item_details_by_name pero con registros en lugar de diccionarios,
+    para que el carrito use price_cents sin volver a parsear nada.
     """
-    logger.info(f"[Tool] Búsqueda v3 para: '{nombre_plato}', en Categoría: '{categoria or 'Todas'}'")
-    from menu_cache import get_menu
-    all_records = get_menu()
-
-    # Filtra el menú por categoría DESDE EL PRINCIPIO si se proporciona
-    if categoria:
-        search_space = [
-            item for item in all_records
-            if str(item.get('Categoria', '')).lower() == categoria.lower()
-            and str(item.get('Disponible', '')).lower() == 'sí'
-        ]
-        if not search_space:
-             return {"status": "not_found", "message": f"No encontré ítems en la categoría '{categoria}'."}
-    else:
-        search_space = [item for item in all_records if str(item.get('Disponible', '')).lower() == 'sí']
+    import menu_cache
 
+    # Solo ítems disponibles (y de la categoría, si se indica), directamente del índice del menú.
+    search_space = menu_cache.get_available_items(categoria)
     if not search_space:
+        metrics.MENU_LOOKUPS_TOTAL.inc(result='miss')
+        if categoria:
+            return {"status": "not_found", "message": f"No encontré ítems en la categoría '{categoria}'."}
         return {"status": "not_found", "message": "No hay ítems disponibles en el menú."}
 
     query_clean = nombre_plato.strip().lower()
 
-    # Lógica de búsqueda (exacta, por alias, flexible) ahora sobre el 'search_space' filtrado
-    # (El resto de la lógica de la función que ya implementamos para manejar ambigüedades permanece igual)
-    
-    # --- BÚSQUEDA EXACTA Y POR ALIAS ---
-    for item in search_space:
-        if str(item.get('Nombre_Plato', '')).lower() == query_clean:
-            logger.info(f"Coincidencia exacta encontrada: {item['Nombre_Plato']}")
-            return {"status": "success", "item_details": item}
-        aliases_str = item.get('Alias', '')
-        if aliases_str:
-            if query_clean in [alias.strip().lower() for alias in aliases_str.split(',')]:
-                logger.info(f"Coincidencia de alias encontrada para '{query_clean}': {item['Nombre_Plato']}")
-                return {"status": "success", "item_details": item}
+    # --- BÚSQUEDA EXACTA Y POR ALIAS (diccionarios del índice) ---
+    exact_item = menu_cache.find_available_item(query_clean, categoria)
+    if exact_item is not None:
+        logger.info(f"Coincidencia exacta o de alias encontrada para '{query_clean}': {exact_item.name}")
+        metrics.MENU_LOOKUPS_TOTAL.inc(result='hit')
+        return {"status": "success", "item_details": exact_item}
 
     # --- BÚSQUEDA POR CONTENCIÓN ---
-    possible_matches = [item for item in search_space if query_clean in str(item.get('Nombre_Plato', '')).lower()]
+    possible_matches = [item for item in search_space if query_clean in item.name.lower()]
     
     if len(possible_matches) == 1:
+        metrics.MENU_LOOKUPS_TOTAL.inc(result='hit')
         return {"status": "success", "item_details": possible_matches[0]}
     elif len(possible_matches) > 1:
+        metrics.MENU_LOOKUPS_TOTAL.inc(result='ambiguous')
         return {"status": "clarification_needed", "message": f"Encontré varias opciones para '{nombre_plato}'.", "options": possible_matches}
     else:
+        metrics.MENU_LOOKUPS_TOTAL.inc(result='miss')
         return {"status": "not_found", "message": f"Lo siento, no pude encontrar '{nombre_plato}'."}
 
 
+async def get_item_details_by_name(tool_context: Any, nombre_plato: str, categoria: Optional[str] = None) -> Dict[str, Any]:
+    """
+    [VERSIÓN v3 - BÚSQUEDA POR CATEGORÍA]
+    Busca un plato. Si se proporciona una 'categoria', la búsqueda es más rápida y precisa.
+    Mantiene la lógica de manejo de ambigüedad para tamaños y variantes.
+    """
+    logger.info("[Tool] Búsqueda v3 para: '%s', en Categoría: '%s'", nombre_plato, categoria or 'Todas', extra={'category': 'menu_lookup'})
+    result = _lookup_menu_item(nombre_plato, categoria)
+    # El agente recibe la forma de siempre (la de menu.json).
+    if "item_details" in result:
+        result["item_details"] = result["item_details"].to_dict()
+    if "options" in result:
+        result["options"] = [item.to_dict() for item in result["options"]]
+    return result
+
+
 async def get_items_by_category(tool_context: Any, categoria: str) -> Dict[str, Any]:
     """
     [V2 - OPTIMIZADA] Busca y devuelve todos los platos de una categoría
@@ -162,31 +193,24 @@ async def get_items_by_category(tool_context: Any, categoria: str) -> Dict[str,
     """
     logger.info(f"[Tool] get_items_by_category: Solicitud para categoría '{categoria}' desde CACHÉ.")
 
-    from menu_cache import get_menu # Importamos nuestra función de caché
+    import menu_cache
     if not categoria or not categoria.strip():
         return {"status": "error_input", "message": "El parámetro 'categoria' es obligatorio."}
     
     try:
         # ¡ESTA ES LA SOLUCIÓN! Leemos desde la memoria.
-        all_records = get_menu()
-
-        if not all_records:
+        if not menu_cache.get_menu_items():
             return {"status": "error_internal", "message": "La caché del menú está vacía."}
-                
-        available_records = [r for r in all_records if str(r.get('Disponible', '')).strip().lower() == 'sí']
-        if not available_records:
-            return {"status": "not_found", "message": "No hay ítems disponibles en el menú en este momento.", "items": []}
 
-        categoria_lower = categoria.lower()
         found_items = [
             # Se crea un diccionario limpio solo con los datos que el agente necesita mostrar
             {
-                "id_plato": r.get('ID_Plato', ''),
-                "nombre_plato": r.get('Nombre_Plato', ''),
-                "descripcion": r.get('Descripcion', ''),
-                "precio": r.get('Precio', '0.0')
+                "id_plato": item.item_id,
+                "nombre_plato": item.name,
+                "descripcion": item.description,
+                "precio": item.to_dict()['Precio']
             }
-            for r in available_records if str(r.get('Categoria', '')).lower() == categoria_lower
+            for item in menu_cache.get_available_items(categoria)
         ]
         
         if not found_items:
@@ -205,15 +229,14 @@ async def get_available_categories(tool_context: Any) -> Dict[str, Any]:
     Es útil para ofrecer al cliente opciones válidas cuando una búsqueda falla.
     """
     logger.info("[Tool] Obteniendo todas las categorías disponibles desde CACHÉ.")
-    from menu_cache import get_menu
+    import menu_cache
     
     try:
-        all_records = get_menu()
-        if not all_records:
+        if not menu_cache.get_menu_items():
             return {"status": "error", "message": "La caché del menú está vacía."}
         
-        # Usamos un set para obtener categorías únicas y luego lo convertimos a lista
-        categories = sorted(list(set(item.get('Categoria', '') for item in all_records if item.get('Categoria'))))
+        # El índice del menú ya guarda las categorías únicas y ordenadas
+        categories = list(menu_cache.get_categories())
         
         return {"status": "success", "categories": categories}
         
@@ -282,7 +305,7 @@ async def yield_control_silently(tool_context: ToolContext, state_updates: Dict[
                                         para actualizar en el estado de la sesión.
     """
     state = get_state_from_context(tool_context)
-    logger.info(f"[Tool] Cediendo control silenciosamente. Actualizando estado con: {state_updates}")
+    logger.info("[Tool] Cediendo control silenciosamente. Actualizando estado con: %s", LazyPayload(state_updates))
 
     # 1. Actualiza el estado con toda la información necesaria.
     state.update(state_updates)
@@ -318,14 +341,17 @@ async def manage_order_item(tool_context: Any, action: str, item_name: str, quan
     # --- VALIDACIÓN OBLIGATORIA DEL ÍTEM (excepto para remove) ---
     item_details = None
     if action in ["add", "set_quantity"]:
-        validation_result = await get_item_details_by_name(tool_context, item_name)
+        # Búsqueda sobre los registros del menú: el precio ya viene en céntimos, sin float() del texto.
+        validation_result = _lookup_menu_item(item_name)
         if validation_result.get("status") != "success":
             logger.warning(f"[Tool] Validación fallida para '{item_name}': {validation_result.get('status')}")
+            if "options" in validation_result:
+                validation_result["options"] = [option.to_dict() for option in validation_result["options"]]
             return validation_result  # Devuelve el resultado de la validación para que el orquestador lo maneje
 
         item_details = validation_result["item_details"]
-        canonical_name = item_details.get("Nombre_Plato")
-        price = float(item_details.get("Precio", 0.0))
+        canonical_name = item_details.name
+        price = item_details.price
     
     # --- LÓGICA DE ACCIONES ---
     if action == "add":
@@ -377,6 +403,47 @@ async def manage_order_item(tool_context: Any, action: str, item_name: str, quan
     else:
         return {"status": "error", "message": f"La acción '{action}' no es válida. Solo se permite 'add', 'remove' o 'set_quantity'."}
 
+async def repeat_previous_order(tool_context: Any, which: str = "last") -> Dict[str, Any]:
+    """
+    Carga en el carrito un pedido anterior del cliente ("lo mismo de siempre").
+    which: 'last' (el último pedido) o 'frequent' (el que más repite).
+    Los precios se toman del menú ACTUAL; los ítems que ya no existen o no están disponibles se omiten.
+    """
+    state = get_state_from_context(tool_context)
+    user_id = state.get('_session_user_id')
+    which = (which or "last").lower()
+    history = get_history()
+    await history.load() # La primera lectura del archivo no bloquea el event loop.
+    previous = history.most_frequent_order(user_id) if which.startswith("freq") else history.last_order(user_id)
+    logger.info(f"[Tool] repeat_previous_order | Cliente: '{user_id}', modo: {which}, encontrado: {bool(previous)}")
+    if not previous:
+        return {"status": "no_history", "message": "No encontré pedidos anteriores de este cliente."}
+
+    import menu_cache
+    cart_items = []
+    skipped_items = []
+    for past_item in previous['items']:
+        item_details = menu_cache.find_available_item(past_item['name'])
+        if item_details is None:
+            skipped_items.append(past_item['name'])
+            continue
+        price = item_details.price
+        quantity = int(past_item['quantity'])
+        cart_items.append({"name": past_item['name'], "quantity": quantity, "price": price, "subtotal": price * quantity})
+
+    if not cart_items:
+        return {"status": "unavailable", "message": "Ninguno de los ítems de su pedido anterior está disponible hoy.",
+                "skipped_items": skipped_items}
+
+    state['_current_order_items'] = cart_items
+    return {
+        "status": "success",
+        "order_id": previous.get('order_id'),
+        "order_items": cart_items,
+        "skipped_items": skipped_items,
+        "message": f"Se cargó el pedido anterior con {len(cart_items)} ítem(s) a precios actuales.",
+    }
+
 async def view_current_order(tool_context: Any) -> Dict[str, Any]:
     """Muestra los ítems en el carrito desde la sesión."""
     state = get_state_from_context(tool_context)
@@ -390,14 +457,13 @@ async def calculate_order_total(tool_context: Any) -> Dict[str, Any]:
     """
     state = get_state_from_context(tool_context)
     order_items = state.get('_current_order_items', [])
-    from menu_cache import get_menu
-    menu = get_menu()
+    import menu_cache
     
-    subtotal = 0.0
+    subtotal_cents = 0
     items_breakdown = []
     calculation_string_parts = []
 
-    if not menu:
+    if not menu_cache.get_menu_items():
         logger.error("[Tool] No se pudo calcular el total: la caché del menú está vacía.")
         return {"status": "error_no_menu", "subtotal": 0.0, "items_breakdown": [], "calculation_string": "Error"}
 
@@ -410,29 +476,28 @@ async def calculate_order_total(tool_context: Any) -> Dict[str, Any]:
         if not item_name:
             continue
 
-        # Usamos get_menu() que ahora devuelve una lista de diccionarios
-        item_details = next((menu_item for menu_item in menu if menu_item.get('Nombre_Plato') == item_name), None)
+        # Búsqueda por nombre en el índice; el precio ya está en céntimos enteros
+        item_details = menu_cache.get_item_by_name(item_name)
         
-        if item_details:
+        if item_details is not None and item_details.name == item_name:
             try:
-                precio = float(item_details.get('Precio', 0.0))
                 cantidad = int(item_in_order.get('quantity', 1))
-                item_subtotal = precio * cantidad
-                subtotal += item_subtotal
+                item_subtotal_cents = item_details.price_cents * cantidad
+                subtotal_cents += item_subtotal_cents
                 
                 # Añadimos al desglose
-                items_breakdown.append({"name": item_name, "quantity": cantidad, "price": f"S/ {precio:.2f}", "subtotal": f"S/ {item_subtotal:.2f}"})
-                calculation_string_parts.append(f"{item_subtotal:.2f}")
+                items_breakdown.append({"name": item_name, "quantity": cantidad, "price": f"S/ {item_details.price:.2f}", "subtotal": f"S/ {item_subtotal_cents / 100:.2f}"})
+                calculation_string_parts.append(f"{item_subtotal_cents / 100:.2f}")
 
             except (ValueError, TypeError):
                 logger.warning(f"No se pudo procesar el precio/cantidad para el ítem: {item_name}")
 
-    final_total = round(subtotal, 2)
+    final_total = round(subtotal_cents / 100, 2)
     state["_order_subtotal"] = final_total
     
     calculation_string = " + ".join(calculation_string_parts) + f" = S/ {final_total:.2f}"
     
-    logger.info(f"[Tool] Subtotal calculado: {final_total}. Desglose: {items_breakdown}")
+    logger.info("[Tool] Subtotal calculado: %s. Desglose: %s", final_total, LazyPayload(items_breakdown))
     
     return {
         "status": "success", 
@@ -447,7 +512,7 @@ async def update_session_state(tool_context: Any, data_to_update: Dict[str, Any]
     indicando que han completado su tarea para el orquestador.
     """
     state = get_state_from_context(tool_context)
-    logger.info(f"[Tool] Actualizando state con la bandera: {data_to_update}")
+    logger.info("[Tool] Actualizando state con la bandera: %s", LazyPayload(data_to_update))
     state.update(data_to_update)
     
     # [SOLUCIÓN] Devolvemos un diccionario que no incite a la conversación.
@@ -455,10 +520,25 @@ async def update_session_state(tool_context: Any, data_to_update: Dict[str, Any]
     # pero no hay un 'message' que el LLM se sienta tentado a repetir.
     return {"status": "success"}
 
+async def _index_registered_order(user_id: Any, order_id: str, timestamp: str, total: float,
+                                  order_items: List[Dict[str, Any]]) -> None:
+    """
+    Copias locales de un pedido ya registrado: historial por cliente y almacén columnar de ventas.
+    Un fallo aquí no afecta al pedido; solo se pierde el atajo o el dato de reporte.
+    """
+    try:
+        await get_history().record(user_id, order_id, timestamp, order_items)
+    except Exception as e:
+        logger.warning(f"[Tool] No se pudo añadir el pedido {order_id} al historial local: {e!r}")
+    try:
+        await get_store().record(timestamp, total, order_items)
+    except Exception as e:
+        logger.warning(f"[Tool] No se pudo añadir el pedido {order_id} al almacén de ventas: {e!r}")
+
 async def registrar_pedido_finalizado(tool_context: Any) -> Dict[str, Any]:
     """
     [VERSIÓN FINAL Y COMPLETA] Herramienta transaccional: Lee todos los datos del state,
-    escribe de forma persistente el pedido y el cliente en Google Sheets y LUEGO limpia el estado.
+    escribe de forma persistente el pedido y el cliente (persistence.py: Sheets o SQLite) y LUEGO limpia el estado.
     """
     state = get_state_from_context(tool_context)
     logger.info("[Tool] Iniciando registro final y persistencia de pedido Y CLIENTE...")
@@ -469,41 +549,24 @@ async def registrar_pedido_finalizado(tool_context: Any) -> Dict[str, Any]:
     address = state.get('_last_confirmed_delivery_address_for_order', 'N/A')
     order_items = state.get('_current_order_items', [])
     total = state.get('_order_subtotal', 0.0)
-    order_id = f"PZ-{str(int(time.time()))[-6:]}"
+    order_id = new_order_id()
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # Formatear los ítems para que se lean bien en una celda
-    items_str = ", ".join([f"{item['quantity']}x {item['name']}" for item in order_items])
+    items_str = persistence.format_order_items(order_items)
 
     try:
-        # =============================================================
-        # LÓGICA DE REGISTRO/ACTUALIZACIÓN DEL CLIENTE
-        # =============================================================
-        clientes_ws = await asyncio.to_thread(get_worksheet, 'Clientes')
-        
-        # Buscamos si el cliente ya existe por su ID en la primera columna
-        cell = await asyncio.to_thread(clientes_ws.find, user_id, in_column=1)
-        
-        if cell:
-            # Si el cliente existe, actualizamos su nombre y dirección
-            logger.info(f"Cliente con ID '{user_id}' encontrado en la fila {cell.row}. Actualizando datos.")
-            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 2, customer_name)
-            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 3, address)
-            await asyncio.to_thread(clientes_ws.update_cell, cell.row, 5, timestamp) # Actualizamos fecha de última interacción
-        else:
-            # Si no existe, creamos un nuevo cliente
-            logger.info(f"Cliente con ID '{user_id}' no encontrado. Creando nuevo registro.")
-            # Asumiendo columnas: ID_Cliente, Nombre, Direccion_Predeterminada, Fecha_Registro, Fecha_Ultimo_Pedido
-            nueva_fila_cliente = [user_id, customer_name, address, timestamp, timestamp]
-            await asyncio.to_thread(clientes_ws.append_row, nueva_fila_cliente)
-        
-        # =============================================================
-        # LÓGICA EXISTENTE: REGISTRO DEL PEDIDO
-        # =============================================================
-        pedidos_ws = await asyncio.to_thread(get_worksheet, 'Pedidos_Registrados')
-        nueva_fila_pedido = [order_id, timestamp, user_id, customer_name, items_str, total, address, 'Recibido']
-        await asyncio.to_thread(pedidos_ws.append_row, nueva_fila_pedido)
-        logger.info(f"--- Pedido {order_id} REGISTRADO CORRECTAMENTE EN GOOGLE SHEETS ---")
+        # Registro/actualización del cliente y registro del pedido en el backend de persistencia
+        # (Sheets, o SQLite con copia opcional a Sheets en segundo plano).
+        backend = persistence.get_backend()
+        await backend.upsert_customer(user_id, customer_name, address, timestamp)
+        await backend.append_order({
+            'ID_Pedido': order_id, 'Fecha': timestamp, 'ID_Cliente': user_id, 'Nombre_Cliente': customer_name,
+            'Items': items_str, 'Total': total, 'Direccion': address, 'Estado': 'Recibido',
+            persistence.ORDER_ITEMS_KEY: order_items,
+        })
+        logger.info(f"--- Pedido {order_id} REGISTRADO CORRECTAMENTE ({backend.name}) ---")
+        await _index_registered_order(user_id, order_id, timestamp, total, order_items)
 
         # 3. Limpiar el estado de la sesión para el siguiente pedido
         logger.info("[Tool] Limpiando estado de la sesión después del pedido.")
@@ -522,6 +585,7 @@ async def registrar_pedido_finalizado(tool_context: Any) -> Dict[str, Any]:
         # 5. Devolver mensaje de éxito al usuario
         return {
             "status": "success",
+            "order_id": order_id,
             "message": f"¡Gracias, {customer_name.title()}! Tu pedido #{order_id} por S/ {total:.2f} ha sido registrado y se enviará a: {address}."
         }
 
@@ -535,19 +599,12 @@ async def registrar_pedido_finalizado(tool_context: Any) -> Dict[str, Any]:
 
 async def get_general_info(tool_context: ToolContext, info_key: str) -> Dict[str, Any]:
     """
-    Obtiene información general de la pizzería desde una fuente de verdad externa
-    (simulada aquí, pero idealmente una pestaña de Google Sheets 'Configuracion').
+    Obtiene información general de la pizzería desde la pestaña de Google Sheets 'Configuracion'.
+    Responde desde la caché en memoria (config_cache): ninguna pregunta espera a Sheets.
     """
     logger.info(f"[Tool] Solicitando información general para la clave: '{info_key}'")
     
-    # Simulación de lectura desde una hoja de cálculo 'Configuracion'
-    config_data = {
-        "horario": "Nuestro horario es de Lunes a Sábado, de 11:00 AM a 10:00 PM. Domingos cerramos.",
-        "telefono": "Puedes contactarnos al número +51 987 654 321.",
-        "ubicacion": "Estamos ubicados en Av. Siempre Viva 742."
-    }
-    
-    data = config_data.get(info_key.lower())
+    data = config_cache.get_config().get(info_key)
     
     if data:
         return {"status": "success", "info_key": info_key, "info_value": data}
@@ -556,15 +613,20 @@ async def get_general_info(tool_context: ToolContext, info_key: str) -> Dict[str
 
 async def handle_complaint(tool_context: ToolContext, complaint_text: str) -> Dict[str, Any]:
     """
-    Registra la queja de un cliente en un sistema externo
-    (simulado aquí, pero idealmente una pestaña de Google Sheets 'Quejas').
+    Registra la queja de un cliente en la pestaña de Google Sheets 'Quejas'.
+    La escritura se hace en segundo plano y por lotes (complaints_queue): la respuesta no la espera.
     """
     state = get_state_from_context(tool_context)
-    customer_name = state.get('_customer_name_for_greeting', 'Anónimo')
+    customer_name = state.get('_customer_name_for_greeting') or 'Anónimo'
     
     logger.warning(f"[Tool] QUEJA REGISTRADA - Cliente: {customer_name}, Queja: '{complaint_text}'")
     
-    # Aquí iría la lógica para escribir en la pestaña 'Quejas' de Google Sheets.
+    complaints_queue.get_queue().submit({
+        'Fecha': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'ID_Cliente': str(state.get('_session_user_id') or ''),
+        'Nombre': customer_name,
+        'Queja': complaint_text,
+    })
     
     return {
         "status": "success",
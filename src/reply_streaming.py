@@ -0,0 +1,108 @@
+# ==============================================================================
+# reply_streaming.py - ENTREGA PROGRESIVA DE RESPUESTAS E INDICADOR "ESCRIBIENDO"
+# ==============================================================================
+"""
+En modo streaming (STREAM_REPLIES=1, por defecto) cada texto final que produce el
+orquestador se envía en cuanto aparece, incluidos los mensajes de transición de
+fase que antes quedaban pisados por el último texto del turno.
+
+Con STREAM_PARTIALS=1 el runner se ejecuta en modo SSE y el texto parcial del
+modelo se muestra editando un mismo mensaje (como máximo una edición cada
+STREAM_EDIT_INTERVAL_S, por los límites de Telegram). Todos los envíos pasan
+por outbound_queue.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+from telegram.constants import ChatAction
+from telegram.error import BadRequest
+
+import outbound_queue
+from logging_setup import LazyPayload
+
+logger = logging.getLogger(__name__)
+
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "1").lower() in ("1", "true", "yes")
+STREAM_PARTIALS = os.environ.get("STREAM_PARTIALS", "0").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL_S = float(os.environ.get("STREAM_EDIT_INTERVAL_S", "1.0"))
+TYPING_REFRESH_S = 4.0 # Telegram muestra "escribiendo..." unos 5 segundos por llamada.
+
+
+def streaming_run_config() -> Optional[Any]:
+    """RunConfig en modo SSE si se piden parciales; None para usar el de ADK por defecto."""
+    if not STREAM_PARTIALS:
+        return None
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+    return RunConfig(streaming_mode=StreamingMode.SSE)
+
+
+async def keep_typing(chat: Any) -> None:
+    """Mantiene el indicador 'escribiendo...' hasta que se cancele la tarea."""
+    try:
+        while True:
+            try:
+                await chat.send_action(ChatAction.TYPING)
+            except Exception as e:
+                logger.debug("No se pudo enviar el indicador de escritura: %s", e)
+            await asyncio.sleep(TYPING_REFRESH_S)
+    except asyncio.CancelledError:
+        pass
+
+
+class StreamingReply:
+    """
+    Recibe los textos de un turno y los entrega al chat a medida que llegan.
+    on_first_send se llama justo antes del primer envío (p.ej. para marcar el turno como no cancelable).
+    """
+
+    def __init__(self, message: Any, on_first_send: Optional[Callable[[], None]] = None,
+                 edit_interval_s: float = STREAM_EDIT_INTERVAL_S):
+        self.message = message
+        self.on_first_send = on_first_send
+        self.edit_interval_s = edit_interval_s
+        self.delivered = 0
+        self._draft = None # Mensaje que se va editando con el texto parcial.
+        self._draft_text = ""
+        self._last_edit_at = 0.0
+
+    def _before_send(self) -> None:
+        if self.delivered == 0 and self._draft is None and self.on_first_send:
+            self.on_first_send()
+
+    async def on_partial(self, text_so_far: str) -> None:
+        text_so_far = text_so_far.strip()
+        if not text_so_far or text_so_far == self._draft_text:
+            return
+        now = time.monotonic()
+        if self._draft is None:
+            self._before_send()
+            self._draft = await outbound_queue.reply_text(self.message, text_so_far)
+        elif now - self._last_edit_at >= self.edit_interval_s:
+            await self._edit(text_so_far)
+        else:
+            return
+        self._draft_text = text_so_far
+        self._last_edit_at = now
+
+    async def on_text(self, text: str) -> None:
+        """Texto final de un evento: cierra el borrador si lo hay o envía un mensaje nuevo."""
+        if self._draft is not None:
+            if text != self._draft_text:
+                await self._edit(text)
+            self._draft = None
+            self._draft_text = ""
+        else:
+            self._before_send()
+            await outbound_queue.reply_text(self.message, text)
+        self.delivered += 1
+        logger.info("📤 Bot respondió (streaming) al chat %s: '%s'", self.message.chat_id, LazyPayload(text, 100), extra={'category': 'turn'})
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await outbound_queue.edit_text(self._draft, text)
+        except BadRequest as e:
+            # "Message is not modified" y similares no deben cortar el turno.
+            logger.debug("Edición de borrador omitida: %s", e)
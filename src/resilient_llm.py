@@ -0,0 +1,175 @@
+# ==============================================================================
+# resilient_llm.py - REINTENTOS CON BACKOFF Y PETICIONES DE COBERTURA (HEDGING)
+# ==============================================================================
+"""
+Envoltorio de Gemini para el camino de producción (Telegram), equivalente al bucle
+de reintentos que ya tenía interactive_chat pero por llamada y por agente:
+
+- Errores transitorios (503, 429/cuota, 5xx, timeouts) se reintentan con backoff
+  exponencial con jitter completo, sin pasarse del plazo del turno (turn_deadline).
+- Con MODEL_HEDGE=1, si una llamada tarda más que el percentil configurado de las
+  latencias recientes del agente, se lanza una copia y se usa la que responda antes.
+
+Los reintentos y coberturas se cuentan por agente en /metrics.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncGenerator, Deque, Dict, List, Optional
+
+from google.adk.models import Gemini, LlmRequest, LlmResponse
+from google.api_core import exceptions as core_exceptions
+from google.genai import errors as genai_errors
+from pydantic import PrivateAttr
+
+import metrics
+import model_routing
+import turn_deadline
+
+logger = logging.getLogger(__name__)
+
+
+def _load_attempts() -> Dict[str, int]:
+    """MODEL_RETRY_ATTEMPTS: número entero o JSON {"*": 3, "IntentClassifierAgent": 2}."""
+    raw = os.environ.get("MODEL_RETRY_ATTEMPTS", "3")
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        logger.warning("MODEL_RETRY_ATTEMPTS no es válido. Se usan 3 intentos.")
+        return {"*": 3}
+    return {str(k): int(v) for k, v in value.items()} if isinstance(value, dict) else {"*": int(value)}
+
+
+RETRY_ATTEMPTS = _load_attempts()
+RETRY_BASE_DELAY_S = float(os.environ.get("MODEL_RETRY_BASE_DELAY_S", "0.5"))
+RETRY_MAX_DELAY_S = float(os.environ.get("MODEL_RETRY_MAX_DELAY_S", "8"))
+
+HEDGE_ENABLED = os.environ.get("MODEL_HEDGE", "0").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("MODEL_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY_S = float(os.environ.get("MODEL_HEDGE_MIN_DELAY_S", "1.0"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+MODEL_RETRIES_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_model_retries_total", "Reintentos de llamadas al modelo por agente y tipo de error.", ["agent", "reason"]
+)
+MODEL_HEDGES_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_model_hedges_total", "Peticiones de cobertura lanzadas por agente y cuál ganó.", ["agent", "winner"]
+)
+MODEL_GIVE_UPS_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_model_give_ups_total", "Llamadas al modelo que agotaron reintentos o plazo, por agente.", ["agent"]
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Errores transitorios de la API de Gemini que vale la pena reintentar."""
+    if isinstance(error, (core_exceptions.ServiceUnavailable, core_exceptions.ResourceExhausted,
+                          core_exceptions.DeadlineExceeded, core_exceptions.InternalServerError,
+                          genai_errors.ServerError)):
+        return True
+    if isinstance(error, genai_errors.ClientError) and getattr(error, 'code', None) == 429:
+        return True
+    return turn_deadline.is_timeout_error(error)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial con jitter completo: uniforme en [0, min(máx, base * 2^intento)]."""
+    return random.uniform(0.0, min(RETRY_MAX_DELAY_S, RETRY_BASE_DELAY_S * (2 ** attempt)))
+
+
+class ResilientGemini(Gemini):
+    """Gemini con reintentos por agente y, opcionalmente, peticiones de cobertura."""
+    agent_name: str = ""
+    _latencies: Deque[float] = PrivateAttr(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def _max_attempts(self) -> int:
+        return max(1, RETRY_ATTEMPTS.get(self.agent_name, RETRY_ATTEMPTS.get("*", 3)))
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Umbral de latencia a partir del cual se lanza la cobertura (None si no aplica)."""
+        if not HEDGE_ENABLED or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        threshold = ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+        return max(HEDGE_MIN_DELAY_S, threshold)
+
+    async def _collect(self, llm_request: LlmRequest) -> List[LlmResponse]:
+        responses = []
+        async for response in super().generate_content_async(llm_request, stream=False):
+            responses.append(response)
+        return responses
+
+    async def _collect_hedged(self, llm_request: LlmRequest) -> List[LlmResponse]:
+        hedge_delay = self._hedge_delay()
+        primary = asyncio.ensure_future(self._collect(llm_request))
+        if hedge_delay is None:
+            return await primary
+        hedge: Optional[asyncio.Future] = None
+        last_error: Optional[BaseException] = None
+        try:
+            # asyncio.wait no cancela sus tareas si nos cancelan (plazo del turno, mensajes
+            # agrupados): el finally se encarga, también durante esta primera espera.
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            hedge = asyncio.ensure_future(self._collect(llm_request.model_copy(deep=True)))
+            logger.info(f"🪁 Llamada de '{self.agent_name}' supera {hedge_delay:.2f}s. Lanzando petición de cobertura.")
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        MODEL_HEDGES_TOTAL.inc(agent=self.agent_name, winner='hedge' if task is hedge else 'primary')
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        max_attempts = self._max_attempts()
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            yielded = False
+            try:
+                if stream:
+                    # En streaming solo se reintenta si aún no se entregó ningún fragmento.
+                    async for response in super().generate_content_async(llm_request, stream=True):
+                        yielded = True
+                        yield response
+                else:
+                    for response in await self._collect_hedged(llm_request):
+                        yield response
+                self._latencies.append(time.monotonic() - started_at)
+                return
+            except Exception as e:
+                elapsed = time.monotonic() - started_at
+                if yielded or not is_retryable(e):
+                    raise
+                model_routing.ROUTER.record(llm_request.model or self.model, elapsed, ok=False)
+                attempt += 1
+                delay = backoff_delay(attempt)
+                deadline = turn_deadline.current_deadline()
+                out_of_time = deadline is not None and deadline.remaining() <= delay + turn_deadline.REPLY_RESERVE_S
+                if attempt >= max_attempts or out_of_time:
+                    MODEL_GIVE_UPS_TOTAL.inc(agent=self.agent_name)
+                    logger.error(f"❌ '{self.agent_name}' agotó {'el plazo del turno' if out_of_time else 'los reintentos'} tras {attempt} intentos: {e!r}")
+                    raise
+                MODEL_RETRIES_TOTAL.inc(agent=self.agent_name, reason=type(e).__name__)
+                logger.warning(f"Error transitorio de la API en '{self.agent_name}' (Intento {attempt}/{max_attempts}): {e!r}. Reintentando en {delay:.2f}s...")
+                await asyncio.sleep(delay)
+                # El timeout HTTP del reintento se recalcula con lo que queda del turno.
+                turn_deadline.apply_model_timeout(llm_request)
+
+
+def resilient_model(agent_name: str) -> ResilientGemini:
+    """Modelo configurado para el agente (model_routing) envuelto con reintentos y cobertura."""
+    return ResilientGemini(model=model_routing.model_for(agent_name), agent_name=agent_name)
@@ -0,0 +1,346 @@
+# ==============================================================================
+# session_store.py - SESIONES ADK ACOTADAS: EXPULSIÓN POR INACTIVIDAD/LRU Y VOLCADO A DISCO
+# ==============================================================================
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, InMemorySessionService, Session
+
+import metrics
+from admission import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str, str] # (app_name, user_id, session_id)
+
+SESSIONS_SPILLED = metrics.REGISTRY.gauge("pizzeria_sessions_spilled", "Sesiones volcadas a disco pendientes de recarga.")
+SESSION_EVICTIONS_TOTAL = metrics.REGISTRY.counter("pizzeria_session_evictions_total", "Sesiones expulsadas de memoria.", ["reason"])
+SESSION_RELOADS_TOTAL = metrics.REGISTRY.counter("pizzeria_session_reloads_total", "Sesiones recargadas desde disco.")
+
+
+class SessionSpillStore:
+    """
+    Almacén local de sesiones expulsadas: un archivo JSON comprimido (gzip) por sesión.
+    El nombre del archivo codifica la clave, así el índice se reconstruye con un listdir.
+    """
+    SUFFIX = '.json.gz'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index: Dict[SessionKey, str] = {}
+        for filename in os.listdir(directory):
+            key = self._key_from_filename(filename)
+            if key:
+                self._index[key] = os.path.join(directory, filename)
+        SESSIONS_SPILLED.set(len(self._index))
+
+    def _filename(self, key: SessionKey) -> str:
+        # quote(safe='') siempre codifica '+', así que sirve de separador sin ambigüedad.
+        return "+".join(quote(part, safe='') for part in key) + self.SUFFIX
+
+    def _key_from_filename(self, filename: str) -> Optional[SessionKey]:
+        if not filename.endswith(self.SUFFIX):
+            return None
+        parts = filename[:-len(self.SUFFIX)].split("+")
+        return tuple(unquote(part) for part in parts) if len(parts) == 3 else None
+
+    def __contains__(self, key: SessionKey) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> List[SessionKey]:
+        return list(self._index)
+
+    def write(self, key: SessionKey, payload: Dict[str, Any]) -> None:
+        """Escritura atómica (archivo temporal + rename). Bloqueante: llamar desde un hilo."""
+        path = os.path.join(self.directory, self._filename(key))
+        _write_json_gz(path, payload)
+        self._index[key] = path
+        SESSIONS_SPILLED.set(len(self._index))
+
+    def read(self, key: SessionKey) -> Optional[Dict[str, Any]]:
+        path = self._index.get(key)
+        if not path:
+            return None
+        try:
+            return _read_json_gz(path)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"[SessionStore] No se pudo leer la sesión volcada {key}: {e!r}")
+            return None
+
+    def remove(self, key: SessionKey) -> None:
+        path = self._index.pop(key, None)
+        SESSIONS_SPILLED.set(len(self._index))
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def serialize_session(session: Session, max_events: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Forma compacta de una sesión: estado, marca de tiempo y eventos sin campos vacíos.
+    Con max_events solo se conservan los últimos N eventos (el estado va completo igualmente).
+    """
+    events = session.events if max_events is None else session.events[-max_events:] if max_events else []
+    return {
+        "app_name": session.app_name,
+        "user_id": session.user_id,
+        "id": session.id,
+        "state": session.state,
+        "last_update_time": session.last_update_time,
+        "events": [event.model_dump(mode='json', exclude_none=True) for event in events],
+    }
+
+
+def _write_json_gz(path: str, payload: Dict[str, Any]) -> None:
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _read_json_gz(path: str) -> Dict[str, Any]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class BoundedSessionService(BaseSessionService):
+    """
+    Envoltura sobre InMemorySessionService con un tope de sesiones en memoria (LRU) y un TTL
+    de inactividad. Las sesiones expulsadas se vuelcan a SessionSpillStore y se recargan de
+    forma perezosa en el siguiente get_session, así que para el Runner son transparentes.
+    """
+
+    def __init__(
+        self,
+        spill_dir: str,
+        max_sessions: int = 2000,
+        idle_ttl_s: float = 1800.0,
+        min_idle_s: float = 60.0,
+        inner: Optional[InMemorySessionService] = None,
+    ):
+        super().__init__()
+        self.inner = inner or InMemorySessionService()
+        self.spill = SessionSpillStore(spill_dir)
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        # Nunca se expulsa por LRU una sesión usada hace menos de esto (puede tener un turno en curso).
+        self.min_idle_s = min_idle_s
+        self._last_access: "OrderedDict[SessionKey, float]" = OrderedDict()
+        # Un lock por sesión para lecturas, eventos, expulsión y recarga; se borra cuando nadie lo usa ni lo espera.
+        self._key_locks = KeyedLocks()
+        self._sweeper: Optional[asyncio.Task] = None
+        metrics.SESSIONS_ACTIVE.set(0)
+
+    # --- Contabilidad LRU ---
+    def _touch(self, key: SessionKey) -> None:
+        self._last_access[key] = time.monotonic()
+        self._last_access.move_to_end(key)
+        metrics.SESSIONS_ACTIVE.set(len(self._last_access))
+
+    def active_keys(self) -> List[SessionKey]:
+        return list(self._last_access)
+
+    # --- API de BaseSessionService ---
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        if session_id is None:
+            session = await self.inner.create_session(app_name=app_name, user_id=user_id, state=state)
+            self._touch((app_name, user_id, session.id))
+        else:
+            async with self._key_locks.hold((app_name, user_id, session_id)):
+                session = await self.inner.create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+                self.spill.remove((app_name, user_id, session_id)) # Una sesión nueva reemplaza cualquier volcado antiguo con la misma clave
+                self._touch((app_name, user_id, session_id))
+        await self._enforce_capacity()
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Any = None) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        # Con el lock de la sesión: no se lee a medio expulsar (los eventos añadidos se perderían).
+        async with self._key_locks.hold(key):
+            reloaded = await self._reload_locked(key)
+            session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+            if session is not None:
+                self._touch(key)
+        if reloaded:
+            await self._enforce_capacity()
+        return session
+
+    async def list_sessions(self, *, app_name: str, user_id: str):
+        response = await self.inner.list_sessions(app_name=app_name, user_id=user_id)
+        in_memory = {session.id for session in response.sessions}
+        for spilled_app, spilled_user, spilled_id in self.spill.keys():
+            if spilled_app == app_name and spilled_user == user_id and spilled_id not in in_memory:
+                response.sessions.append(Session(app_name=app_name, user_id=user_id, id=spilled_id, state={}, events=[]))
+        return response
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        async with self._key_locks.hold(key): # Una expulsión en curso no debe dejar el volcado detrás.
+            self.spill.remove(key)
+            if self._last_access.pop(key, None) is not None:
+                metrics.SESSIONS_ACTIVE.set(len(self._last_access))
+            await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        key = (session.app_name, session.user_id, session.id)
+        async with self._key_locks.hold(key):
+            # Si se expulsó durante el turno (no debería pasar gracias a min_idle_s), la traemos de vuelta.
+            reloaded = await self._reload_locked(key)
+            self._touch(key)
+            appended = await self.inner.append_event(session, event)
+        if reloaded:
+            await self._enforce_capacity()
+        return appended
+
+    # --- Expulsión y recarga ---
+    async def _evict(self, key: SessionKey, reason: str, idle_since: Optional[float] = None) -> bool:
+        """
+        Vuelca la sesión a disco y la saca de memoria. Con 'idle_since', solo si no se ha usado
+        después de ese instante (se comprueba con el lock: entre elegirla y expulsarla pudo
+        llegar un turno). Devuelve True si se expulsó.
+        """
+        async with self._key_locks.hold(key):
+            last_access = self._last_access.get(key)
+            if last_access is None or (idle_since is not None and last_access > idle_since):
+                return False
+            app_name, user_id, session_id = key
+            session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            if session is not None:
+                await asyncio.to_thread(self.spill.write, key, serialize_session(session))
+                await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            self._last_access.pop(key, None)
+        metrics.SESSIONS_ACTIVE.set(len(self._last_access))
+        SESSION_EVICTIONS_TOTAL.inc(reason=reason)
+        logger.info("[SessionStore] Sesión %s expulsada a disco (%s).", key[2], reason, extra={'category': 'session'})
+        return True
+
+    async def _reload_locked(self, key: SessionKey) -> bool:
+        """Recarga la sesión desde disco si está volcada. Con el lock de la sesión tomado."""
+        if key in self._last_access or key not in self.spill:
+            return False
+        payload = await asyncio.to_thread(self.spill.read, key)
+        self.spill.remove(key)
+        if payload is None:
+            return False
+        await self._restore(payload)
+        SESSION_RELOADS_TOTAL.inc()
+        logger.info("[SessionStore] Sesión %s recargada desde disco (%d eventos).", key[2], len(payload.get("events", [])), extra={'category': 'session'})
+        return True
+
+    async def _restore(self, payload: Dict[str, Any]) -> Session:
+        """
+        Recrea la sesión en memoria con su estado final y vuelve a anexar los eventos para
+        conservar el historial de conversación. Reaplicar los state_delta en orden deja el
+        mismo estado final, porque en ADK todo cambio de estado persistente viaja en eventos.
+        """
+        session = await self.inner.create_session(
+            app_name=payload["app_name"], user_id=payload["user_id"], state=payload.get("state") or {}, session_id=payload["id"]
+        )
+        for event_data in payload.get("events", []):
+            # Se valida en modo JSON para que los campos binarios (base64) se decodifiquen bien.
+            await self.inner.append_event(session, Event.model_validate_json(json.dumps(event_data)))
+        self._touch((payload["app_name"], payload["user_id"], payload["id"]))
+        return session
+
+    async def _enforce_capacity(self) -> None:
+        now = time.monotonic()
+        while len(self._last_access) > self.max_sessions:
+            key, last_access = next(iter(self._last_access.items()))
+            if now - last_access < self.min_idle_s:
+                break # Todas las sesiones restantes están en uso; preferimos exceder el tope un momento
+            # Si se usó mientras tanto, pasa al final del LRU y el bucle sigue con la siguiente.
+            await self._evict(key, reason='lru', idle_since=last_access)
+
+    async def evict_idle(self) -> int:
+        """Vuelca a disco todas las sesiones inactivas por más de idle_ttl_s."""
+        cutoff = time.monotonic() - self.idle_ttl_s
+        idle = [key for key, last_access in self._last_access.items() if last_access < cutoff]
+        evicted = 0
+        for key in idle:
+            evicted += await self._evict(key, reason='idle', idle_since=cutoff)
+        return evicted
+
+    async def spill_all(self) -> int:
+        """Vuelca todas las sesiones en memoria (útil al apagar el proceso)."""
+        evicted = 0
+        for key in self.active_keys():
+            evicted += await self._evict(key, reason='shutdown')
+        return evicted
+
+    # --- Snapshot para reinicios en caliente ---
+    async def write_snapshot(self, path: str, max_events: int = 30) -> int:
+        """
+        Escribe en un único archivo gzip el estado (y los últimos eventos) de todas las sesiones
+        en memoria, ordenadas de la más reciente a la más antigua. Las ya volcadas a disco no se
+        incluyen: siguen en SessionSpillStore y sobreviven al reinicio por sí solas.
+        """
+        sessions = []
+        for app_name, user_id, session_id in reversed(self.active_keys()):
+            session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            if session is not None:
+                sessions.append(serialize_session(session, max_events=max_events))
+        payload = {"version": 1, "written_at": time.time(), "sessions": sessions}
+        await asyncio.to_thread(_write_json_gz, path, payload)
+        return len(sessions)
+
+    async def restore_snapshot(self, path: str) -> int:
+        """
+        Restaura en memoria las sesiones de un snapshot (las más recientes primero, hasta
+        max_sessions; el resto pasa al almacén de volcado). El archivo se renombra a
+        '.restored' para no aplicarlo dos veces si el proceso vuelve a caer.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            payload = await asyncio.to_thread(_read_json_gz, path)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"[SessionStore] Snapshot '{path}' ilegible, se ignora: {e!r}")
+            return 0
+
+        restored = 0
+        for session_data in payload.get("sessions", []):
+            key = (session_data["app_name"], session_data["user_id"], session_data["id"])
+            if key in self._last_access:
+                continue
+            self.spill.remove(key) # El snapshot es más reciente que cualquier volcado previo
+            if len(self._last_access) < self.max_sessions:
+                await self._restore(session_data)
+            else:
+                await asyncio.to_thread(self.spill.write, key, session_data)
+            restored += 1
+        os.replace(path, path + '.restored')
+        return restored
+
+    # --- Barrido periódico ---
+    def start_sweeper(self, interval_s: float = 60.0) -> None:
+        async def _sweep_forever():
+            while True:
+                await asyncio.sleep(interval_s)
+                try:
+                    evicted = await self.evict_idle()
+                    if evicted:
+                        logger.info(f"[SessionStore] Barrido: {evicted} sesiones inactivas volcadas a disco.")
+                except Exception as e:
+                    logger.error(f"[SessionStore] Error en el barrido de sesiones: {e!r}", exc_info=True)
+
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(_sweep_forever())
+
+    def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
@@ -1,7 +1,12 @@
 # Contenido COMPLETO y CORREGIDO para sheets_client.py
 
+import os
+import threading
+
 import gspread
 from google.oauth2.service_account import Credentials 
+import metrics
+import tenants
 
 # Define el alcance (scope) de los permisos.
 SCOPES = [
@@ -15,64 +20,112 @@ CREDS_FILE = 'google-credentials.json'
 # Nombre de tu Hoja de Cálculo en Google Drive (lo dejamos por si volvemos a usarlo, pero open_by_url no lo usa)
 SPREADSHEET_NAME = 'PizzeriaBotDB' 
 
-_spreadsheet = None 
+# URL de la hoja de la pizzería por defecto; cada tenant puede indicar la suya (ver tenants.py).
+# Nota: A menudo es mejor quitar la parte final de la URL como "?gid=..." o "#gid=..."
+# Ejemplo sin #gid: "https://docs.google.com/spreadsheets/d/1nB8F00oaSAUoh4QJB3lcIpJryLEgk-Wi_BZJbZhLmik/edit"
+DEFAULT_SPREADSHEET_URL = os.environ.get(
+    "SPREADSHEET_URL",
+    "https://docs.google.com/spreadsheets/d/1nB8F00oaSAUoh4QJB3lcIpJryLEgk-Wi_BZJbZhLmik/edit?gid=304647370#gid=304647370",
+)
 
-def _get_spreadsheet_client():
+class _InstrumentedWorksheet:
     """
-    Función interna para autenticarse con Google Sheets usando credenciales de cuenta de servicio
-    y abrir la hoja de cálculo especificada por URL. Cachea el objeto spreadsheet.
+    Envoltura delgada sobre un gspread.Worksheet que cuenta cada llamada (y sus errores)
+    en las métricas de Sheets. Todo lo demás se delega tal cual al worksheet real.
     """
-    global _spreadsheet
-    if _spreadsheet is None: 
-        try:
-            creds = Credentials.from_service_account_file(CREDS_FILE, scopes=SCOPES)
-            client = gspread.authorize(creds)
-            
-            # --- LÍNEA MODIFICADA PARA USAR LA URL CORRECTAMENTE ---
-            # !!! ASEGÚRATE DE PEGAR AQUÍ LA URL COMPLETA Y CORRECTA DE TU HOJA DE CÁLCULO !!!
-            spreadsheet_url = "https://docs.google.com/spreadsheets/d/1nB8F00oaSAUoh4QJB3lcIpJryLEgk-Wi_BZJbZhLmik/edit?gid=304647370#gid=304647370" # <-- REEMPLAZA ESTA URL DE EJEMPLO CON LA TUYA
-            # Nota: A menudo es mejor quitar la parte final de la URL como "?gid=..." o "#gid=..."
-            # Prueba con la URL completa primero, si falla, prueba solo hasta "/edit"
-            # Ejemplo sin #gid: "https://docs.google.com/spreadsheets/d/1nB8F00oaSAUoh4QJB3lcIpJryLEgk-Wi_BZJbZhLmik/edit"
-
-            _spreadsheet = client.open_by_url(spreadsheet_url)
-            # Si abres por URL, el SPREADSHEET_NAME que tengas arriba no se usa para esta operación,
-            # pero es bueno saber el nombre real para los logs.
-            actual_spreadsheet_name = _spreadsheet.title
-            print(f"[sheets_client] Conexión exitosa a la Hoja de Cálculo por URL. Nombre: '{actual_spreadsheet_name}'")
-        except Exception as e:
-            print(f"[sheets_client] Error CRÍTICO al conectar o abrir la Hoja de Cálculo por URL.")
-            print(f"[sheets_client] Tipo de error: {type(e)}")
-            print(f"[sheets_client] Detalles del error: {repr(e)}")
-            _spreadsheet = "ERROR" 
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        def _counted(*args, **kwargs):
+            metrics.SHEETS_REQUESTS_TOTAL.inc(operation=name)
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                metrics.SHEETS_ERRORS_TOTAL.inc(operation=name)
+                raise
+        return _counted
+
+class SheetsConnection:
+    """
+    Conexión perezosa a la Hoja de Cálculo de una pizzería. Se autentica y abre la
+    hoja por URL la primera vez que se pide una pestaña, y cachea el objeto spreadsheet.
+    """
+    def __init__(self, spreadsheet_url: str = DEFAULT_SPREADSHEET_URL, creds_file: str = CREDS_FILE):
+        self.spreadsheet_url = spreadsheet_url
+        self.creds_file = creds_file
+        self._spreadsheet = None
+        self._lock = threading.Lock() # Las pestañas se piden desde hilos (asyncio.to_thread).
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                try:
+                    creds = Credentials.from_service_account_file(self.creds_file, scopes=SCOPES)
+                    client = gspread.authorize(creds)
+                    self._spreadsheet = client.open_by_url(self.spreadsheet_url)
+                    # Si abres por URL, el SPREADSHEET_NAME que tengas arriba no se usa para esta operación,
+                    # pero es bueno saber el nombre real para los logs.
+                    actual_spreadsheet_name = self._spreadsheet.title
+                    print(f"[sheets_client] Conexión exitosa a la Hoja de Cálculo por URL. Nombre: '{actual_spreadsheet_name}'")
+                except Exception as e:
+                    print(f"[sheets_client] Error CRÍTICO al conectar o abrir la Hoja de Cálculo por URL.")
+                    print(f"[sheets_client] Tipo de error: {type(e)}")
+                    print(f"[sheets_client] Detalles del error: {repr(e)}")
+                    self._spreadsheet = "ERROR"
+                    return None
+
+        if self._spreadsheet == "ERROR":
             return None
-    
-    if _spreadsheet == "ERROR": 
+        return self._spreadsheet
+
+    def worksheet(self, worksheet_name: str):
+        """
+        Obtiene una pestaña (worksheet) específica de esta hoja de cálculo.
+        """
+        spreadsheet = self.spreadsheet()
+
+        metrics.SHEETS_REQUESTS_TOTAL.inc(operation='worksheet')
+        if spreadsheet:
+            try:
+                worksheet = spreadsheet.worksheet(worksheet_name)
+                print(f"[sheets_client] Acceso exitoso a la pestaña: '{worksheet_name}'")
+                return _InstrumentedWorksheet(worksheet)
+            except gspread.exceptions.WorksheetNotFound:
+                # Usamos spreadsheet.title para obtener el nombre real de la hoja abierta por URL
+                print(f"[sheets_client] Error: Pestaña '{worksheet_name}' no encontrada en la Hoja de Cálculo '{spreadsheet.title}'. Verifica el nombre exacto.")
+            except Exception as e:
+                print(f"[sheets_client] Error al intentar obtener la pestaña '{worksheet_name}':")
+                print(f"[sheets_client] Tipo de error: {type(e)}")
+                print(f"[sheets_client] Detalles del error: {repr(e)}")
+        else:
+            print(f"[sheets_client] No se pudo obtener la pestaña '{worksheet_name}' porque no se pudo conectar a la Hoja de Cálculo.")
+
+        metrics.SHEETS_ERRORS_TOTAL.inc(operation='worksheet')
         return None
-    return _spreadsheet
+
+
+# Una conexión por pizzería (ver tenants.py); con un solo tenant, la de siempre.
+_connections = {}
+
+def current_connection() -> SheetsConnection:
+    return tenants.scoped(_connections, lambda tenant: SheetsConnection(tenant.spreadsheet_url or DEFAULT_SPREADSHEET_URL))
+
+def _get_spreadsheet_client():
+    """
+    Función interna que devuelve el objeto spreadsheet de la pizzería activa (o None si falló la conexión).
+    """
+    return current_connection().spreadsheet()
 
 def get_worksheet(worksheet_name: str):
     """
-    Obtiene una pestaña (worksheet) específica de la hoja de cálculo principal.
+    Obtiene una pestaña (worksheet) específica de la hoja de cálculo de la pizzería activa.
     """
-    spreadsheet = _get_spreadsheet_client() 
-    
-    if spreadsheet: 
-        try:
-            worksheet = spreadsheet.worksheet(worksheet_name)
-            print(f"[sheets_client] Acceso exitoso a la pestaña: '{worksheet_name}'")
-            return worksheet
-        except gspread.exceptions.WorksheetNotFound:
-            # Usamos spreadsheet.title para obtener el nombre real de la hoja abierta por URL
-            print(f"[sheets_client] Error: Pestaña '{worksheet_name}' no encontrada en la Hoja de Cálculo '{spreadsheet.title}'. Verifica el nombre exacto.")
-        except Exception as e:
-            print(f"[sheets_client] Error al intentar obtener la pestaña '{worksheet_name}':")
-            print(f"[sheets_client] Tipo de error: {type(e)}")
-            print(f"[sheets_client] Detalles del error: {repr(e)}")
-    else:
-        print(f"[sheets_client] No se pudo obtener la pestaña '{worksheet_name}' porque no se pudo conectar a la Hoja de Cálculo.")
-        
-    return None
+    return current_connection().worksheet(worksheet_name)
 
 if __name__ == '__main__':
     print("-----------------------------------------------------")
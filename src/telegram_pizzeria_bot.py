@@ -4,6 +4,9 @@
 
 import asyncio
 import logging
+import signal
+import time
+_PROCESS_STARTED_AT = time.perf_counter() # Para medir el tiempo total de arranque
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import os
@@ -13,18 +16,28 @@ import json
 # Importar componentes ADK
 from pizzeria_agents import root_agent
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types as genai_types
+from session_store import BoundedSessionService
 from google.adk.events import Event
+import metrics
+from turn_processing import ensure_session, run_turn
+from admission import ADMISSION, KeyedLocks, Shed, shed_reply
+import turn_deadline
+from message_coalescing import COALESCE_WINDOW_S, MessageCoalescer, PendingTurn
+from typing import Dict, List, Optional
+import outbound_queue
+import menu_pdf
+import persistence
+import menu_cache
+import tenants
+import config_cache
+import complaints_queue
+from reply_streaming import STREAM_PARTIALS, STREAM_REPLIES, StreamingReply, keep_typing, streaming_run_config
+from logging_setup import setup_logging, LazyPayload
 
 # --- Configuración de Logging ---
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] %(message)s',
-    level=logging.INFO
-)
+# Escritor en segundo plano, formato texto/JSON y muestreo por categoría (ver logging_setup.py).
+setup_logging()
 logger = logging.getLogger(__name__)
-logging.getLogger('google_adk').setLevel(logging.WARNING)
-logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # --- Configuración del Bot y ADK ---
 env_path = find_dotenv(usecwd=True)
@@ -34,153 +47,274 @@ if env_path:
 else:
     logger.info("Archivo .env NO encontrado.")
 
-TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-if not TELEGRAM_BOT_TOKEN:
+# Una o varias pizzerías (ver tenants.py); sin TENANTS_CONFIG, solo la de TELEGRAM_BOT_TOKEN.
+if not tenants.bot_tokens():
     logger.critical("¡Error Crítico! TELEGRAM_BOT_TOKEN no encontrado.")
     exit()
 
-APP_NAME_ADK = "PizzeriaChatBot_Telegram_v3"
-session_service_adk = InMemorySessionService()
-runner_adk = Runner(agent=root_agent, app_name=APP_NAME_ADK, session_service=session_service_adk)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0")) # 0 = sin endpoint de métricas
+# Permite apuntar el bot a un Bot API local (p.ej. fake_bot_api.py) en pruebas de carga.
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL")
+# Usuarios de Telegram (IDs separados por comas) que pueden usar los comandos de administración.
+ADMIN_USER_IDS = {int(uid) for uid in os.environ.get("ADMIN_USER_IDS", "").replace(" ", "").split(",") if uid}
+# Sesiones en memoria acotadas: las inactivas o las más antiguas se vuelcan a disco y se recargan al volver.
+session_service_adk = BoundedSessionService(
+    spill_dir=os.environ.get("SESSION_SPILL_DIR", "session_spill"),
+    max_sessions=int(os.environ.get("SESSION_MAX_ACTIVE", "2000")),
+    idle_ttl_s=float(os.environ.get("SESSION_IDLE_TTL_S", "1800")),
+)
+SESSION_SNAPSHOT_PATH = os.environ.get("SESSION_SNAPSHOT_PATH", "session_snapshot.json.gz")
+STARTUP_SECONDS = metrics.REGISTRY.gauge("pizzeria_startup_seconds", "Tiempo desde el inicio del proceso hasta estar listo para recibir mensajes.")
+# Los agentes y el servicio de sesiones son uno solo; cada pizzería tiene su Runner (su app_name).
+_runners: Dict[str, Runner] = {}
+# Un solo turno a la vez por usuario; entre usuarios manda el control de admisión.
+user_turn_locks = KeyedLocks()
 
 
-async def get_or_create_adk_session(user_id_telegram: int):
-    """Obtiene o crea una sesión ADK para un usuario de Telegram."""
-    user_id_adk = str(user_id_telegram)
-    session_id_adk = str(user_id_telegram) # Usamos el mismo ID para simplicidad
+def current_runner() -> Runner:
+    """Runner ADK de la pizzería activa."""
+    return tenants.scoped(_runners, lambda tenant: Runner(agent=root_agent, app_name=tenant.app_name, session_service=session_service_adk))
+
+
+def tenant_for_update(update: Update) -> Optional[tenants.Tenant]:
+    """Pizzería a la que va dirigido un update: por el bot que lo recibió y, si hace falta, por el chat."""
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    tenant = tenants.resolve(update.get_bot().token, chat_id)
+    if tenant is None:
+        logger.warning(f"⚠️ Ninguna pizzería atiende el chat {chat_id} en este bot. Update ignorado.")
+    return tenant
 
-    current_session = await session_service_adk.get_session(
-        app_name=APP_NAME_ADK, user_id=user_id_adk, session_id=session_id_adk
-    )
-    if current_session is None:
-        logger.info(f"No se encontró sesión para user {user_id_adk}. Creando una nueva...")
-        initial_state = {
-            '_session_user_id': user_id_adk,
-            'processing_order_sub_phase': 'A_GESTION_CLIENTE',
-        }
-        await session_service_adk.create_session(
-            app_name=APP_NAME_ADK, user_id=user_id_adk, session_id=session_id_adk, state=initial_state
-        )
-        logger.info(f"Nueva sesión ADK creada para user {user_id_adk}. Estado inicial: {initial_state}")
-    else:
-        # Aseguramos que el estado y la fase inicial existan
-        if not current_session.state:
-            current_session.state = {}
-        if 'processing_order_sub_phase' not in current_session.state:
-            current_session.state['processing_order_sub_phase'] = 'A_GESTION_CLIENTE'
-        current_session.state['_session_user_id'] = user_id_adk
-        logger.info(f"Sesión ADK existente recuperada para user {user_id_adk}. Estado actual: {current_session.state}")
-
-    return user_id_adk, session_id_adk
+
+async def get_or_create_adk_session(user_id_telegram: int):
+    """Obtiene o crea una sesión ADK para un usuario de Telegram (en la pizzería activa)."""
+    return await ensure_session(session_service_adk, tenants.current_tenant().app_name, user_id_telegram)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Maneja los mensajes de texto del usuario con una lógica de bucle para procesar
-    transiciones de estado silenciosas dentro de un mismo turno de conversación.
+    Maneja los mensajes de texto del usuario. El bucle que procesa las transiciones
+    de estado silenciosas dentro de un mismo turno vive en turn_processing.run_turn.
+    Con COALESCE_WINDOW_S > 0 los mensajes seguidos del mismo chat se unen en un solo turno.
     """
     if not update.message or not update.message.text:
         return
+    tenant = tenant_for_update(update)
+    if tenant is None:
+        return
 
     user_id_telegram = update.effective_user.id
     user_message_text = update.message.text
-    logger.info(f"💬 Mensaje del usuario {user_id_telegram}: '{user_message_text}'")
-
-    user_id_adk, session_id_adk = await get_or_create_adk_session(user_id_telegram)
-
-    # Preparamos el mensaje inicial del usuario para la primera iteración del bucle.
-    adk_message_to_process = genai_types.Content(parts=[genai_types.Part(text=user_message_text)], role="user")
-    final_response_text = None
-    
-    # ==============================================================================
-    # INICIO DE LA LÓGICA DE SOLUCIÓN: BUCLE DE PROCESAMIENTO DE TURNOS
-    # ==============================================================================
-    
-    max_loops = 5 # Para evitar bucles infinitos en caso de un bug de estado.
-    current_loop = 0
-
-    while current_loop < max_loops:
-        current_loop += 1
-        logger.info(f"🔄 Iniciando ciclo de procesamiento ADK #{current_loop} para el turno.")
-
-        # Obtener el estado de la fase ANTES de ejecutar el runner.
-        session_before = await session_service_adk.get_session(app_name=APP_NAME_ADK, user_id=user_id_adk, session_id=session_id_adk)
-        phase_before = session_before.state.get('processing_order_sub_phase')
-
-        text_response_from_turn = ""
-
-        try:
-            # Ejecutar el runner de ADK. En la primera vuelta, usa el mensaje del usuario.
-            # En las siguientes, será None, permitiendo que el agente en la nueva fase actúe.
-            events_stream = runner_adk.run_async(
-                user_id=user_id_adk, session_id=session_id_adk, new_message=adk_message_to_process
-            )
-            
-            async for event in events_stream:
-                if event.is_final_response() and event.content and event.content.parts:
-                    if event.content.parts[0].text:
-                        text_response_from_turn = event.content.parts[0].text.strip()
-                        logger.info(f"✅ Texto de respuesta final detectado en ciclo #{current_loop}: '{text_response_from_turn[:100]}...'")
-            
-            # Después del primer ciclo, las siguientes iteraciones se basan en el estado, no en un nuevo mensaje.
-            adk_message_to_process = None
-
-            # Obtener el estado de la fase DESPUÉS de ejecutar el runner.
-            session_after = await session_service_adk.get_session(app_name=APP_NAME_ADK, user_id=user_id_adk, session_id=session_id_adk)
-            phase_after = session_after.state.get('processing_order_sub_phase')
-
-            # Si se obtuvo una respuesta textual, la guardamos y salimos del bucle.
-            if text_response_from_turn:
-                final_response_text = text_response_from_turn
-                logger.info("El ciclo generó una respuesta de texto. Finalizando bucle de turno.")
-                break
-
-            # Si no hubo respuesta de texto, PERO la fase cambió, significa que hubo una transición silenciosa.
-            # Continuamos el bucle para permitir que el nuevo agente actúe.
-            elif phase_before != phase_after:
-                logger.info(f"Transición de fase silenciosa detectada de '{phase_before}' a '{phase_after}'. Continuando ciclo...")
-                continue
-
-            # Si no hubo respuesta y la fase no cambió, el turno realmente terminó. Salimos.
-            else:
-                logger.warning("El ciclo terminó sin respuesta de texto y sin cambio de fase. Finalizando bucle de turno.")
-                break
-
-        except Exception as e:
-            logger.error(f"❌ Error excepcional durante el ciclo de procesamiento ADK: {e}", exc_info=True)
-            final_response_text = "Lo siento, ocurrió un error interno. Por favor, intenta de nuevo."
-            break
-            
-    # ==============================================================================
-    # FIN DE LA LÓGICA DE SOLUCIÓN
-    # ==============================================================================
-
-    # Enviar la respuesta final al usuario si se generó alguna.
-    if final_response_text:
-        await update.message.reply_text(final_response_text)
-        logger.info(f"📤 Bot respondió al chat {user_id_telegram}: '{final_response_text[:100]}...'")
-    else:
-        # Si después de todo el proceso no hay respuesta, enviar un mensaje genérico.
-        await update.message.reply_text("Entendido. ¿Necesitas algo más?")
-        logger.warning(f"⚠️ El flujo del agente terminó sin una respuesta textual explícita para el usuario '{user_id_telegram}'.")
+    logger.info("💬 Mensaje del usuario %s (%s): '%s'", user_id_telegram, tenant.tenant_id, LazyPayload(user_message_text), extra={'category': 'turn'})
+
+    chat_key = f"{tenant.tenant_id}:{user_id_telegram}"
+    if message_coalescer is not None:
+        message_coalescer.submit(chat_key, user_message_text, update)
+        return
+    await process_user_text(chat_key, user_message_text, update)
+
+async def process_user_text(chat_key: str, user_message_text: str, update: Update, pending_turn: Optional[PendingTurn] = None) -> None:
+    """Ejecuta un turno completo (admisión, runner ADK y respuesta) para el texto de un usuario."""
+    tenant = tenant_for_update(update)
+    if tenant is None:
+        return
+    with tenants.activate(tenant):
+        await _process_user_text(user_message_text, update, pending_turn)
+
+async def _process_user_text(user_message_text: str, update: Update, pending_turn: Optional[PendingTurn]) -> None:
+    user_id_telegram = update.effective_user.id
+    runner_adk = current_runner()
+    typing_task = asyncio.ensure_future(keep_typing(update.effective_chat))
+
+    def mark_started() -> None:
+        if pending_turn:
+            # A partir de aquí el turno ya no se puede cancelar para unirlo con otro mensaje.
+            pending_turn.started = True
+
+    stream = StreamingReply(update.message) if STREAM_REPLIES else None
+    try:
+        user_id_adk, session_id_adk = await get_or_create_adk_session(user_id_telegram)
+        async with user_turn_locks.hold(f"{runner_adk.app_name}:{user_id_adk}"):
+            session = await session_service_adk.get_session(app_name=runner_adk.app_name, user_id=user_id_adk, session_id=session_id_adk)
+            phase = session.state.get('processing_order_sub_phase') if session else None
+            try:
+                async with ADMISSION.admit(phase) as waited_s:
+                    # El runner anexa el mensaje a la sesión en cuanto arranca: ya no se puede repetir.
+                    mark_started()
+                    # La espera en cola sale del mismo presupuesto del turno.
+                    result = await run_turn(
+                        runner_adk, user_id_adk, session_id_adk, user_message_text,
+                        deadline_s=turn_deadline.TURN_DEADLINE_S - waited_s,
+                        turn_stats=pending_turn.stats if pending_turn else None,
+                        on_text=stream.on_text if stream else None,
+                        on_partial=stream.on_partial if stream and STREAM_PARTIALS else None,
+                        run_config=streaming_run_config() if stream else None,
+                    )
+            except Shed:
+                mark_started()
+                await outbound_queue.reply_text(update.message, shed_reply(phase))
+                return
+    finally:
+        typing_task.cancel()
+
+    pdf_action = next((a for a in result.actions if a.get('action_request') == menu_pdf.ACTION_SEND_PDF_MENU), None)
+    # Con streaming, lo que el usuario tenía que ver ya se envió a medida que se produjo.
+    if not (stream and stream.delivered):
+        final_response_text = result.text
+
+        # Enviar la respuesta final al usuario si se generó alguna.
+        if final_response_text:
+            await outbound_queue.reply_text(update.message, final_response_text)
+            logger.info("📤 Bot respondió al chat %s: '%s'", user_id_telegram, LazyPayload(final_response_text, 100), extra={'category': 'turn'})
+        elif pdf_action:
+            # El agente solo pidió el PDF: usamos el texto que la herramienta propone para acompañarlo.
+            await outbound_queue.reply_text(update.message, pdf_action.get('message_to_user_before_pdf') or "Aquí tienes nuestro menú:")
+        else:
+            # Si después de todo el proceso no hay respuesta, enviar un mensaje genérico.
+            await outbound_queue.reply_text(update.message, "Entendido. ¿Necesitas algo más?")
+            logger.warning(f"⚠️ El flujo del agente terminó sin una respuesta textual explícita para el usuario '{user_id_telegram}'.")
+
+    if pdf_action:
+        await menu_pdf.send_menu_pdf(update.message)
+
+message_coalescer = MessageCoalescer(process_user_text) if COALESCE_WINDOW_S > 0 else None
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Envía un mensaje cuando el comando /start es ejecutado."""
+    tenant = tenant_for_update(update)
+    if tenant is None:
+        return
     user = update.effective_user
-    await get_or_create_adk_session(user.id) # Aseguramos que la sesión se cree/recupere.
-    await update.message.reply_html(
-        f"¡Hola {user.mention_html()}! 👋 Soy Angelo, tu asistente virtual de la Pizzería San Marzano. ¿En qué puedo ayudarte hoy?"
+    with tenants.activate(tenant):
+        await get_or_create_adk_session(user.id) # Aseguramos que la sesión se cree/recupere.
+    await outbound_queue.reply_html(
+        update.message,
+        f"¡Hola {user.mention_html()}! 👋 Soy Angelo, tu asistente virtual de la {tenant.display_name}. ¿En qué puedo ayudarte hoy?"
     )
 
-def main() -> None:
-    """Inicia el bot de Telegram."""
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def availability_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /agotado <plato> y /disponible <plato> (solo ADMIN_USER_IDS): cambia la disponibilidad
+    de un ítem en caliente, sin reiniciar. /agotados lista lo que está agotado ahora.
+    """
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_USER_IDS:
+        logger.warning(f"🔒 Comando de administración rechazado para el usuario {user.id if user else '?'}.")
+        return
+    tenant = tenant_for_update(update)
+    if tenant is None:
+        return
+    with tenants.activate(tenant): # Cada pizzería tiene su propio menú en memoria.
+        await _availability_command(update, context, user)
+
+async def _availability_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user) -> None:
+    command = update.message.text.split()[0].lstrip('/').split('@')[0].lower()
+    if command == "agotados":
+        unavailable = menu_cache.get_unavailable_items()
+        lines = [f"• {item.name} ({item.item_id})" for item in unavailable]
+        await outbound_queue.reply_text(update.message, ("Agotados ahora:\n" + "\n".join(lines)) if lines else "No hay nada agotado. 👌")
+        return
+    reference = " ".join(context.args or []).strip()
+    if not reference:
+        await outbound_queue.reply_text(update.message, f"Uso: /{command} <ID, nombre o alias del plato>")
+        return
+    try:
+        item = menu_cache.set_item_availability(reference, available=(command == "disponible"))
+    except KeyError:
+        await outbound_queue.reply_text(update.message, f"No encontré '{reference}' en el menú. Usa el ID (p.ej. PIZ001-G), el nombre exacto o un alias.")
+        return
+    logger.info(f"🛠️ El admin {user.id} marcó '{item.name}' como {command}.")
+    await outbound_queue.reply_text(update.message, f"✅ {item.name} ({item.item_id}) ahora está: {'disponible' if command == 'disponible' else 'agotado'}.")
+
+async def post_init(application: Application) -> None:
+    """Tareas de arranque dentro del event loop del bot, antes de empezar a recibir mensajes."""
+    restore_started_at = time.perf_counter()
+    restored = await session_service_adk.restore_snapshot(SESSION_SNAPSHOT_PATH)
+    restore_seconds = time.perf_counter() - restore_started_at
+    session_service_adk.start_sweeper()
+    for tenant in tenants.all_tenants():
+        with tenants.activate(tenant):
+            menu_cache.current_cache().index # El menú de cada pizzería, cargado antes del primer mensaje.
+    config_cache.start_all() # 'Configuracion' se lee en segundo plano; no retrasa el arranque.
+
+    startup_seconds = time.perf_counter() - _PROCESS_STARTED_AT
+    STARTUP_SECONDS.set(startup_seconds)
+    logger.info(f"⏱️ Arranque listo en {startup_seconds:.2f}s. Sesiones restauradas del snapshot: {restored} en {restore_seconds:.3f}s.")
+
+async def post_stop(application: Application) -> None:
+    """Vacía la cola de envíos con el bot ya detenido pero aún inicializado (antes de Application.shutdown())."""
+    await outbound_queue.OUTBOX.drain()
+
+async def post_shutdown(application: Application) -> None:
+    """Apagado ordenado: guarda los datos pendientes y las sesiones activas para el siguiente arranque."""
+    await persistence.close_backend() # Incluye esperar a que la copia a Sheets se ponga al día.
+    await complaints_queue.close_all()
+    config_cache.stop_all()
+    session_service_adk.stop_sweeper()
+    snapshot_started_at = time.perf_counter()
+    saved = await session_service_adk.write_snapshot(SESSION_SNAPSHOT_PATH)
+    logger.info(f"💾 Snapshot de {saved} sesiones escrito en '{SESSION_SNAPSHOT_PATH}' en {time.perf_counter() - snapshot_started_at:.3f}s.")
+
+def build_application(token: str, with_lifecycle_hooks: bool = True) -> Application:
+    """Aplicación de Telegram para un token. Los handlers resuelven la pizzería en cada update."""
+    # Las actualizaciones se procesan en paralelo para que el control de admisión decida quién espera.
+    builder = (
+        Application.builder().token(token)
+        .concurrent_updates(ADMISSION.max_concurrent + ADMISSION.max_queue)
+    )
+    if with_lifecycle_hooks:
+        # PTB llama a post_stop antes de shutdown() (que cierra el cliente HTTP del bot) y a post_shutdown después.
+        builder = builder.post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    if TELEGRAM_API_BASE_URL:
+        logger.info(f"🧪 Usando Bot API en {TELEGRAM_API_BASE_URL}")
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler(["agotado", "disponible", "agotados"], availability_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
+async def run_bots(applications: List[Application]) -> None:
+    """
+    Varios bots (uno por token) en el mismo event loop, compartiendo agentes, sesiones,
+    cola de envíos y control de admisión. Replica el ciclo de vida de run_polling.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    for application in applications:
+        await application.initialize()
+    await post_init(applications[0])
+    for application in applications:
+        await application.start()
+        await application.updater.start_polling(drop_pending_updates=True)
+    try:
+        await stop_event.wait()
+    finally:
+        for application in applications:
+            await application.updater.stop()
+            await application.stop()
+        await post_stop(applications[0]) # Antes de cerrar los bots: la cola de envíos aún puede usarlos.
+        for application in applications:
+            await application.shutdown()
+        await post_shutdown(applications[0])
+
+def main() -> None:
+    """Inicia el bot de Telegram (o los de todas las pizzerías configuradas)."""
+    tokens = tenants.bot_tokens()
+
+    if METRICS_PORT:
+        metrics.start_metrics_server(METRICS_PORT)
+
+    if len(tokens) == 1:
+        logger.info("🚀 Iniciando bot de Telegram...")
+        build_application(tokens[0]).run_polling(drop_pending_updates=True)
+        return
 
-    logger.info("🚀 Iniciando bot de Telegram...")
-    application.run_polling(drop_pending_updates=True)
+    logger.info(f"🚀 Iniciando {len(tokens)} bots de Telegram para {len(tenants.all_tenants())} pizzerías en un solo proceso...")
+    asyncio.run(run_bots([build_application(token, with_lifecycle_hooks=False) for token in tokens]))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
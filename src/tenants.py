@@ -0,0 +1,174 @@
+# ==============================================================================
+# tenants.py - VARIAS PIZZERÍAS (SUCURSALES) EN UN SOLO PROCESO
+# ==============================================================================
+"""
+Un tenant es una pizzería: su bot de Telegram, su Hoja de Cálculo, su menú, su
+información general y su espacio de sesiones ADK (app_name). Los agentes, el
+servicio de sesiones, la cola de envíos y el control de admisión son uno solo
+para todo el proceso; lo que depende de la pizzería se resuelve con el tenant
+activo del turno (una ContextVar, como el plazo del turno en turn_deadline).
+
+Sin TENANTS_CONFIG hay un único tenant 'default' con la configuración de
+siempre (TELEGRAM_BOT_TOKEN, menu.json, la hoja de sheets_client...). Con
+TENANTS_CONFIG=tenants.json:
+
+    {"tenants": [
+        {"id": "centro", "name": "Pizzería San Marzano", "bot_token_env": "TELEGRAM_BOT_TOKEN"},
+        {"id": "norte", "name": "Pizzería San Marzano - Norte", "bot_token_env": "BOT_TOKEN_NORTE",
+         "spreadsheet_url": "https://docs.google.com/spreadsheets/d/.../edit",
+         "menu_path": "tenants/norte/menu.json", "general_info": {"telefono": "..."}}
+    ]}
+
+El tenant se elige por el token del bot que recibió el mensaje; si varios tenants
+comparten token, por 'chat_ids'. El primer tenant de la lista usa las rutas
+locales de siempre; los demás guardan sus archivos (SQLite, historial, almacén
+de pedidos, file_id del PDF) en 'data_dir' (por defecto tenants/<id>/).
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+TENANTS_CONFIG = os.environ.get("TENANTS_CONFIG")
+DEFAULT_TENANT_ID = "default"
+DEFAULT_DISPLAY_NAME = "Pizzería San Marzano"
+DEFAULT_APP_NAME = "PizzeriaChatBot_Telegram_v3"
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    tenant_id: str
+    display_name: str = DEFAULT_DISPLAY_NAME
+    bot_token: Optional[str] = None
+    chat_ids: Tuple[int, ...] = () # Solo hace falta si varios tenants comparten bot.
+    app_name: str = DEFAULT_APP_NAME # Espacio de nombres de las sesiones ADK.
+    spreadsheet_url: Optional[str] = None # None = la hoja por defecto de sheets_client.
+    menu_path: Optional[str] = None
+    menu_pdf_path: Optional[str] = None
+    data_dir: Optional[str] = None # None = directorio actual (las rutas de siempre).
+    general_info: Dict[str, str] = field(default_factory=dict, compare=False)
+
+    def data_path(self, path: str) -> str:
+        """Ruta de un archivo local de este tenant (base SQLite, historial...)."""
+        if not self.data_dir:
+            return path
+        os.makedirs(self.data_dir, exist_ok=True)
+        return os.path.join(self.data_dir, os.path.basename(os.path.normpath(path)))
+
+
+_current: contextvars.ContextVar[Optional[Tenant]] = contextvars.ContextVar("pizzeria_tenant", default=None)
+_tenants: Optional[Dict[str, Tenant]] = None
+_lock = threading.RLock() # scoped() puede anidarse si una fábrica usa otro registro.
+
+
+def _tenant_from_config(entry: Dict, first: bool) -> Tenant:
+    tenant_id = str(entry['id'])
+    token = entry.get('bot_token') or os.environ.get(entry.get('bot_token_env') or '')
+    if not token:
+        logger.warning(f"⚠️ El tenant '{tenant_id}' no tiene token de bot (bot_token / bot_token_env).")
+    data_dir = entry.get('data_dir') or (None if first else os.path.join("tenants", tenant_id))
+    return Tenant(
+        tenant_id=tenant_id,
+        display_name=entry.get('name') or DEFAULT_DISPLAY_NAME,
+        bot_token=token or None,
+        chat_ids=tuple(int(chat_id) for chat_id in entry.get('chat_ids') or ()),
+        app_name=entry.get('app_name') or (DEFAULT_APP_NAME if first else f"{DEFAULT_APP_NAME}_{tenant_id}"),
+        spreadsheet_url=entry.get('spreadsheet_url'),
+        menu_path=entry.get('menu_path') or (os.path.join(data_dir, "menu.json") if data_dir else None),
+        menu_pdf_path=entry.get('menu_pdf_path'),
+        data_dir=data_dir,
+        general_info={str(k).lower(): str(v) for k, v in (entry.get('general_info') or {}).items()},
+    )
+
+
+def load_tenants(path: Optional[str] = TENANTS_CONFIG) -> Dict[str, Tenant]:
+    """Lee TENANTS_CONFIG; sin archivo, un único tenant con la configuración de siempre."""
+    if not path:
+        return {DEFAULT_TENANT_ID: Tenant(DEFAULT_TENANT_ID, bot_token=os.environ.get("TELEGRAM_BOT_TOKEN"))}
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f).get('tenants') or []
+    if not entries:
+        raise ValueError(f"'{path}' no define ningún tenant.")
+    loaded: Dict[str, Tenant] = {}
+    for position, entry in enumerate(entries):
+        tenant = _tenant_from_config(entry, first=(position == 0))
+        if tenant.tenant_id in loaded:
+            raise ValueError(f"Tenant duplicado en '{path}': '{tenant.tenant_id}'.")
+        loaded[tenant.tenant_id] = tenant
+    logger.info(f"🏪 {len(loaded)} pizzerías configuradas en '{path}': {', '.join(loaded)}.")
+    return loaded
+
+
+def all_tenants() -> List[Tenant]:
+    global _tenants
+    if _tenants is None:
+        with _lock:
+            if _tenants is None:
+                _tenants = load_tenants()
+    return list(_tenants.values())
+
+
+def get_tenant(tenant_id: str) -> Tenant:
+    all_tenants()
+    return _tenants[tenant_id]
+
+
+def current_tenant() -> Tenant:
+    """El tenant del turno en curso; fuera de un turno, el primero (el de siempre)."""
+    return _current.get() or all_tenants()[0]
+
+
+@contextlib.contextmanager
+def activate(tenant: Tenant) -> Iterator[Tenant]:
+    """Hace de 'tenant' el tenant activo dentro del bloque (y de las tareas que se creen en él)."""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def resolve(bot_token: Optional[str], chat_id: Optional[int] = None) -> Optional[Tenant]:
+    """Tenant de un mensaje: por el token del bot y, si varios lo comparten, por el chat."""
+    candidates = [tenant for tenant in all_tenants() if tenant.bot_token == bot_token]
+    return (next((tenant for tenant in candidates if chat_id in tenant.chat_ids), None)
+            or next((tenant for tenant in candidates if not tenant.chat_ids), None))
+
+
+def bot_tokens() -> List[str]:
+    """Tokens distintos, en el orden de la configuración: un bot de Telegram por token."""
+    return list(dict.fromkeys(tenant.bot_token for tenant in all_tenants() if tenant.bot_token))
+
+
+def scoped(instances: Dict[str, T], factory: Callable[[Tenant], T]) -> T:
+    """
+    La instancia de 'instances' que corresponde al tenant activo, creándola con
+    factory(tenant) la primera vez. Así cada módulo guarda sus singletons por tenant.
+    """
+    tenant = current_tenant()
+    instance = instances.get(tenant.tenant_id)
+    if instance is None:
+        with _lock:
+            instance = instances.get(tenant.tenant_id)
+            if instance is None:
+                instance = instances[tenant.tenant_id] = factory(tenant)
+    return instance
+
+
+def detached_context(tenant: Optional[Tenant] = None) -> contextvars.Context:
+    """
+    Contexto limpio con solo la pizzería (por defecto, la activa). Para tareas de fondo
+    que no deben heredar el turno que las lanzó (su plazo, sus métricas):
+        detached_context().run(loop.create_task, coro)
+    """
+    context = contextvars.Context()
+    context.run(_current.set, tenant or current_tenant())
+    return context
@@ -0,0 +1,148 @@
+# ==============================================================================
+# turn_deadline.py - PRESUPUESTO DE TIEMPO POR TURNO Y RESPUESTAS DE RESPALDO
+# ==============================================================================
+"""
+Cada turno tiene un plazo máximo (TURN_DEADLINE_S). run_turn lo abre con
+begin_deadline() y corta el runner de ADK cuando se agota; mientras tanto:
+
+- Los callbacks marcan la etapa en curso (model:<agente>, tool:<herramienta>)
+  para saber cuál provocó el corte.
+- Cada llamada al modelo recibe como timeout HTTP una parte del tiempo restante.
+- Las lecturas de Sheets (run_in_thread) reciben otra parte y fallan con
+  TurnDeadlineExceeded en vez de colgar el turno.
+
+Cuando el plazo se agota el usuario recibe una respuesta enlatada acorde a la fase.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TURN_DEADLINE_S = float(os.environ.get("TURN_DEADLINE_S", "25"))
+# Fracción del tiempo restante que puede consumir una sola etapa.
+MODEL_CALL_SHARE = float(os.environ.get("TURN_MODEL_CALL_SHARE", "0.8"))
+SHEETS_CALL_SHARE = float(os.environ.get("TURN_SHEETS_CALL_SHARE", "0.5"))
+# Tiempo que se reserva al final del turno para responder al usuario.
+REPLY_RESERVE_S = 1.0
+MIN_STAGE_TIMEOUT_S = 0.5
+
+TURN_TIMEOUTS_TOTAL = metrics.REGISTRY.counter(
+    "pizzeria_turn_timeouts_total", "Turnos o etapas cortados por el plazo del turno, por etapa.", ["stage"]
+)
+
+# Respuestas cuando se agota el plazo, según la fase en la que estaba el cliente.
+TIMEOUT_REPLIES = {
+    'A_GESTION_CLIENTE': "¡Hola! 😊 Estoy tardando un poco más de lo normal. ¿Me escribes de nuevo en un momento?",
+    'B_TOMA_ITEMS': "Perdona la demora 🙏 No alcancé a procesar tu último mensaje. ¿Me repites qué te gustaría añadir a tu pedido?",
+    'C_CONFIRMACION_PEDIDO': "Perdona la demora 🙏 Tu pedido sigue guardado. ¿Me confirmas si es correcto?",
+    'D_RECOGER_DIRECCION': "Perdona la demora 🙏 Tu pedido sigue guardado. ¿Me repites la dirección de entrega?",
+    'E_FINALIZAR_PEDIDO': "Estamos registrando tu pedido 🍕 Si en unos minutos no recibes la confirmación, escríbenos y lo revisamos.",
+}
+DEFAULT_TIMEOUT_REPLY = "Perdona la demora 🙏 Estoy tardando más de lo normal. ¿Me escribes de nuevo en un momento?"
+
+
+class TurnDeadlineExceeded(TimeoutError):
+    """Una etapa del turno no terminó dentro de su parte del plazo."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Plazo del turno agotado en la etapa '{stage}'.")
+        self.stage = stage
+
+
+class TurnDeadline:
+    """Plazo de un turno y etapa en curso (se muta en sitio, visible desde tareas hijas)."""
+    __slots__ = ("started_at", "budget_s", "expires_at", "stage")
+
+    def __init__(self, budget_s: float):
+        self.started_at = time.monotonic()
+        self.budget_s = budget_s
+        self.expires_at = self.started_at + budget_s
+        self.stage = "orchestrator"
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def share(self, fraction: float) -> float:
+        """Timeout para una etapa: una fracción de lo que queda, descontando la reserva de respuesta."""
+        usable = max(0.0, self.remaining() - REPLY_RESERVE_S)
+        return max(MIN_STAGE_TIMEOUT_S, usable * fraction)
+
+
+_current_deadline: contextvars.ContextVar[Optional[TurnDeadline]] = contextvars.ContextVar("pizzeria_turn_deadline", default=None)
+
+
+def begin_deadline(budget_s: float = TURN_DEADLINE_S) -> TurnDeadline:
+    deadline = TurnDeadline(budget_s)
+    _current_deadline.set(deadline)
+    return deadline
+
+
+def current_deadline() -> Optional[TurnDeadline]:
+    return _current_deadline.get()
+
+
+def end_deadline() -> None:
+    _current_deadline.set(None)
+
+
+def enter_stage(stage: str) -> None:
+    """Marca la etapa en curso del turno (sin efecto fuera de un turno)."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.stage = stage
+
+
+def timeout_reply(phase: Optional[str]) -> str:
+    return TIMEOUT_REPLIES.get(phase or '', DEFAULT_TIMEOUT_REPLY)
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """Timeouts propios, de asyncio, de httpx (ReadTimeout...) o de google.api_core (DeadlineExceeded)."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    name = type(error).__name__.lower()
+    return 'timeout' in name or 'deadline' in name
+
+
+def apply_model_timeout(llm_request: Any) -> None:
+    """Pone como timeout HTTP de la llamada al modelo una parte del tiempo restante del turno."""
+    deadline = _current_deadline.get()
+    if deadline is None or llm_request.config is None:
+        return
+    from google.genai import types as genai_types
+    timeout_ms = int(deadline.share(MODEL_CALL_SHARE) * 1000)
+    try:
+        llm_request.config.http_options = genai_types.HttpOptions(timeout=timeout_ms)
+    except (AttributeError, ValueError, TypeError) as e:
+        # Versiones antiguas de google-genai sin http_options por petición: queda solo el corte del turno.
+        logger.debug("No se pudo fijar el timeout del modelo: %s", e)
+
+
+async def run_in_thread(func: Callable[..., Any], *args: Any, stage: str = "sheets", share: float = SHEETS_CALL_SHARE, **kwargs: Any) -> Any:
+    """
+    asyncio.to_thread con una parte del plazo del turno como timeout.
+    Fuera de un turno se comporta igual que asyncio.to_thread. Si vence, el hilo
+    sigue en segundo plano (no se puede interrumpir), pero el turno ya no lo espera.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    previous_stage = deadline.stage
+    deadline.stage = stage
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=deadline.share(share))
+    except asyncio.TimeoutError:
+        TURN_TIMEOUTS_TOTAL.inc(stage=stage)
+        logger.warning(f"⏱️ La etapa '{stage}' superó su parte del plazo del turno.")
+        raise TurnDeadlineExceeded(stage) from None
+    finally:
+        deadline.stage = previous_stage
@@ -0,0 +1,211 @@
+# ==============================================================================
+# turn_processing.py - BUCLE DE TURNO ADK COMPARTIDO (TELEGRAM, BENCHMARKS)
+# ==============================================================================
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from google.adk.runners import Runner
+from google.genai import types as genai_types
+
+import customer_prefetch
+import metrics
+import turn_deadline
+import usage_accounting
+from logging_setup import LazyPayload
+
+logger = logging.getLogger(__name__)
+
+INITIAL_PHASE = 'A_GESTION_CLIENTE'
+MAX_LOOPS_PER_TURN = 5 # Para evitar bucles infinitos en caso de un bug de estado.
+ERROR_REPLY = "Lo siento, ocurrió un error interno. Por favor, intenta de nuevo."
+
+TextCallback = Callable[[str], Awaitable[None]]
+
+
+@dataclass
+class TurnResult:
+    """Resultado de un turno completo del orquestador."""
+    text: Optional[str]
+    outcome: str # 'ok' | 'error' | 'empty' | 'timeout'
+    phase_before: Optional[str]
+    loops: int
+    stats: metrics.TurnStats
+    timeout_stage: Optional[str] = None
+    # Respuestas de herramientas con 'action_request' (p.ej. SEND_PDF_MENU_TO_USER) para la capa de Telegram.
+    actions: List[Dict[str, Any]] = field(default_factory=list)
+
+
+async def ensure_session(session_service: Any, app_name: str, user_id: Any) -> Tuple[str, str]:
+    """Obtiene o crea la sesión ADK de un usuario. Devuelve (user_id, session_id)."""
+    user_id_adk = str(user_id)
+    session_id_adk = str(user_id) # Usamos el mismo ID para simplicidad
+
+    current_session = await session_service.get_session(
+        app_name=app_name, user_id=user_id_adk, session_id=session_id_adk
+    )
+    if current_session is None:
+        logger.info(f"No se encontró sesión para user {user_id_adk}. Creando una nueva...")
+        initial_state = {
+            '_session_user_id': user_id_adk,
+            'processing_order_sub_phase': INITIAL_PHASE,
+        }
+        await session_service.create_session(
+            app_name=app_name, user_id=user_id_adk, session_id=session_id_adk, state=initial_state
+        )
+        logger.info("Nueva sesión ADK creada para user %s. Estado inicial: %s", user_id_adk, LazyPayload(initial_state), extra={'category': 'session'})
+        # Leemos al cliente en segundo plano mientras el usuario escribe su primer mensaje.
+        customer_prefetch.schedule_prefetch(user_id_adk)
+    else:
+        # Aseguramos que el estado y la fase inicial existan
+        if not current_session.state:
+            current_session.state = {}
+        if 'processing_order_sub_phase' not in current_session.state:
+            current_session.state['processing_order_sub_phase'] = INITIAL_PHASE
+        current_session.state['_session_user_id'] = user_id_adk
+        if (current_session.state.get('processing_order_sub_phase') == INITIAL_PHASE
+                and not current_session.state.get('_customer_status')):
+            customer_prefetch.schedule_prefetch(user_id_adk)
+        logger.info(
+            "Sesión ADK existente recuperada para user %s (fase: %s).",
+            user_id_adk, current_session.state.get('processing_order_sub_phase'), extra={'category': 'session'}
+        )
+        logger.debug("Estado actual de la sesión %s: %s", user_id_adk, LazyPayload(current_session.state))
+
+    return user_id_adk, session_id_adk
+
+
+async def run_turn(runner: Runner, user_id: str, session_id: str, user_message_text: str,
+                   max_loops: int = MAX_LOOPS_PER_TURN, deadline_s: float = turn_deadline.TURN_DEADLINE_S,
+                   turn_stats: Optional[metrics.TurnStats] = None, on_text: Optional[TextCallback] = None,
+                   on_partial: Optional[TextCallback] = None, run_config: Optional[Any] = None) -> TurnResult:
+    """
+    Ejecuta un turno de conversación con una lógica de bucle para procesar
+    transiciones de estado silenciosas dentro de un mismo turno.
+    El turno completo tiene un plazo máximo (deadline_s); si se agota, se corta el
+    runner y se devuelve una respuesta enlatada acorde a la fase del cliente.
+    Si se pasa on_text, cada texto final para el usuario (también los mensajes de
+    transición) se entrega en cuanto aparece; on_partial recibe el texto parcial
+    acumulado cuando el runner corre en modo streaming (run_config SSE).
+    """
+    turn_stats = metrics.begin_turn(turn_stats)
+    deadline = turn_deadline.begin_deadline(deadline_s)
+    result = TurnResult(text=None, outcome="ok", phase_before=None, loops=0, stats=turn_stats)
+
+    try:
+        await asyncio.wait_for(
+            _run_cycles(runner, user_id, session_id, user_message_text, max_loops, result, deadline,
+                        on_text, on_partial, run_config),
+            timeout=deadline.remaining(),
+        )
+    except asyncio.TimeoutError:
+        _mark_timeout(result, deadline.stage)
+        session = await runner.session_service.get_session(app_name=runner.app_name, user_id=user_id, session_id=session_id)
+        phase_now = session.state.get('processing_order_sub_phase') if session else result.phase_before
+        result.text = turn_deadline.timeout_reply(phase_now)
+    finally:
+        turn_deadline.end_deadline()
+
+    if not result.text:
+        result.outcome = "empty"
+
+    usage_accounting.log_turn_summary(turn_stats, user_id)
+    metrics.end_turn(turn_stats, result.phase_before, result.outcome)
+    return result
+
+
+def _mark_timeout(result: TurnResult, stage: str) -> None:
+    result.outcome = "timeout"
+    result.timeout_stage = stage
+    turn_deadline.TURN_TIMEOUTS_TOTAL.inc(stage=stage)
+    logger.warning(f"⏱️ Plazo del turno agotado en la etapa '{stage}' (ciclo #{result.loops}).")
+
+
+async def _run_cycles(runner: Runner, user_id: str, session_id: str, user_message_text: str, max_loops: int,
+                      result: TurnResult, deadline: turn_deadline.TurnDeadline, on_text: Optional[TextCallback] = None,
+                      on_partial: Optional[TextCallback] = None, run_config: Optional[Any] = None) -> None:
+    """Bucle de ciclos del runner. Escribe el progreso en result para que sobreviva a un corte por plazo."""
+    session_service = runner.session_service
+    app_name = runner.app_name
+
+    # Si hay una precarga del cliente en curso, la aplicamos antes de que actúe la fase A.
+    await customer_prefetch.apply_prefetch(session_service, app_name, user_id, session_id)
+
+    # Preparamos el mensaje inicial del usuario para la primera iteración del bucle.
+    adk_message_to_process = genai_types.Content(parts=[genai_types.Part(text=user_message_text)], role="user")
+
+    while result.loops < max_loops:
+        result.loops += 1
+        current_loop = result.loops
+        logger.info("🔄 Iniciando ciclo de procesamiento ADK #%d para el turno.", current_loop, extra={'category': 'turn'})
+
+        # Obtener el estado de la fase ANTES de ejecutar el runner.
+        session_before = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        phase_before = session_before.state.get('processing_order_sub_phase')
+        if result.phase_before is None:
+            result.phase_before = phase_before
+
+        text_response_from_turn = ""
+
+        try:
+            # Ejecutar el runner de ADK. En la primera vuelta, usa el mensaje del usuario.
+            # En las siguientes, será None, permitiendo que el agente en la nueva fase actúe.
+            run_kwargs = {'run_config': run_config} if run_config is not None else {}
+            events_stream = runner.run_async(
+                user_id=user_id, session_id=session_id, new_message=adk_message_to_process, **run_kwargs
+            )
+
+            partial_text = ""
+            async for event in events_stream:
+                if event.partial:
+                    if on_partial and event.content and event.content.parts and event.content.parts[0].text:
+                        partial_text += event.content.parts[0].text
+                        await on_partial(partial_text)
+                    continue
+                for function_response in event.get_function_responses():
+                    response = function_response.response or {}
+                    if response.get('action_request'):
+                        result.actions.append(response)
+                if event.is_final_response() and event.content and event.content.parts:
+                    if event.content.parts[0].text:
+                        text_response_from_turn = event.content.parts[0].text.strip()
+                        partial_text = ""
+                        logger.info("✅ Texto de respuesta final detectado en ciclo #%d: '%s'", current_loop, LazyPayload(text_response_from_turn, 100), extra={'category': 'turn'})
+                        if on_text and text_response_from_turn:
+                            await on_text(text_response_from_turn)
+
+            # Después del primer ciclo, las siguientes iteraciones se basan en el estado, no en un nuevo mensaje.
+            adk_message_to_process = None
+
+            # Obtener el estado de la fase DESPUÉS de ejecutar el runner.
+            session_after = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            phase_after = session_after.state.get('processing_order_sub_phase')
+
+            # Si se obtuvo una respuesta textual, la guardamos y salimos del bucle.
+            if text_response_from_turn:
+                result.text = text_response_from_turn
+                logger.info("El ciclo generó una respuesta de texto. Finalizando bucle de turno.")
+                break
+
+            # Si no hubo respuesta de texto, PERO la fase cambió, significa que hubo una transición silenciosa.
+            # Continuamos el bucle para permitir que el nuevo agente actúe.
+            elif phase_before != phase_after:
+                logger.info(f"Transición de fase silenciosa detectada de '{phase_before}' a '{phase_after}'. Continuando ciclo...")
+                continue
+
+            # Si no hubo respuesta y la fase no cambió, el turno realmente terminó. Salimos.
+            else:
+                logger.warning("El ciclo terminó sin respuesta de texto y sin cambio de fase. Finalizando bucle de turno.")
+                break
+
+        except Exception as e:
+            if turn_deadline.is_timeout_error(e):
+                # Timeout de una etapa (modelo o Sheets) que llegó hasta aquí sin ser manejado.
+                _mark_timeout(result, getattr(e, 'stage', None) or deadline.stage)
+                result.text = turn_deadline.timeout_reply(phase_before)
+                break
+            logger.error(f"❌ Error excepcional durante el ciclo de procesamiento ADK: {e}", exc_info=True)
+            result.text = ERROR_REPLY
+            result.outcome = "error"
+            break
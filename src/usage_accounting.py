@@ -0,0 +1,226 @@
+# ==============================================================================
+# usage_accounting.py - CONTABILIDAD DE TOKENS Y TAMAÑO DE PROMPT POR AGENTE/TURNO
+# ==============================================================================
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# Precios en USD por millón de tokens. Se pueden sobrescribir con MODEL_PRICING
+# (JSON: {"modelo": {"input": 0.1, "output": 0.4}}). '*' es el precio por defecto.
+DEFAULT_MODEL_PRICING: Dict[str, Dict[str, float]] = {
+    "*": {"input": 0.10, "output": 0.40},
+}
+
+
+def _load_pricing() -> Dict[str, Dict[str, float]]:
+    pricing = dict(DEFAULT_MODEL_PRICING)
+    raw = os.environ.get("MODEL_PRICING")
+    if raw:
+        try:
+            pricing.update(json.loads(raw))
+        except json.JSONDecodeError:
+            logger.warning("MODEL_PRICING no es un JSON válido. Se usan los precios por defecto.")
+    return pricing
+
+
+MODEL_PRICING = _load_pricing()
+# El costo acumulado de una sesión que no llega a pedir se descarta tras este tiempo sin llamadas.
+SESSION_COST_TTL_S = float(os.environ.get("USAGE_SESSION_COST_TTL_S", "1800"))
+
+SessionKey = Tuple[str, str] # (app_name, user_id): el mismo usuario en dos pizzerías son dos sesiones.
+
+PROMPT_CHARS = metrics.REGISTRY.histogram(
+    "pizzeria_model_prompt_chars", "Caracteres enviados al modelo por llamada.", ["agent"],
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+TOKENS_TOTAL = metrics.REGISTRY.counter("pizzeria_model_tokens_total", "Tokens consumidos por agente y tipo.", ["agent", "kind"])
+MODEL_COST_TOTAL = metrics.REGISTRY.counter("pizzeria_model_cost_usd_total", "Costo estimado del modelo por agente (USD).", ["agent"])
+TIME_TO_FIRST_RESPONSE = metrics.REGISTRY.histogram(
+    "pizzeria_model_time_to_first_response_seconds", "Tiempo hasta la primera respuesta del modelo por agente.", ["agent"]
+)
+ORDER_MODEL_COST = metrics.REGISTRY.histogram(
+    "pizzeria_order_model_cost_usd", "Costo acumulado del modelo por pedido completado (USD).",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+def _new_usage() -> Dict[str, float]:
+    return {"calls": 0, "prompt_chars": 0, "prompt_tokens": 0, "response_tokens": 0, "cost_usd": 0.0, "model_seconds": 0.0}
+
+
+def _add_usage(target: Dict[str, float], delta: Dict[str, float]) -> None:
+    for key, value in delta.items():
+        target[key] = target.get(key, 0) + value
+
+
+class UsageLedger:
+    """Acumulados por agente, por sesión (hasta el siguiente pedido) y por pedido completado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_agent: Dict[str, Dict[str, float]] = {}
+        self._pending_calls: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._session_cost: Dict[SessionKey, Tuple[float, float]] = {} # clave -> (costo, última llamada)
+        self._session_cost_pruned_at = time.monotonic()
+        self._orders = {"count": 0, "cost_usd": 0.0}
+
+    # --- Llamadas al modelo ---
+    def begin_call(self, call_key: Tuple[str, str], model: str, prompt_chars: int) -> None:
+        if len(self._pending_calls) > 1000:
+            # Llamadas que fallaron nunca reciben after_model_callback; evitamos que se acumulen.
+            self._pending_calls.clear()
+        self._pending_calls[call_key] = {"started_at": time.perf_counter(), "model": model, "prompt_chars": prompt_chars, "first_at": None}
+
+    def end_call(self, call_key: Tuple[str, str], agent_name: str, session_key: Optional[SessionKey], usage_metadata: Any, partial: bool) -> None:
+        pending = self._pending_calls.get(call_key)
+        if pending is None:
+            return
+        now = time.perf_counter()
+        if pending["first_at"] is None:
+            pending["first_at"] = now
+            TIME_TO_FIRST_RESPONSE.observe(now - pending["started_at"], agent=agent_name)
+        if partial:
+            return
+        del self._pending_calls[call_key]
+
+        prompt_tokens = getattr(usage_metadata, 'prompt_token_count', None) or 0
+        response_tokens = getattr(usage_metadata, 'candidates_token_count', None) or 0
+        price = MODEL_PRICING.get(pending["model"], MODEL_PRICING["*"])
+        cost = (prompt_tokens * price.get("input", 0.0) + response_tokens * price.get("output", 0.0)) / 1_000_000
+        delta = {
+            "calls": 1,
+            "prompt_chars": pending["prompt_chars"],
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "cost_usd": cost,
+            "model_seconds": now - pending["started_at"],
+        }
+
+        PROMPT_CHARS.observe(pending["prompt_chars"], agent=agent_name)
+        TOKENS_TOTAL.inc(prompt_tokens, agent=agent_name, kind="prompt")
+        TOKENS_TOTAL.inc(response_tokens, agent=agent_name, kind="response")
+        MODEL_COST_TOTAL.inc(cost, agent=agent_name)
+
+        with self._lock:
+            _add_usage(self._by_agent.setdefault(agent_name, _new_usage()), delta)
+            if session_key:
+                previous_cost, _ = self._session_cost.get(session_key, (0.0, 0.0))
+                self._session_cost[session_key] = (previous_cost + cost, time.monotonic())
+                self._prune_session_costs()
+
+        turn = metrics.current_turn()
+        if turn is not None:
+            _add_usage(turn.usage.setdefault(agent_name, _new_usage()), delta)
+
+    def _prune_session_costs(self) -> None:
+        """Descarta (como mucho una vez por minuto) las sesiones sin llamadas en SESSION_COST_TTL_S. Con el lock tomado."""
+        now = time.monotonic()
+        if now - self._session_cost_pruned_at < 60:
+            return
+        self._session_cost_pruned_at = now
+        expired = [key for key, (_, last_at) in self._session_cost.items() if now - last_at > SESSION_COST_TTL_S]
+        for key in expired:
+            del self._session_cost[key]
+
+    # --- Pedidos ---
+    def complete_order(self, session_key: Optional[SessionKey]) -> float:
+        """Cierra el costo acumulado de la sesión como costo del pedido recién registrado."""
+        with self._lock:
+            cost, _ = self._session_cost.pop(session_key, (0.0, 0.0))
+            self._orders["count"] += 1
+            self._orders["cost_usd"] += cost
+        ORDER_MODEL_COST.observe(cost)
+        return cost
+
+    # --- Informes ---
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            agents = {name: dict(usage) for name, usage in self._by_agent.items()}
+            orders = dict(self._orders)
+        for usage in agents.values():
+            usage["avg_prompt_chars"] = usage["prompt_chars"] / usage["calls"] if usage["calls"] else 0
+        orders["avg_cost_usd"] = orders["cost_usd"] / orders["count"] if orders["count"] else 0.0
+        return {"agents": agents, "orders": orders}
+
+
+LEDGER = UsageLedger()
+
+
+def _prompt_chars(llm_request: Any) -> int:
+    """Cuenta los caracteres de texto del prompt (instrucción de sistema + historial)."""
+    total = 0
+    config = getattr(llm_request, 'config', None)
+    system_instruction = getattr(config, 'system_instruction', None) if config else None
+    if isinstance(system_instruction, str):
+        total += len(system_instruction)
+    elif system_instruction is not None:
+        total += sum(len(part.text or '') for part in getattr(system_instruction, 'parts', None) or [])
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                total += len(part.text)
+    return total
+
+
+def _call_key(callback_context: Any) -> Tuple[str, str]:
+    return (callback_context.invocation_id, callback_context.agent_name)
+
+
+def _session_key(user_id: Optional[str]) -> Optional[SessionKey]:
+    return (tenants.current_tenant().app_name, str(user_id)) if user_id else None
+
+
+def record_model_request(callback_context: Any, llm_request: Any) -> None:
+    """Se llama desde before_model_callback."""
+    LEDGER.begin_call(_call_key(callback_context), llm_request.model or "*", _prompt_chars(llm_request))
+
+
+def record_model_response(callback_context: Any, llm_response: Any) -> None:
+    """Se llama desde after_model_callback (una vez por respuesta; varias si hay streaming parcial)."""
+    LEDGER.end_call(
+        _call_key(callback_context),
+        callback_context.agent_name,
+        _session_key(callback_context.state.get('_session_user_id')),
+        llm_response.usage_metadata,
+        bool(llm_response.partial),
+    )
+
+
+def record_order_completed(user_id: Optional[str], order_id: Optional[str] = None) -> None:
+    cost = LEDGER.complete_order(_session_key(user_id))
+    logger.info("[Usage] Pedido %s de %s completado. Costo de modelo acumulado: $%.5f", order_id or '?', user_id, cost)
+
+
+def get_usage_report() -> Dict[str, Any]:
+    """Resumen acumulado por agente y por pedido desde el arranque del proceso."""
+    return LEDGER.report()
+
+
+def log_turn_summary(turn: metrics.TurnStats, user_id: Any) -> None:
+    """Una línea de resumen al final del turno: llamadas, tokens y costo por agente."""
+    if not turn.usage:
+        return
+    totals = _new_usage()
+    for usage in turn.usage.values():
+        _add_usage(totals, usage)
+    per_agent = ", ".join(
+        f"{agent}={int(usage['calls'])}x/{int(usage['prompt_tokens'])}+{int(usage['response_tokens'])}tok"
+        for agent, usage in turn.usage.items()
+    )
+    logger.info(
+        "[Usage] Turno de %s: %d llamadas, %d chars de prompt, %d+%d tokens, $%.5f en %.2fs | %s",
+        user_id, totals["calls"], totals["prompt_chars"], totals["prompt_tokens"], totals["response_tokens"],
+        totals["cost_usd"], turn.elapsed(), per_agent,
+        extra={'category': 'usage'},
+    )
+
+
+metrics.register_json_endpoint('/usage', get_usage_report)